@@ -5,30 +5,113 @@
 import os
 import copy
 import functools
+import hashlib
 import json
+import logging
+import pickle
 import collections.abc
+import threading
+import datetime
+from collections import OrderedDict
 from contextlib import contextmanager
-from typing import Optional, Callable, Union
+from typing import Dict, Iterable, List, NamedTuple, Optional, Callable, Union
 
-import dateparser
-from deepdiff import DeepSearch
 import jsonschema
 from jsonschema.exceptions import ValidationError, RefResolutionError
 from jsonpointer import resolve_pointer
 
+from . import __version__
 from .constants import SCHEMA_DIR, METASCHEMA_PATH
 from .util import JSON
 
+logger = logging.getLogger("cidc_schemas.json_validation")
+
 
 class InDocRefNotFoundError(ValidationError):
     pass
 
 
-def _in_doc_refs_check(validator, schema_prop_value, ref_value, subschema):
-    """A "dummy" validator, that just produces errors for every occurrence of `in_doc_ref_pattern`"""
-    yield InDocRefNotFoundError(
-        f"Ref {schema_prop_value.split('/')[-1]}: {ref_value!r} not found within {schema_prop_value!r}"
-    )
+def _in_doc_refs_check(validator, ref_path_pattern, instance, schema):
+    """
+    Check that `instance` is one of the values found in the document being
+    validated at `ref_path_pattern`. This runs as a regular keyword validator,
+    so referential integrity is checked in the same pass as everything else.
+    """
+    if validator._ignore_in_doc_refs:
+        return
+
+    # If the in_doc_refs cache is None at this point in the code,
+    # we know that it wasn't initialized properly - this generally means
+    # some client code called `iter_errors` directly, which isn't allowed.
+    if validator._in_doc_refs_cache is None:
+        raise AssertionError(
+            "_Validator.iter_errors cannot be called directly. Please call _Validator.safe_iter_errors instead."
+        )
+
+    if repr(instance) not in validator._in_doc_refs_cache[ref_path_pattern]:
+        yield InDocRefNotFoundError(
+            f"Ref {ref_path_pattern.split('/')[-1]}: {instance!r} not found within {ref_path_pattern!r}"
+        )
+
+
+def _exhaustive(check):
+    """
+    Wrap a keyword validator whose outcome depends on whether subschemas match
+    (e.g., `anyOf`), so that unchanged subtrees are never skipped beneath it.
+    """
+
+    def exhaustive_check(validator, value, instance, schema):
+        validator._exhaustive_depth += 1
+        try:
+            return list(check(validator, value, instance, schema) or ())
+        finally:
+            validator._exhaustive_depth -= 1
+
+    return exhaustive_check
+
+
+def _find_changed_nodes(instance: JSON, previous: JSON) -> dict:
+    """
+    Build a mapping from `id`s to nodes for every node in `instance` that isn't the very
+    same object found at the same path in `previous`. Mergers share unmodified subtrees
+    of the merge base with the merge result, so for a merge result this only walks the
+    parts of the document touched by the merge.
+    """
+    missing = object()
+    changed = {}
+    nodes = [(instance, previous)]
+    while nodes:
+        node, prev = nodes.pop()
+        if node is prev:
+            continue
+        changed[id(node)] = node
+        if isinstance(node, dict):
+            if not isinstance(prev, dict):
+                prev = {}
+            nodes.extend((v, prev.get(k, missing)) for k, v in node.items())
+        elif isinstance(node, list):
+            if not isinstance(prev, list):
+                prev = []
+            nodes.extend(
+                (v, prev[i] if i < len(prev) else missing) for i, v in enumerate(node)
+            )
+    return changed
+
+
+def _find_in_doc_ref_patterns(schema: JSON) -> set:
+    """Collect every `in_doc_ref_pattern` value used anywhere in `schema`."""
+    patterns = set()
+    nodes = [schema]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, dict):
+            pattern = node.get("in_doc_ref_pattern")
+            if isinstance(pattern, str):
+                patterns.add(pattern)
+            nodes.extend(node.values())
+        elif isinstance(node, list):
+            nodes.extend(node)
+    return patterns
 
 
 class _Validator(jsonschema.Draft7Validator):
@@ -71,28 +154,49 @@ class _Validator(jsonschema.Draft7Validator):
         }
 
 
-    It achieves that by first checking everything with regular Draft7Validator,
-    and then collecting all refs and checking existence of a corresponding value.
+    It achieves that by collecting all `in_doc_ref_pattern`s used in the schema
+    once, at construction. Before each validation, the values the document holds
+    at those patterns are collected, and then `in_doc_ref_pattern` is checked
+    like any other keyword during the regular Draft7Validator traversal.
+
+    If a valid `previous` document is provided to `safe_iter_errors`, the traversal
+    doesn't descend into subtrees the instance shares with `previous`, since those
+    were already validated. This gives the same errors as a full validation while
+    only doing work proportional to what changed, e.g., during a merge.
 
     """
 
     with open(METASCHEMA_PATH) as metaschema_file:
         META_SCHEMA = json.load(metaschema_file)
 
+    VALIDATORS = dict(
+        jsonschema.Draft7Validator.VALIDATORS,
+        in_doc_ref_pattern=_in_doc_refs_check,
+        **{
+            keyword: _exhaustive(jsonschema.Draft7Validator.VALIDATORS[keyword])
+            for keyword in ["anyOf", "oneOf", "not", "if", "contains", "dependencies"]
+        },
+    )
+
     def __init__(self, *args, **kwargs):
 
         super().__init__(*args, **kwargs)
 
         self._in_doc_refs_cache = None
         self._ignore_in_doc_refs = False
+        self._changed_nodes = None
+        self._exhaustive_depth = 0
 
         # TODO consider adding json pointer check to metaschema for in_doc_ref_pattern values
-        self.in_doc_ref_validator = jsonschema.validators.create(
-            self.META_SCHEMA, validators={"in_doc_ref_pattern": _in_doc_refs_check}
-        )(*args, **kwargs)
+        self._in_doc_ref_patterns = _find_in_doc_ref_patterns(self.schema)
 
     @contextmanager
-    def _validation_context(self, instance: JSON, ignore_in_doc_refs: bool = False):
+    def _validation_context(
+        self,
+        instance: JSON,
+        ignore_in_doc_refs: bool = False,
+        previous: Optional[JSON] = None,
+    ):
         """
         A context manager for building up and tearing down configuration for
         a running our custom validator on a given instance.
@@ -102,25 +206,31 @@ class _Validator(jsonschema.Draft7Validator):
 
         # Build the in_doc_refs_cache if we're not ignoring in_doc_refs
         if not ignore_in_doc_refs:
-            search = DeepSearch(self.schema, "in_doc_ref_pattern")
-            if "matched_paths" in search:
-                for path in search["matched_paths"]:
-                    scope = {"root": self.schema}
-                    exec(f"ref_path_pattern = {path}", scope)
-                    ref_path_pattern = scope["ref_path_pattern"]
-                    # If there are no cached values for this ref path pattern, collect them
-                    if ref_path_pattern not in self._in_doc_refs_cache:
-                        self._in_doc_refs_cache[
-                            ref_path_pattern
-                        ] = self._get_values_for_path_pattern(
-                            ref_path_pattern, instance
-                        )
+            for ref_path_pattern in self._in_doc_ref_patterns:
+                self._in_doc_refs_cache[
+                    ref_path_pattern
+                ] = self._get_values_for_path_pattern(ref_path_pattern, instance)
+
+        if previous is not None:
+            self._changed_nodes = _find_changed_nodes(instance, previous)
+            # If a value was dropped from the targets of an in-doc ref, refs to it
+            # anywhere in the document might have become invalid, so check everything.
+            if not ignore_in_doc_refs and any(
+                not self._get_values_for_path_pattern(pattern, previous).issubset(
+                    self._in_doc_refs_cache[pattern]
+                )
+                for pattern in self._in_doc_ref_patterns
+            ):
+                self._changed_nodes = None
 
         # see: https://docs.python.org/3/library/contextlib.html
         try:
             yield
         finally:
             self._in_doc_refs_cache = None
+            self._changed_nodes = None
+            # restore to default value
+            self._ignore_in_doc_refs = False
 
     def validate(
         self, instance: JSON, *args, ignore_in_doc_refs: bool = False, **kwargs
@@ -128,72 +238,47 @@ class _Validator(jsonschema.Draft7Validator):
         with self._validation_context(instance, ignore_in_doc_refs):
             super().validate(instance, *args, **kwargs)
 
-    def iter_errors(self, instance: JSON, _schema: Optional[dict] = None):
+    def safe_iter_errors(
+        self,
+        instance: JSON,
+        _schema: Optional[dict] = None,
+        ignore_in_doc_refs: bool = False,
+        previous: Optional[JSON] = None,
+    ):
         """
-        NOTE: do not call this directly! Doing so will break the in_doc_refs validation!
+        A generator producing validation errors for the given JSON instance.
 
-        This is the main validation method. `.is_valid`, `.validate` are based on this.
-
-        It will be called recursively, while `.descend`ing instance and schema.
+        If provided, `previous` must be a valid document that `instance` was derived
+        from without modifying it in place (e.g., the base of a merge). Subtrees of
+        `instance` that are shared with `previous` won't be validated again.
         """
-        # First we call usual Draft7Validator validation
-        for downstream_error in super().iter_errors(instance, _schema):
-            # and if an error is not "ours" - just propagate it up
-            if not isinstance(downstream_error, InDocRefNotFoundError):
-                yield downstream_error
-            # if it is "ours" - we actually check ref
-            elif (
-                repr(downstream_error.instance)
-                not in self._in_doc_refs_cache[downstream_error.validator_value]
-            ):
-                # and if the check was not passed - we propagate it
-                yield downstream_error
-
-        # Don't perform referential integrity checks if _ignore_in_doc_refs = True
-        if self._ignore_in_doc_refs:
-            return
+        with self._validation_context(instance, ignore_in_doc_refs, previous):
+            for error in self.iter_errors(instance, _schema):
+                yield error
 
-        # Here we actually call our custom validator, that will throw errors
-        # on every occurrence of `in_doc_ref_pattern` constraint
-        for in_doc_ref_not_found in self.in_doc_ref_validator.iter_errors(
-            instance, _schema
+    def descend(self, instance, schema, path=None, schema_path=None):
+        # Skip unchanged subtrees, unless we're evaluating a subschema whose
+        # outcome might differ from what it was for the previous document
+        if (
+            path is not None
+            and self._changed_nodes is not None
+            and not self._exhaustive_depth
+            and id(instance) not in self._changed_nodes
         ):
-            # If the in_doc_refs cache is None at this point in the code,
-            # we know that it wasn't initialized properly - this generally means
-            # some client code called `self.iter_errors` directly, which
-            # isn't allowed.
-            if self._in_doc_refs_cache is None:
-                raise AssertionError(
-                    "_Validator.iter_errors cannot be called directly. Please call _Validator.safe_iter_errors instead."
-                )
-
-            # but then we actually check refs
-            if (
-                repr(in_doc_ref_not_found.instance)
-                not in self._in_doc_refs_cache[in_doc_ref_not_found.validator_value]
-            ):
-                # and produce errors only when check wont pass
-                yield in_doc_ref_not_found
+            return iter(())
+        return super().descend(instance, schema, path, schema_path)
 
-    def safe_iter_errors(
+    def iter_error_messages(
         self,
         instance: JSON,
         _schema: Optional[dict] = None,
-        ignore_in_doc_refs: bool = False,
+        previous: Optional[JSON] = None,
     ):
-        """A generator producing validation errors for the given JSON instance."""
-        with self._validation_context(instance, ignore_in_doc_refs):
-            for error in self.iter_errors(instance, _schema):
-                yield error
-            # restore to default value
-            self._ignore_in_doc_refs = False
-
-    def iter_error_messages(self, instance: JSON, _schema: Optional[dict] = None):
         """
         A wrapper for `_Validator.iter_errors` that generates friendlier, shorter error
         messages representing `ValidationError`s.
         """
-        for error in self.safe_iter_errors(instance, _schema):
+        for error in self.safe_iter_errors(instance, _schema, previous=previous):
             yield format_validation_error(error)
 
     def _get_values_for_path_pattern(self, path: str, doc: dict) -> set:
@@ -232,6 +317,99 @@ class _Validator(jsonschema.Draft7Validator):
         return set(repr(val) for val in values)
 
 
+class _SchemaDict(dict):
+    """
+    A read-only, interned schema mapping, shared between every schema that contains it.
+    Copying it (e.g., with `dict(...)`, `copy.copy` or `copy.deepcopy`) or unpickling it
+    produces a plain, mutable `dict`.
+    """
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("interned schemas are read-only; copy them to make changes")
+
+    __setitem__ = __delitem__ = __ior__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class _SchemaList(list):
+    """A read-only, interned schema list. See `_SchemaDict`."""
+
+    _read_only = _SchemaDict._read_only
+
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+    append = clear = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+_intern_schemas = False
+
+# Maps the structure of each interned schema node to the node itself. Child nodes are
+# interned first, so a node's structure can refer to its children by `id`.
+_interned_schema_nodes: Dict[tuple, Union[_SchemaDict, _SchemaList]] = {}
+
+
+def set_schema_interning(enabled: bool):
+    """
+    Choose whether schemas loaded from now on share identical subschemas (e.g., every
+    `$ref` to "sample.json"), rather than each holding its own copy. Shared subschemas
+    are read-only, so this should only be enabled by applications that don't modify
+    loaded schemas, before they load any schemas or templates.
+    """
+    global _intern_schemas
+    _intern_schemas = enabled
+    if not enabled:
+        _interned_schema_nodes.clear()
+    schema_registry.clear()
+
+
+def _intern_key(value):
+    if isinstance(value, (dict, list)):
+        return id(value)
+    # e.g., so that `True` and `1` aren't conflated
+    return type(value), value
+
+
+def _intern_schema(node):
+    """Return the shared, read-only copy of `node`, interning all its subschemas."""
+    if isinstance(node, (_SchemaDict, _SchemaList)):
+        return node
+
+    if isinstance(node, dict):
+        children = [(k, _intern_schema(v)) for k, v in node.items()]
+        key = (dict,) + tuple((k, _intern_key(v)) for k, v in children)
+        node_type = _SchemaDict
+    elif isinstance(node, list):
+        children = [_intern_schema(v) for v in node]
+        key = (list,) + tuple(_intern_key(v) for v in children)
+        node_type = _SchemaList
+    else:
+        return node
+
+    interned = _interned_schema_nodes.get(key)
+    if interned is None:
+        interned = _interned_schema_nodes.setdefault(key, node_type(children))
+    return interned
+
+
+def _intern_if_enabled(schema):
+    """Intern `schema` if `set_schema_interning` is enabled."""
+    if _intern_schemas:
+        return _intern_schema(schema)
+    return schema
+
+
+def _writable(node):
+    """Get a mutable shallow copy of `node` if it's a shared, interned schema."""
+    if isinstance(node, _SchemaDict):
+        return dict(node)
+    return node
+
+
 def _map_refs(node: dict, on_refs: Callable[[str], dict]) -> dict:
     """
     Apply `on_refs` to all nodes with `$ref`, returning node with refs replaced
@@ -240,6 +418,9 @@ def _map_refs(node: dict, on_refs: Callable[[str], dict]) -> dict:
     Note: _map_refs is shallow, i.e., if calling `on_refs` on a node produces
     a new node that contains refs, those refs will not be resolved.
     """
+    if isinstance(node, (_SchemaDict, _SchemaList)):
+        # interned schemas have already had their refs resolved
+        return node
     if isinstance(node, collections.abc.Mapping):
         if "$ref" in node or "type_ref" in node:
             ref_key = "$ref" if "$ref" in node else "type_ref"
@@ -267,20 +448,23 @@ def _map_refs(node: dict, on_refs: Callable[[str], dict]) -> dict:
             if ref_key == "type_ref":
                 # For type_ref's, we don't want to clobber the other properties in node,
                 # so merge new_node and node.
+                new_node = _writable(new_node)
                 new_node.update(node)
 
             # Keep old 'description' field from next to $ref;
             # this is for user-facing documentation.
             if "description" in node and node["description"]:
+                new_node = _writable(new_node)
                 new_node["description"] = node["description"]
 
             # Plus concatenate new and old '$comment' fields;
             # this is for dev-side documentation side and
             # shouldn't be shown to users.
             if "$comment" in new_node or "$comment" in node:
-                new_node["$comment"] = new_node.get("$comment", "") + node.get(
-                    "$comment", ""
-                )
+                comment = new_node.get("$comment", "") + node.get("$comment", "")
+                if new_node.get("$comment") != comment:
+                    new_node = _writable(new_node)
+                    new_node["$comment"] = comment
             return new_node
         else:
             # Look for all refs further down in this mapping
@@ -324,7 +508,9 @@ def _resolve_refs(schema_root: str, json_spec: dict, context: str) -> dict:
                 raise RefResolutionError(f"Error resolving '$ref':{ref!r}: {e}") from e
 
             # as reslover uses cache we don't want to return mutable
-            # objects, so we make a copy
+            # objects, so we make a copy, or share an immutable one
+            if _intern_schemas:
+                return _intern_schema(res)
             return copy.deepcopy(res)
 
     try:
@@ -379,25 +565,292 @@ def _load_dont_validate_schema(
         if on_refs:
             schema = _map_refs(json_spec, on_refs)
         else:
-            schema = _resolve_refs(schema_root, json_spec, schema_path)
+            schema = _intern_if_enabled(
+                _resolve_refs(schema_root, json_spec, schema_path)
+            )
 
     return schema
 
 
 _validator_instance = _Validator({})
 
+_schema_cache_dir: Optional[str] = None
+
+
+def default_schema_cache_dir() -> str:
+    """The per-user cache directory for resolved schemas, under `$XDG_CACHE_HOME`."""
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "cidc_schemas")
+
+
+def set_schema_cache_dir(cache_dir: Optional[str]):
+    """
+    Persist schemas loaded by `load_and_validate_schema` and `schema_registry` (including
+    template schemas) to `cache_dir`, with their `$ref`s resolved and, if they were loaded
+    with validation, already checked against the metaschema, so that other processes can load
+    them without doing either again. Cached schemas are keyed on a hash of the schema files
+    and the package version, so stale entries are never used. Entries are pickled, so
+    `cache_dir` should only be writable by trusted users.
+    Pass `None` to stop using the on-disk cache.
+    """
+    global _schema_cache_dir
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+    _schema_cache_dir = cache_dir
+
+
+@functools.lru_cache(maxsize=None)
+def _get_schema_dir_hash(schema_root: str = SCHEMA_DIR) -> str:
+    """Hash the package version and the names and contents of every file in `schema_root`."""
+    sha = hashlib.sha256(__version__.encode())
+    for root, dirs, files in os.walk(schema_root):
+        dirs.sort()
+        for fname in sorted(files):
+            path = os.path.join(root, fname)
+            sha.update(os.path.relpath(path, schema_root).encode())
+            with open(path, "rb") as f:
+                sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _get_schema_cache_path(
+    cache_dir: str, schema_path: str, schema_root: str, validate: bool
+) -> str:
+    # schemas that weren't checked against the metaschema are cached separately
+    checked = "" if validate else ":unchecked"
+    key = hashlib.sha256(
+        f"{_get_schema_dir_hash(schema_root)}:{schema_path}{checked}".encode()
+    ).hexdigest()
+    return os.path.join(cache_dir, f"{key}.pickle")
+
+
+def _read_cached_schema(cache_path: str) -> Optional[dict]:
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except OSError:
+        return None
+    except Exception as e:
+        # e.g., a truncated file, which is replaced once the schema is reloaded
+        logger.warning(f"Ignoring unreadable cached schema {cache_path}: {e}")
+        return None
+
+
+def _write_cached_schema(cache_path: str, schema: dict):
+    try:
+        # write to a temporary file first so readers never see a partial schema
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(schema, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Couldn't cache schema at {cache_path}: {e}")
+
+
+def _load_schema(schema_path: str, schema_root: str, validate: bool) -> dict:
+    """
+    Load the resolved schema at `schema_path`, checking it against the metaschema if
+    `validate` is set. Schemas are read from and written to the on-disk cache, if one is set.
+    """
+    cache_path = None
+    if _schema_cache_dir is not None:
+        cache_path = _get_schema_cache_path(
+            _schema_cache_dir, schema_path, schema_root, validate
+        )
+
+    schema = _read_cached_schema(cache_path) if cache_path else None
+    if schema is not None:
+        return _intern_if_enabled(schema)
+
+    schema = _load_dont_validate_schema(schema_path, schema_root)
+
+    if validate:
+        # Ensure schema is valid
+        # NOTE: $refs were resolved above, so no need for a RefResolver here
+        _validator_instance.check_schema(schema)
+
+    if cache_path:
+        _write_cached_schema(cache_path, schema)
+
+    return schema
+
+
+class SchemaRegistryStats(NamedTuple):
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+class _SchemaRegistryEntry:
+    __slots__ = ("schema", "validator")
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        self.validator: Optional[_Validator] = None
+
+
+class SchemaRegistry:
+    """
+    A least-recently-used cache of resolved schemas, and of validators built from them,
+    keyed on schema path and schema root. Schemas are shared between callers, so they
+    mustn't be modified.
+
+    Arguments:
+        maxsize {int} -- the most schemas to keep before evicting the least recently used
+        preload_schemas {Iterable[str]} -- schemas loaded by `preload`
+        preload_templates {bool} -- whether `preload` also loads every template schema
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 128,
+        preload_schemas: Iterable[str] = ("clinical_trial.json",),
+        preload_templates: bool = True,
+    ):
+        assert maxsize > 0, "maxsize must be positive"
+        self.maxsize = maxsize
+        self.preload_schemas = list(preload_schemas)
+        self.preload_templates = preload_templates
+        self._entries: "OrderedDict[tuple, _SchemaRegistryEntry]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._hits = self._misses = self._evictions = 0
+        self._drop_callbacks: List[Callable[[Optional[dict]], None]] = []
+
+    def add_drop_callback(self, callback: Callable[[Optional[dict]], None]):
+        """
+        Call `callback(schema)` whenever `schema` is evicted, and `callback(None)` whenever
+        the registry is cleared, so that caches built from schemas can drop them too.
+        """
+        self._drop_callbacks.append(callback)
+
+    def _dropped(self, schemas: List[Optional[dict]]):
+        # called without holding the lock, since callbacks may take locks of their own
+        for schema in schemas:
+            for callback in self._drop_callbacks:
+                callback(schema)
+
+    def _get_entry(
+        self, schema_path: str, schema_root: str, validate: bool
+    ) -> _SchemaRegistryEntry:
+        key = (schema_path, schema_root, validate)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._hits += 1
+                self._entries.move_to_end(key)
+                return entry
+            self._misses += 1
+
+        # load outside of the lock, so slow loads don't block other schemas
+        schema = _load_schema(schema_path, schema_root, validate)
+
+        with self._lock:
+            # another thread may have loaded the same schema in the meantime
+            entry = self._entries.setdefault(key, _SchemaRegistryEntry(schema))
+            self._entries.move_to_end(key)
+            evicted = self._evict(self.maxsize)
+        self._dropped(evicted)
+        return entry
+
+    def _evict(self, maxsize: int) -> List[Optional[dict]]:
+        evicted = []
+        while len(self._entries) > maxsize:
+            _, entry = self._entries.popitem(last=False)
+            evicted.append(entry.schema)
+            self._evictions += 1
+        return evicted
+
+    def get(
+        self, schema_path: str, schema_root: str = SCHEMA_DIR, validate: bool = True
+    ) -> dict:
+        """
+        Get the resolved schema at `schema_path`, loading it if it isn't cached.
+        Schemas are checked against the metaschema unless `validate` is False,
+        e.g., for template schemas.
+        """
+        return self._get_entry(schema_path, schema_root, validate).schema
+
+    def get_validator(
+        self, schema_path: str, schema_root: str = SCHEMA_DIR
+    ) -> "_Validator":
+        """Get a validator for the schema at `schema_path`, building it if it isn't cached."""
+        entry = self._get_entry(schema_path, schema_root, True)
+        if entry.validator is None:
+            validator = _Validator(entry.schema)
+            validator.resolver = _build_ref_resolver(schema_root, entry.schema)
+            entry.validator = validator
+        return entry.validator
+
+    def preload(self, schema_root: str = SCHEMA_DIR):
+        """
+        Load `preload_schemas` and, if `preload_templates` is set, every template schema,
+        so that long-running processes don't pay for loading them on first use.
+        """
+        for schema_path in self.preload_schemas:
+            self.get(schema_path, schema_root)
+
+        if self.preload_templates:
+            # imported here, since `template` depends on this module
+            from .template import _get_template_path_map
+
+            # keyed as `Template.from_type` loads them
+            for template_path in _get_template_path_map().values():
+                self.get(template_path, validate=False)
+
+    def resize(self, maxsize: int):
+        """Change the most schemas to keep, evicting the least recently used if needed."""
+        assert maxsize > 0, "maxsize must be positive"
+        with self._lock:
+            self.maxsize = maxsize
+            evicted = self._evict(maxsize)
+        self._dropped(evicted)
+
+    def stats(self) -> SchemaRegistryStats:
+        with self._lock:
+            return SchemaRegistryStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self.maxsize,
+            )
+
+    def clear(self):
+        """
+        Drop every cached schema and validator, along with caches built from them
+        (see `add_drop_callback`), and reset the statistics.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._hits = self._misses = self._evictions = 0
+        self._dropped([None])
+
+
+# The registry used by `load_and_validate_schema` and `Template.from_type`
+schema_registry = SchemaRegistry()
+
 
-@functools.lru_cache(maxsize=32)
 def load_and_validate_schema(
     schema_path: str,
     schema_root: str = SCHEMA_DIR,
     return_validator: bool = False,
     on_refs: Optional[Callable[[dict], dict]] = None,
 ) -> Union[dict, jsonschema.Draft7Validator]:
-    schema = _load_dont_validate_schema(schema_path, schema_root, on_refs)
+    """
+    Load the schema at `schema_path` with its `$ref`s resolved, and check that it's valid.
+    Schemas and validators are cached in `schema_registry`, except for schemas loaded
+    with `on_refs`, since functions can't be part of a cache key.
+    """
+    if on_refs is None:
+        if return_validator:
+            return schema_registry.get_validator(schema_path, schema_root)
+        return schema_registry.get(schema_path, schema_root)
 
-    # Ensure schema is valid
-    # NOTE: $refs were resolved above, so no need for a RefResolver here
+    schema = _load_dont_validate_schema(schema_path, schema_root, on_refs)
     _validator_instance.check_schema(schema)
 
     if not return_validator:
@@ -408,8 +861,73 @@ def load_and_validate_schema(
         return validator
 
 
-# Warm up the cache with a full clinical trial validator
-load_and_validate_schema("clinical_trial.json", return_validator=True)
+_format_checker = jsonschema.FormatChecker()
+
+
+def compile_instance_validator(
+    schema: dict,
+) -> Callable[[JSON, bool], Optional[str]]:
+    """
+    Build a function `(instance, is_required) -> Optional[str]` that validates data
+    instances against `schema` exactly as `validate_instance` does. The schema is
+    checked and its validator, format checker and type converter are built only once,
+    so the returned function is cheap to call on many instances.
+    """
+    type_error = None
+    stype = schema.get("format")
+    if not stype:
+        stype = schema.get("type")
+    if not stype:
+        if "allOf" in schema:
+            types = set(s.get("type") for s in schema["allOf"] if "type" in s)
+            # if all types in 'allOf' are the same:
+            if len(types) == 1:
+                stype = types.pop()
+            else:
+                type_error = (
+                    f"Value can't be of multiple different types ({types}), "
+                    "as 'allOf' in schema specifies."
+                )
+
+    reformatter = _get_reformatter(stype)
+
+    # we're using this to validate only 'basic' values that come from Template cells
+    # that's why we don't want to check for ref integrity with _Validator here
+    # so a Validator specified in this schema will be used, or a default one
+    validator_cls = jsonschema.validators.validator_for(schema)
+    schema_error = None
+    try:
+        validator_cls.check_schema(schema)
+    except jsonschema.SchemaError as e:
+        # raised when validating, as `jsonschema.validate` would
+        schema_error = e
+    validator = validator_cls(schema, format_checker=_format_checker)
+
+    def validate(instance: JSON, is_required: bool = False) -> Optional[str]:
+        try:
+            if instance is None:
+                if is_required:
+                    raise jsonschema.ValidationError(
+                        "found empty value for required field"
+                    )
+                else:
+                    return None
+
+            if type_error:
+                return type_error
+
+            instance = _reformat(reformatter, instance)
+
+            if schema_error:
+                raise schema_error
+            error = jsonschema.exceptions.best_match(validator.iter_errors(instance))
+            if error is not None:
+                raise error
+            return None
+        except jsonschema.ValidationError as error:
+            return error.message
+
+    return validate
 
 
 def validate_instance(instance: str, schema: dict, is_required=False) -> Optional[str]:
@@ -417,49 +935,68 @@ def validate_instance(instance: str, schema: dict, is_required=False) -> Optiona
     Validate a data instance against a JSON schema.
 
     Returns None if `instance` is valid, otherwise returns reason for invalidity.
+    Use `compile_instance_validator` to validate many instances against one schema.
     """
-    try:
-        if instance is None:
-            if is_required:
-                raise jsonschema.ValidationError("found empty value for required field")
-            else:
-                return None
-
-        stype = schema.get("format")
-        if not stype:
-            stype = schema.get("type")
-        if not stype:
-            if "allOf" in schema:
-                types = set(s.get("type") for s in schema["allOf"] if "type" in s)
-                # if all types in 'allOf' are the same:
-                if len(types) == 1:
-                    stype = types.pop()
-                else:
-                    return (
-                        f"Value can't be of multiple different types ({types}), "
-                        "as 'allOf' in schema specifies."
-                    )
+    return compile_instance_validator(schema)(instance, is_required)
 
-        instance = convert(stype, instance)
 
-        jsonschema.validate(
-            # we're using this to validate only 'basic' values that come from Template cells
-            # that's why we don't want to check for ref integrity with _Validator here
-            # so a Validator specified in this schema will be used, or a default one
-            instance,
-            schema,
-            format_checker=jsonschema.FormatChecker(),
-        )
-        return None
-    except jsonschema.ValidationError as error:
-        return error.message
+# Methods for reformatting strings
 
 
-# Methods for reformatting strings
+# Formats that cover nearly every date we see in practice. These are tried with
+# strptime before falling back to dateparser, which is much slower. Each format
+# here must parse strings exactly as dateparser would (e.g., month-first for
+# US-style dates and the same two-digit-year pivot).
+_STRICT_DATETIME_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M:%S.%f",
+    "%Y-%m-%dT%H:%M:%S.%f",
+    "%m/%d/%Y",
+    "%m/%d/%y",
+)
+_STRICT_TIME_FORMATS = ("%H:%M:%S", "%H:%M")
+
+
+def _strptime(value: str, formats: tuple) -> Optional[datetime.datetime]:
+    for fmt in formats:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    return None
 
 
-def _get_datetime(value):
-    return dateparser.parse(str(value))
+@functools.lru_cache(maxsize=4096)
+def _parse_datetime_string(value: str) -> Optional[datetime.datetime]:
+    """Parse a date string, trying the strict formats before dateparser."""
+    dt = _strptime(value, _STRICT_DATETIME_FORMATS)
+    if dt is None:
+        # dateparser is slow to import, and most dates never need it
+        import dateparser
+
+        dt = dateparser.parse(value)
+    return dt
+
+
+def _get_datetime(value) -> Optional[datetime.datetime]:
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    if isinstance(value, datetime.time):
+        return datetime.datetime.combine(datetime.date.today(), value)
+
+    value = str(value)
+
+    # Like dateparser, treat bare times as times on the current day. These
+    # aren't memoized, since the result depends on when they're parsed.
+    t = _strptime(value, _STRICT_TIME_FORMATS)
+    if t is not None:
+        return datetime.datetime.combine(datetime.date.today(), t.time())
+
+    return _parse_datetime_string(value)
 
 
 def _to_date(value):
@@ -490,8 +1027,7 @@ def _to_bool(value):
         raise ValueError(f'could not convert "{value}" to boolean')
 
 
-def convert(fmt: str, value: str) -> str:
-    """Try to convert a value to the given format"""
+def _get_reformatter(fmt: str) -> Callable:
     if fmt == "time":
         reformatter = _to_time
     elif fmt == "date":
@@ -508,12 +1044,21 @@ def convert(fmt: str, value: str) -> str:
         # If we don't have a specified reformatter, use the identity function
         reformatter = id
 
+    return reformatter
+
+
+def _reformat(reformatter: Callable, value):
     try:
         return reformatter(value)
     except Exception as e:
         raise jsonschema.ValidationError(e)
 
 
+def convert(fmt: str, value: str) -> str:
+    """Try to convert a value to the given format"""
+    return _reformat(_get_reformatter(fmt), value)
+
+
 REQUIRED_PROPERTY_MSG = " is a required property"
 
 
@@ -1,5 +1,6 @@
 from .core import (
     prismify,
+    validate_and_prismify,
     ParsingException,
     LocalFileUploadEntry,
     set_prism_encrypt_key,
@@ -8,10 +9,13 @@ from .merger import (
     merge_artifact,
     merge_artifacts,
     merge_artifact_extra_metadata,
+    merge_artifacts_extra_metadata,
+    index_upload_placeholders,
     merge_clinical_trial_metadata,
     InvalidMergeTargetException,
     MergeCollisionException,
     ArtifactInfo,
+    ExtraMetadataInfo,
 )
 from .extra_metadata import (
     parse_elisa,
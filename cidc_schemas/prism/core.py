@@ -2,7 +2,7 @@
 import logging
 import base64
 import hmac
-from typing import List, Tuple, Union
+from typing import BinaryIO, List, Tuple, Union
 
 from cidc_schemas.json_validation import load_and_validate_schema
 from cidc_schemas.template import (
@@ -14,8 +14,7 @@ from cidc_schemas.template import (
 from cidc_schemas.template_reader import XlTemplateReader
 from cidc_schemas.template_writer import RowType
 from cidc_schemas.constants import SCHEMA_DIR
-from .merger import PRISM_MERGE_STRATEGIES, MergeCollisionException
-from jsonmerge import Merger
+from .merger import MergeCollisionException, get_merge_plan
 from jsonpointer import EndOfList, JsonPointer, JsonPointerException, resolve_pointer
 
 from .constants import SUPPORTED_TEMPLATES
@@ -405,7 +404,7 @@ def prismify(
         template_root_obj = root_ct_obj
 
     # and merger for it
-    root_ct_merger = Merger(root_ct_schema, strategies=PRISM_MERGE_STRATEGIES)
+    root_ct_merge_plan = get_merge_plan(root_ct_schema)
     # and where to collect all local file refs
     collected_files = []
 
@@ -434,15 +433,11 @@ def prismify(
             templ_ws.get("prism_preamble_object_schema", root_ct_schema_name),
             schema_root,
         )
-        preamble_merger = Merger(
-            preamble_object_schema, strategies=PRISM_MERGE_STRATEGIES
-        )
+        # accumulates data row objects, merging them by their ids
+        preamble_builder = get_merge_plan(preamble_object_schema).builder()
         preamble_object_pointer = templ_ws.get("prism_preamble_object_pointer", "")
         data_object_pointer = templ_ws["prism_data_object_pointer"]
 
-        # creating preamble obj
-        preamble_obj = {}
-
         # Processing data rows first
         data = ws[RowType.DATA]
         if data:
@@ -489,7 +484,7 @@ def prismify(
                         collected_files.extend(new_files)
 
                 try:
-                    preamble_obj = preamble_merger.merge(preamble_obj, copy_of_preamble)
+                    preamble_builder.add(copy_of_preamble)
                 except MergeCollisionException as e:
                     # Reformatting exception, because this mismatch happened within one template
                     # and not with some saved stuff.
@@ -497,6 +492,9 @@ def prismify(
                     errors_so_far.append(wrapped)
                     logger.info(f"MergeCollisionException: {wrapped}")
 
+        # creating preamble obj
+        preamble_obj = preamble_builder.result or {}
+
         # Now processing preamble rows
         logger.debug(f"  preamble for {ws_name!r}")
         for row in ws[RowType.PREAMBLE]:
@@ -524,7 +522,9 @@ def prismify(
         logger.debug("merging root objs")
         logger.debug(f" {template_root_obj}")
         logger.debug(f" {copy_of_templ_root}")
-        template_root_obj = root_ct_merger.merge(template_root_obj, copy_of_templ_root)
+        template_root_obj = root_ct_merge_plan.merge(
+            template_root_obj, copy_of_templ_root
+        )
         logger.debug(f"  merged - {template_root_obj}")
 
     if template_root_obj_pointer != "":
@@ -533,3 +533,42 @@ def prismify(
         root_ct_obj = template_root_obj
 
     return root_ct_obj, collected_files, errors_so_far
+
+
+def validate_and_prismify(
+    xlsx: Union[str, BinaryIO],
+    template: Template,
+    schema_root: str = SCHEMA_DIR,
+) -> Tuple[dict, List[LocalFileUploadEntry], List[Union[Exception, str]]]:
+    """
+    Reads and validates an Excel file (either a path or an open file) against `template`,
+    then prismifies it, loading the workbook only once rather than once for
+    `Template.iter_errors_excel` and again for the `XlTemplateReader` passed to `prismify`.
+    Args:
+        xlsx: path to the Excel file or the open file itself
+        template: cidc_schemas.template.Template instance
+        schema_root: path to the target JSON schema, defaulting to CIDC schemas root
+    Returns:
+        (tuple):
+            arg1: clinical trial object with data parsed from spreadsheet,
+                or {} if the spreadsheet is invalid
+            arg2: list of `LocalFileUploadEntry`s that describe each file identified,
+                or [] if the spreadsheet is invalid
+            arg3: list of errors from reading, validating and prismifying the spreadsheet
+    Raises:
+        ValidationError if a row has no recognized row type, as `XlTemplateReader.from_excel`
+        NotImplementedError if `template` isn't supported by `prismify`
+    """
+    if template.type not in SUPPORTED_TEMPLATES:
+        raise NotImplementedError(
+            f"{template.type!r} is not supported, only {SUPPORTED_TEMPLATES} are."
+        )
+
+    reader, errors = XlTemplateReader.from_excel(xlsx)
+    if not errors:
+        errors = list(reader.iter_errors(template))
+    if errors:
+        # prismify expects a well-formed workbook, so don't attempt it
+        return {}, [], errors
+
+    return prismify(reader, template, schema_root)
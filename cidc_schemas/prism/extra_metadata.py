@@ -2,24 +2,45 @@
 import logging
 import re
 from codecs import BOM_UTF8
-from typing import BinaryIO
+from itertools import chain, islice
+from typing import BinaryIO, Pattern
 
 import openpyxl
-import pandas as pd
 
 from ..json_validation import load_and_validate_schema
 
 logger = logging.getLogger(__file__)
 
+
+class _SchemaPattern:
+    """
+    A regex built from the "pattern" of a schema property, which is only loaded
+    and compiled on first use. Otherwise behaves like the compiled `re.Pattern`.
+    """
+
+    def __init__(self, schema_path: str, property_name: str):
+        self.schema_path = schema_path
+        self.property_name = property_name
+        self._regex = None
+
+    def _compile(self) -> Pattern:
+        if self._regex is None:
+            schema = load_and_validate_schema(self.schema_path)
+            self._regex = re.compile(
+                schema["properties"][self.property_name]["pattern"]
+            )
+        return self._regex
+
+    def __getattr__(self, name: str):
+        # e.g. while unpickling, before `_regex` is set
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._compile(), name)
+
+
 # Build a regex from the CIMAC ID pattern in the schema
-cimac_id_regex = re.compile(
-    load_and_validate_schema("sample.json")["properties"]["cimac_id"]["pattern"]
-)
-cimac_partid_regex = re.compile(
-    load_and_validate_schema("participant.json")["properties"]["cimac_participant_id"][
-        "pattern"
-    ]
-)
+cimac_id_regex = _SchemaPattern("sample.json", "cimac_id")
+cimac_partid_regex = _SchemaPattern("participant.json", "cimac_participant_id")
 
 
 def parse_elisa(xlsx: BinaryIO) -> dict:
@@ -38,30 +59,35 @@ def parse_elisa(xlsx: BinaryIO) -> dict:
     if type(xlsx) == str:
         raise TypeError(f"parse_npx only accepts BinaryIO and not file paths")
 
-    workbook = openpyxl.load_workbook(xlsx)
-
-    # extract data to python
-    ids = []
-    worksheet = workbook[workbook.sheetnames[0]]
-
-    idx = 0
-    for i, row in enumerate(worksheet.iter_rows()):
-        if i == 0:
+    workbook = openpyxl.load_workbook(xlsx, read_only=True)
+    try:
+        # extract data to python
+        ids = []
+        worksheet = workbook[workbook.sheetnames[0]]
+
+        # read-only worksheets stop at the size stored in the file, which may be stale
+        worksheet.reset_dimensions()
+        rows = worksheet.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is not None:
             # find the one that looks like CIMAC ID
             # ignore case, switch underscores to spaces
             values = [
-                str(i.value).upper().strip().replace("_", " ") if str(i.value) else ""
-                for i in row
+                str(v).upper().strip().replace("_", " ") if str(v) else ""
+                for v in header
             ]
-            assert any(["CIMAC ID" == i for i in values])
+            assert any(["CIMAC ID" == v for v in values])
             idx = values.index("CIMAC ID")
-            continue
 
-        val = row[idx].value
+            for row in rows:
+                # read-only rows are not padded out to the sheet's width
+                val = row[idx] if idx < len(row) else None
 
-        if val:
-            if cimac_id_regex.match(val):
-                ids.append(val)
+                if val:
+                    if cimac_id_regex.match(val):
+                        ids.append(val)
+    finally:
+        workbook.close()
 
     sample_count = len(ids)
 
@@ -89,49 +115,53 @@ def parse_npx(xlsx: BinaryIO) -> dict:
     if type(xlsx) == str:
         raise TypeError(f"parse_npx only accepts BinaryIO and not file paths")
 
-    workbook = openpyxl.load_workbook(xlsx)
-
-    # extract data to python
-    ids = []
-    for worksheet_name in workbook.sheetnames:
-
-        # simplify.
-        worksheet = workbook[worksheet_name]
-        seen_onlinkid = False
-        for i, row in enumerate(worksheet.iter_rows()):
-
-            # extract values from row
-            vals = [col.value for col in row]
+    workbook = openpyxl.load_workbook(xlsx, read_only=True)
+    try:
+        # extract data to python
+        ids = []
+        for worksheet_name in workbook.sheetnames:
 
-            first_cell = vals[0]
+            # simplify.
+            worksheet = workbook[worksheet_name]
+            # read-only worksheets stop at the size stored in the file, which may be stale
+            worksheet.reset_dimensions()
+            seen_onlinkid = False
+            # only the first column is needed, so don't materialize the assay columns
+            for i, row in enumerate(worksheet.iter_rows(max_col=1, values_only=True)):
 
-            # skip empty
-            if len(vals) == 0 or first_cell is None:
-                continue
+                first_cell = row[0] if row else None
 
-            # find OlinkID to locate the first data row
-            if not seen_onlinkid:
-                # check that this is actually an NPX file
-                if i == 1 and first_cell != "NPX data":
-                    raise ValueError("parse_npx got a file that is not in NPX format")
-
-                # check if we are starting ids
-                # use this to capture cases where the column name changes in spacing / capitalization
-                ## needed because some data has 'OlinkID' while the standard seems to call for 'Olink ID'
-                if str(first_cell).lower().replace(" ", "") == "olinkid":
-                    seen_onlinkid = True
+                # skip empty
+                if first_cell is None:
                     continue
 
-            # once it's found keep getting ids until we're done
-            else:
-                # check if we are done.
-                if first_cell == "LOD":
-                    break
-
-                # otherwise get the identifier
-                # and check that it is a CIMAC ID
-                if cimac_id_regex.match(first_cell):
-                    ids.append(first_cell)
+                # find OlinkID to locate the first data row
+                if not seen_onlinkid:
+                    # check that this is actually an NPX file
+                    if i == 1 and first_cell != "NPX data":
+                        raise ValueError(
+                            "parse_npx got a file that is not in NPX format"
+                        )
+
+                    # check if we are starting ids
+                    # use this to capture cases where the column name changes in spacing / capitalization
+                    ## needed because some data has 'OlinkID' while the standard seems to call for 'Olink ID'
+                    if str(first_cell).lower().replace(" ", "") == "olinkid":
+                        seen_onlinkid = True
+                        continue
+
+                # once it's found keep getting ids until we're done
+                else:
+                    # check if we are done.
+                    if first_cell == "LOD":
+                        break
+
+                    # otherwise get the identifier
+                    # and check that it is a CIMAC ID
+                    if cimac_id_regex.match(first_cell):
+                        ids.append(first_cell)
+    finally:
+        workbook.close()
 
     sample_count = len(ids)
 
@@ -140,6 +170,45 @@ def parse_npx(xlsx: BinaryIO) -> dict:
     return samples
 
 
+def _parse_clinical_worksheet(worksheet) -> set:
+    """
+    Collects the CIMAC participant IDs from every "cimac_part_id" column of
+    a read-only `worksheet`, streaming its rows once.
+    """
+    # read-only worksheets stop at the size stored in the file, which may be stale
+    worksheet.reset_dimensions()
+    rows = worksheet.iter_rows(values_only=True)
+
+    # title must be in top 2 rows
+    # also check second row in case of version row
+    # won't match the regex and title will be ignored
+    header = list(islice(rows, 2))
+    width = max((len(row) for row in header), default=0)
+    id_columns = [
+        c
+        for c in range(width)
+        if "cimac_part_id" in {row[c] if c < len(row) else None for row in header}
+    ]
+    if not id_columns:
+        return set()
+
+    ids = set()
+    for row in chain(header, rows):
+        for c in id_columns:
+            value = row[c] if c < len(row) else None
+            # some participant ID's might be blank for
+            # participants not in the system already (skip these for now)
+            if value == "" or not value:
+                continue
+
+            # get the identifier
+            # check that it is a CIMAC PART ID
+            if cimac_partid_regex.match(str(value)):
+                ids.add(value)
+
+    return ids
+
+
 def parse_clinical(file: BinaryIO) -> dict:
     """
     Parses the given clinical file to extract a list of participant IDs.
@@ -166,7 +235,7 @@ def parse_clinical(file: BinaryIO) -> dict:
     ids = set()
 
     try:
-        workbook = openpyxl.load_workbook(file)
+        workbook = openpyxl.load_workbook(file, read_only=True)
         assert len(workbook.sheetnames) > 0
     except:
 
@@ -185,6 +254,9 @@ def parse_clinical(file: BinaryIO) -> dict:
         )
         file.seek(0)
 
+        # pandas is slow to import, and only needed for CSVs
+        import pandas as pd
+
         try:
             csv = pd.read_csv(file, skiprows=skiprows)
         except Exception as e:
@@ -205,33 +277,12 @@ def parse_clinical(file: BinaryIO) -> dict:
                 logger.error(f"Only found: {', '.join(list(csv.columns))}")
 
     else:
-        # extract data to python
-        for worksheet_name in workbook.sheetnames:
-
-            # simplify.
-            worksheet = workbook[worksheet_name]
-
-            # iterate through all possible columns to find all cimac_part_id's
-            # title must be in top 2 rows
-            for column in worksheet.iter_cols(1, worksheet.max_column):
-                # also check second row in case of version row
-                # won't match the regex and title will be ignored
-                possible_titles = (
-                    {column[0].value}
-                    if len(column) == 1
-                    else {cell.value for cell in column[:2]}
-                )
-                if "cimac_part_id" in possible_titles:
-                    for cell in column:
-                        # some participant ID's might be blank for
-                        # participants not in the system already (skip these for now)
-                        if cell.value == "" or not cell.value:
-                            continue
-
-                        # get the identifier
-                        # check that it is a CIMAC PART ID
-                        if cimac_partid_regex.match(str(cell.value)):
-                            ids.add(cell.value)
+        try:
+            # extract data to python
+            for worksheet_name in workbook.sheetnames:
+                ids.update(_parse_clinical_worksheet(workbook[worksheet_name]))
+        finally:
+            workbook.close()
 
     part_count = len(ids)
 
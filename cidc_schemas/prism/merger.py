@@ -1,14 +1,32 @@
 """Merge CIDC schemas metadata dictionaries."""
 
+import json
 import logging
-from typing import BinaryIO, List, NamedTuple, Optional, Tuple
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import (
+    Any,
+    BinaryIO,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+from urllib.parse import unquote
 
 import jsonschema
 from jsonmerge import Merger, strategies
-from deepdiff import DeepSearch
+from jsonmerge.exceptions import BaseInstanceError, HeadInstanceError, SchemaError
 
-from ..json_validation import load_and_validate_schema, _Validator
-from ..util import get_path, get_source
+from ..json_validation import load_and_validate_schema, schema_registry, _Validator
+from ..util import get_source
 from .extra_metadata import EXTRA_METADATA_PARSERS
 from .constants import PROTOCOL_ID_FIELD_NAME
 
@@ -25,6 +43,7 @@ def merge_artifact(
     crc32c_hash: Optional[str] = None,
     md5_hash: Optional[str] = None,
     uuid_path: Optional[str] = None,
+    placeholder_index: Optional[Dict[str, "UploadPlaceholder"]] = None,
 ) -> Tuple[dict, dict, dict]:
     """
     create and merge an artifact into the metadata blob
@@ -39,6 +58,8 @@ def merge_artifact(
         md5_hash: md5 hash of the uploaded object, provided by GCS for non-composite objects
         crc32c_hash: crc32c hash of the uploaded object, provided by GCS for all objects
         uuid_path: optional `deepdiff`-style path to the artifact in the `ct` dictionary
+        placeholder_index: optional `index_upload_placeholders(ct)` output, to avoid
+            searching `ct` for the artifact
     Returns:
         ct: updated clinical trial object
         artifact: updated artifact
@@ -61,7 +82,13 @@ def merge_artifact(
     if md5_hash:
         artifact_patch["md5_hash"] = md5_hash
 
-    return _update_artifact(ct, artifact_patch, artifact_uuid, uuid_path=uuid_path)
+    return _update_artifact(
+        ct,
+        artifact_patch,
+        artifact_uuid,
+        uuid_path=uuid_path,
+        placeholder_index=placeholder_index,
+    )
 
 
 class ArtifactInfo(NamedTuple):
@@ -85,44 +112,59 @@ def merge_artifacts(
     if len(artifacts) == 0:
         return ct, []
 
-    # Pre-compute the mapping from artifact UUIDs to metadata paths.
-    uuid_path_map = _get_uuid_path_map(ct)
+    # Find all the upload placeholders in one walk of `ct`. Artifacts are updated
+    # in place, so the index stays valid while we merge the whole batch.
+    placeholder_index = index_upload_placeholders(ct)
     merged_artifacts = []
     for artifact in artifacts:
-        uuid_path = uuid_path_map[artifact.artifact_uuid]
-        ct, *merged_artifact = merge_artifact(ct, *artifact, uuid_path=uuid_path)
+        ct, *merged_artifact = merge_artifact(
+            ct, *artifact, placeholder_index=placeholder_index
+        )
         merged_artifacts.append(tuple(merged_artifact))
     return ct, merged_artifacts
 
 
-def _get_uuid_path_map(ct: dict) -> dict:
+class UploadPlaceholder(NamedTuple):
+    # path to the "upload_placeholder" field, as `split_python_style_path` would give it
+    path: Tuple[Union[str, int], ...]
+    # the artifact that contains the "upload_placeholder" field
+    artifact: dict
+
+
+def index_upload_placeholders(ct: dict) -> Dict[str, UploadPlaceholder]:
     """
-    Build a dictionary mapping upload placeholder UUIDs to a `deepdiff`-style
-    path to that artifact in the `ct` clinical trial metadata dictionary. This
+    Build a dictionary mapping upload placeholder UUIDs to their location in the
+    `ct` clinical trial metadata dictionary, in a single walk of `ct`. This
     will look something like:
     ```python
     {
-        "uuuu-uuuu-iiii-dddd": "root['path']['to']['upload_placeholder']",
+        "uuuu-uuuu-iiii-dddd": UploadPlaceholder(
+            path=("path", 0, "to", "upload_placeholder"),
+            artifact={"upload_placeholder": "uuuu-uuuu-iiii-dddd", ...},
+        ),
         ...
     }
     ```
     """
-
-    def get_uuid_for_path(path: str):
-        # Spooky stuff: `exec` executes the string provided as its first argument as
-        # python code in a context populated with the global variables defined by
-        # the dictionary passed as its second argument. Since `path` looks like
-        # "root['path']['to']['upload_placeholder']", the following code looks up
-        # the UUID associated with `path` in the `ct` dict, whose value is assigned
-        # to "root" in the scope provided to `exec`, and stores that UUID in `scope['uuid']`.
-        scope = {"root": ct}
-        exec(f"uuid = {path}", scope)
-        return scope["uuid"]
-
-    return {
-        get_uuid_for_path(path): path
-        for path in DeepSearch(ct, "upload_placeholder")["matched_paths"]
-    }
+    index = {}
+    stack = [((), ct)]
+    while stack:
+        path, obj = stack.pop()
+        if isinstance(obj, dict):
+            uuid = obj.get("upload_placeholder")
+            if isinstance(uuid, str):
+                index[uuid] = UploadPlaceholder(path + ("upload_placeholder",), obj)
+            children = obj.items()
+        elif isinstance(obj, list):
+            children = enumerate(obj)
+        else:
+            continue
+
+        for key, child in children:
+            if isinstance(child, (dict, list)):
+                stack.append((path + (key,), child))
+
+    return index
 
 
 class InvalidMergeTargetException(ValueError):
@@ -130,7 +172,11 @@ class InvalidMergeTargetException(ValueError):
 
 
 def merge_artifact_extra_metadata(
-    ct: dict, artifact_uuid: str, assay_hint: str, extra_metadata_file: BinaryIO
+    ct: dict,
+    artifact_uuid: str,
+    assay_hint: str,
+    extra_metadata_file: BinaryIO,
+    placeholder_index: Optional[Dict[str, UploadPlaceholder]] = None,
 ) -> Tuple[dict, dict, dict]:
     """
     Merges parsed extra metadata returned by extra_metadata_parsing to
@@ -140,6 +186,8 @@ def merge_artifact_extra_metadata(
         artifact_uuid: passed from upload assay
         assay_hint: assay type
         extra_metadata_file: extra metadata file in BinaryIO
+        placeholder_index: optional `index_upload_placeholders(ct)` output, to avoid
+            searching `ct` for the artifact
     Returns:
         ct: updated clinical trial object
         artifact: updated artifact
@@ -161,11 +209,142 @@ def merge_artifact_extra_metadata(
             f"Assay {artifact_uuid} cannot be parsed for {assay_hint} metadata"
         ) from e
     else:
-        return _update_artifact(ct, artifact_extra_md_patch, artifact_uuid)
+        return _update_artifact(
+            ct,
+            artifact_extra_md_patch,
+            artifact_uuid,
+            placeholder_index=placeholder_index,
+        )
+
+
+class ExtraMetadataInfo(NamedTuple):
+    artifact_uuid: str
+    assay_hint: str
+    extra_metadata_file: BinaryIO
+
+
+def merge_artifacts_extra_metadata(
+    ct: dict,
+    extra_metadata_files: List[ExtraMetadataInfo],
+    workers: Optional[int] = None,
+) -> Tuple[dict, List[Tuple[dict, dict]]]:
+    """
+    Parse a batch of `extra_metadata_files` in a pool of `workers` processes,
+    then merge the results into their artifacts in `ct`, returning the modified
+    `ct` dictionary and array of merged artifacts.
+    Args:
+        ct: preliminary patch from upload_assay
+        extra_metadata_files: (artifact uuid, assay type, extra metadata file) triples
+        workers: number of parser processes, defaulting to the number of CPUs.
+            With `workers=1`, or by default on a single CPU, files are parsed one
+            at a time in this process. On Linux, pool processes are forked from
+            this one, which can deadlock if another thread holds a lock while
+            forking (e.g., in a multi-threaded server), so pass `workers=1` there.
+    Returns:
+        ct: updated clinical trial object
+        merged_artifacts: (artifact, additional_artifact_metadata) for each file
+    Raises:
+        ValueError
+            if an assay doesn't support metadata parsing or a file cannot be parsed
+        KeyError
+            if an artifact uuid isn't found in `ct`
+    """
+    # Make no modifications to `ct` if no files are passed
+    if len(extra_metadata_files) == 0:
+        return ct, []
+
+    # Check the whole batch before parsing anything, so that nothing is
+    # merged into `ct` unless every file can be.
+    placeholder_index = index_upload_placeholders(ct)
+    for artifact_uuid, assay_hint, _ in extra_metadata_files:
+        if assay_hint not in EXTRA_METADATA_PARSERS:
+            raise ValueError(
+                f"Assay {assay_hint} does not support extra metadata parsing"
+            )
+        if artifact_uuid not in placeholder_index:
+            raise KeyError(f"key: {artifact_uuid} not found")
+
+    artifact_extra_md_patches = _parse_extra_metadata_files(
+        extra_metadata_files, workers
+    )
+
+    merged_artifacts = []
+    for (artifact_uuid, _, _), artifact_extra_md_patch in zip(
+        extra_metadata_files, artifact_extra_md_patches
+    ):
+        ct, *merged_artifact = _update_artifact(
+            ct,
+            artifact_extra_md_patch,
+            artifact_uuid,
+            placeholder_index=placeholder_index,
+        )
+        merged_artifacts.append(tuple(merged_artifact))
+    return ct, merged_artifacts
+
+
+def _parse_extra_metadata(assay_hint: str, extra_metadata: Any) -> dict:
+    """Run the `assay_hint` parser on a file's contents, in a worker process."""
+    if isinstance(extra_metadata, bytes):
+        extra_metadata = BytesIO(extra_metadata)
+    return EXTRA_METADATA_PARSERS[assay_hint](extra_metadata)
+
+
+def _parse_extra_metadata_files(
+    extra_metadata_files: List[ExtraMetadataInfo], workers: Optional[int]
+) -> List[dict]:
+    """Parse `extra_metadata_files` in order, with a process pool if `workers != 1`."""
+    if workers is None:
+        # a pool can't parse any faster than this process on a single CPU
+        workers = os.cpu_count() or 1
+
+    if workers == 1 or len(extra_metadata_files) == 1:
+        results = []
+        for artifact_uuid, assay_hint, extra_metadata_file in extra_metadata_files:
+            try:
+                results.append(EXTRA_METADATA_PARSERS[assay_hint](extra_metadata_file))
+            except ValueError as e:
+                raise ValueError(
+                    f"Assay {artifact_uuid} cannot be parsed for {assay_hint} metadata"
+                ) from e
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Open files can't be sent to another process, so send their contents.
+        # Anything else goes through as is, for the parser to reject.
+        futures = [
+            executor.submit(
+                _parse_extra_metadata,
+                assay_hint,
+                extra_metadata_file.read()
+                if hasattr(extra_metadata_file, "read")
+                else extra_metadata_file,
+            )
+            for _, assay_hint, extra_metadata_file in extra_metadata_files
+        ]
+        try:
+            results = []
+            for (artifact_uuid, assay_hint, _), future in zip(
+                extra_metadata_files, futures
+            ):
+                try:
+                    results.append(future.result())
+                except ValueError as e:
+                    raise ValueError(
+                        f"Assay {artifact_uuid} cannot be parsed for {assay_hint} metadata"
+                    ) from e
+            return results
+        finally:
+            # don't wait on files that haven't started parsing if one failed
+            for future in futures:
+                future.cancel()
 
 
 def _update_artifact(
-    ct: dict, artifact_patch: dict, artifact_uuid: str, uuid_path: Optional[str] = None
+    ct: dict,
+    artifact_patch: dict,
+    artifact_uuid: str,
+    uuid_path: Optional[str] = None,
+    placeholder_index: Optional[Dict[str, UploadPlaceholder]] = None,
 ) -> Tuple[dict, dict, dict]:
     """Updates the artifact with uuid `artifact_uuid` in `ct`,
     and return the updated clinical trial and artifact objects
@@ -173,15 +352,25 @@ def _update_artifact(
         ct: clinical trial object
         artifact_patch: artifact object patch
         artifact_uuid: artifact identifier
+        uuid_path: optional `deepdiff`-style path to the artifact in `ct`
+        placeholder_index: optional `index_upload_placeholders(ct)` output
     Returns:
         ct: updated clinical trial object
         artifact: updated artifact
         additional_artifact_metadata: relevant metadata collected while updating artifact
     """
-    # `uuid_path` won't be defined if the user of this module called
-    # `merge_artifact` directly instead of using `merge_artifacts`,
-    # so we need this fallback.
-    uuid_field_path = uuid_path or get_path(ct, artifact_uuid)
+    if uuid_path:
+        uuid_field_path = uuid_path
+    else:
+        # `placeholder_index` won't be defined if the user of this module called
+        # `merge_artifact` directly instead of using `merge_artifacts`,
+        # so we need this fallback.
+        if placeholder_index is None:
+            placeholder_index = index_upload_placeholders(ct)
+        try:
+            uuid_field_path = placeholder_index[artifact_uuid].path
+        except KeyError:
+            raise KeyError(f"key: {artifact_uuid} not found")
 
     # As "uuid_field_path" contains path to a field with uuid,
     # we're looking for an artifact that contains it, not the "string" field itself
@@ -282,12 +471,503 @@ PRISM_MERGE_STRATEGIES = {
 }
 
 
-def merge_clinical_trial_metadata(patch: dict, target: dict) -> Tuple[dict, List[str]]:
+# Sentinel for missing values in the merge engine below, like jsonmerge's `JSONValue(undef=True)`
+_UNDEF = object()
+
+
+def _escape_ref(key) -> str:
+    return str(key).replace("~", "~0").replace("/", "~1")
+
+
+class _MergeNode:
+    """The merge strategy for one subschema, compiled from its `mergeStrategy` and `mergeOptions`."""
+
+    def __init__(self, plan: "MergePlan", schema: Optional[dict]):
+        self.plan = plan
+        self.schema = schema or {}
+        self.one_of = None
+        self.error = None
+        self.strategy = self.schema.get("mergeStrategy")
+
+        options = self.schema.get("mergeOptions") or {}
+        self.id_ref = options.get("idRef", "id")
+        self.id_parts = [
+            part.replace("~1", "/").replace("~0", "~")
+            for part in unquote(self.id_ref.lstrip("/")).split("/")
+            if self.id_ref.lstrip("/")
+        ]
+        self.id_name = self.id_ref.split("/")[-1]
+        self.ignore_id = options.get("ignoreId")
+        self.keep_if_undef = options.get("keepIfUndef", False)
+
+        # jsonmerge only descends into these when no strategy is set on this level
+        if self.strategy is None:
+            if "oneOf" in self.schema:
+                self.one_of = self.schema["oneOf"]
+            elif "allOf" in self.schema or "anyOf" in self.schema:
+                self.error = SchemaError(
+                    "Can't descend to 'allOf' and 'anyOf' keywords", schema
+                )
+        elif self.strategy not in _MERGE_FUNCTIONS:
+            self.error = SchemaError(f"Unknown strategy '{self.strategy}'", schema)
+
+        self._children: Dict[str, "_MergeNode"] = {}
+        self._items = None
+
+    def child(self, key: str) -> "_MergeNode":
+        """Get the node for property `key` of objects merged with this node."""
+        node = self._children.get(key)
+        if node is None:
+            subschema = self.schema.get("properties", {}).get(key)
+            if subschema is None:
+                for pattern, s in self.schema.get("patternProperties", {}).items():
+                    if re.search(pattern, key):
+                        subschema = s
+            if subschema is None:
+                additional = self.schema.get("additionalProperties")
+                if isinstance(additional, dict):
+                    subschema = additional
+            node = self._children[key] = self.plan.node(subschema)
+        return node
+
+    def items(self) -> "_MergeNode":
+        """Get the node for items of arrays merged with this node."""
+        if self._items is None:
+            items = self.schema.get("items")
+            if isinstance(items, list):
+                raise SchemaError(
+                    "'arrayMergeById' not supported when 'items' is an array", items
+                )
+            self._items = self.plan.node(items)
+        return self._items
+
+    def get_id(self, item):
+        """Get the `idRef` value of `item`, or `_UNDEF` if it has none."""
+        for part in self.id_parts:
+            if isinstance(item, list):
+                try:
+                    part = int(part)
+                except ValueError:
+                    pass
+            try:
+                item = item[part]
+            except (TypeError, LookupError):
+                return _UNDEF
+        return item
+
+
+class MergePlan:
+    """
+    Merge strategies compiled from a schema's `mergeStrategy` and `mergeOptions` annotations.
+    This merges documents like a `jsonmerge.Merger` with `PRISM_MERGE_STRATEGIES` would, but
+    looks up `arrayMergeById` items in hash indexes rather than by scanning arrays.
+    """
+
+    def __init__(self, schema: dict):
+        self.schema = schema
+        # jsonmerge validates `oneOf` subschemas and resolves `$ref`s using draft 4
+        self.validator = jsonschema.Draft4Validator(schema)
+        self._nodes: Dict[int, Tuple[dict, _MergeNode]] = {}
+        self._undef_node = _MergeNode(self, None)
+        self.root = self.node(schema)
+
+    def node(self, schema: Optional[dict]) -> _MergeNode:
+        """Get the (lazily compiled) node for `schema`."""
+        if schema is None:
+            return self._undef_node
+
+        cached = self._nodes.get(id(schema))
+        if cached is not None:
+            return cached[1]
+
+        if "$ref" in schema:
+            _, resolved = self.validator.resolver.resolve(schema["$ref"])
+            node = self.node(resolved)
+        else:
+            node = _MergeNode(self, schema)
+        # keep a reference to `schema` so its id isn't reused
+        self._nodes[id(schema)] = (schema, node)
+        return node
+
+    def merge(self, base, head):
+        """
+        Merge `head` into `base`, without modifying either of them. Raises the same
+        exceptions as `jsonmerge`, except that `JSONMergeError`s don't point at the
+        offending part of the document.
+        """
+        return _MergeRun(self).merge(base, head)
+
+    def builder(self) -> "MergeBuilder":
+        return MergeBuilder(self)
+
+
+# The most merge plans and jsonmerge `Merger`s to keep before evicting the least recently used
+MAX_CACHED_MERGERS = 128
+
+# Merge plans by the id of the schema they were compiled from
+_MERGE_PLANS: "OrderedDict[int, Tuple[dict, MergePlan]]" = OrderedDict()
+_MERGE_PLANS_LOCK = threading.Lock()
+
+
+def get_merge_plan(schema: dict) -> MergePlan:
+    """
+    Get the merge plan for `schema`, compiling it only the first time it's requested.
+    Plans can be shared between threads, since each merge keeps its own state.
+    """
+    with _MERGE_PLANS_LOCK:
+        cached = _MERGE_PLANS.get(id(schema))
+        if cached is not None and cached[0] is schema:
+            _MERGE_PLANS.move_to_end(id(schema))
+            return cached[1]
+
+        plan = MergePlan(schema)
+        # keep a reference to `schema` so its id isn't reused
+        _MERGE_PLANS[id(schema)] = (schema, plan)
+        while len(_MERGE_PLANS) > MAX_CACHED_MERGERS:
+            _MERGE_PLANS.popitem(last=False)
+        return plan
+
+
+# jsonmerge `Merger`s by the ids of their schema and strategies. A `Merger` pushes
+# and pops `$ref` scopes on its resolver while merging, so each thread has its own,
+# held in a `threading.local` that's shared by every thread.
+_MERGERS: "OrderedDict[tuple, Tuple[dict, dict, threading.local]]" = OrderedDict()
+_MERGERS_LOCK = threading.Lock()
+
+
+def get_merger(schema: dict, strategies: Optional[dict] = None) -> Merger:
+    """
+    Get a `jsonmerge.Merger` for `schema` with `strategies` (`PRISM_MERGE_STRATEGIES`
+    by default), constructing it only the first time it's requested on this thread.
+    """
+    if strategies is None:
+        strategies = PRISM_MERGE_STRATEGIES
+
+    key = (id(schema), frozenset((name, id(s)) for name, s in strategies.items()))
+    with _MERGERS_LOCK:
+        cached = _MERGERS.get(key)
+        if cached is None or cached[0] is not schema:
+            # keep references to `schema` and `strategies` so their ids aren't reused
+            cached = _MERGERS[key] = (schema, dict(strategies), threading.local())
+        _MERGERS.move_to_end(key)
+        while len(_MERGERS) > MAX_CACHED_MERGERS:
+            _MERGERS.popitem(last=False)
+
+    thread_mergers = cached[2]
+    merger = getattr(thread_mergers, "merger", None)
+    if merger is None:
+        merger = thread_mergers.merger = Merger(schema, strategies=strategies)
+    return merger
+
+
+def _drop_mergers(schema: Optional[dict]):
+    """Drop merge plans and mergers for `schema`, or all of them if it's None."""
+    with _MERGE_PLANS_LOCK:
+        if schema is None:
+            _MERGE_PLANS.clear()
+        else:
+            cached = _MERGE_PLANS.get(id(schema))
+            if cached is not None and cached[0] is schema:
+                del _MERGE_PLANS[id(schema)]
+
+    with _MERGERS_LOCK:
+        for key, cached in list(_MERGERS.items()):
+            if schema is None or cached[0] is schema:
+                del _MERGERS[key]
+
+
+# merge plans and mergers hold on to their schemas, so drop them along with the schemas
+schema_registry.add_drop_callback(_drop_mergers)
+
+
+class _MergeRun:
+    """
+    State for merging documents with a `MergePlan`. Containers created while merging are
+    "owned" by the run and updated in place. Other containers are copied before they're
+    updated, so unchanged subtrees are shared with the inputs, as with jsonmerge.
+    If `journal` is a list, in-place updates are recorded there so they can be undone.
+    """
+
+    def __init__(self, plan: MergePlan):
+        self.plan = plan
+        # hold on to owned containers, so their ids aren't reused
+        self._owned: Dict[int, Union[dict, list]] = {}
+        self._indexes: Dict[Tuple[int, str], dict] = {}
+        self.journal: Optional[List[Callable]] = None
+
+    def merge(self, base, head):
+        if base is None:
+            base = _UNDEF
+        merged = self.descend(self.plan.root, base, head, "#")
+        return None if merged is _UNDEF else merged
+
+    def undo(self):
+        while self.journal:
+            self.journal.pop()()
+
+    def descend(self, node: _MergeNode, base, head, key):
+        if node.one_of is not None:
+            node = self._select_one_of(node, base, head)
+        if node.error is not None:
+            raise node.error
+        strategy = node.strategy
+        if strategy is None:
+            strategy = "objectMerge" if isinstance(head, dict) else "overwrite"
+        return _MERGE_FUNCTIONS[strategy](self, node, base, head, key)
+
+    def _select_one_of(self, node: _MergeNode, base, head) -> _MergeNode:
+        def is_valid(value, schema):
+            if value is _UNDEF:
+                return True
+            return not any(self.plan.validator.iter_errors(value, schema))
+
+        valid = [
+            subschema
+            for subschema in node.one_of
+            if is_valid(base, subschema) and is_valid(head, subschema)
+        ]
+        if len(valid) == 0:
+            raise HeadInstanceError(
+                "No element of 'oneOf' validates both base and head", head
+            )
+        if len(valid) > 1:
+            raise HeadInstanceError("Multiple elements of 'oneOf' validate", head)
+        return self.plan.node(valid[0])
+
+    def _own(self, container):
+        """Get a version of `container` that can be updated in place."""
+        if id(container) in self._owned:
+            return container
+        return self._new(type(container)(container))
+
+    def _new(self, container):
+        self._owned[id(container)] = container
+        return container
+
+    def _set(self, container, key, value):
+        if self.journal is not None:
+            if isinstance(container, list):
+                old = container[key]
+                self.journal.append(lambda: container.__setitem__(key, old))
+            elif key in container:
+                old = container[key]
+                self.journal.append(lambda: container.__setitem__(key, old))
+            else:
+                self.journal.append(lambda: container.pop(key))
+        container[key] = value
+
+    def _delete(self, container: dict, key):
+        if key in container:
+            if self.journal is not None:
+                old = container[key]
+                self.journal.append(lambda: container.__setitem__(key, old))
+            del container[key]
+
+    def _extend(self, container: list, values: list):
+        if self.journal is not None:
+            length = len(container)
+            self.journal.append(lambda: container.__delitem__(slice(length, None)))
+        container.extend(values)
+
+    def _index(self, node: _MergeNode, container: list) -> dict:
+        """Get an index from `idRef` values to positions in an owned `container`."""
+        index = self._indexes.get((id(container), node.id_ref))
+        if index is None:
+            index = self._indexes[(id(container), node.id_ref)] = {}
+            for position, item in enumerate(container):
+                item_id = node.get_id(item)
+                if item_id is not _UNDEF:
+                    index.setdefault(_hashable(item_id), []).append(position)
+        return index
+
+    def _add_to_index(self, index: dict, item_id, position: int):
+        positions = index.setdefault(_hashable(item_id), [])
+        positions.append(position)
+        if self.journal is not None:
+            self.journal.append(positions.pop)
+
+
+def _hashable(value):
+    try:
+        hash(value)
+        return value
+    except TypeError:
+        return ("unhashable", json.dumps(value, sort_keys=True))
+
+
+def _merge_overwrite(run: _MergeRun, node: _MergeNode, base, head, key):
+    """Like `ThrowOnOverwrite`"""
+    if base is _UNDEF:
+        return head
+    if base != head:
+        raise MergeCollisionException(_escape_ref(key), base, head)
+    return base
+
+
+def _merge_overwrite_any(run: _MergeRun, node: _MergeNode, base, head, key):
+    return head
+
+
+def _merge_discard(run: _MergeRun, node: _MergeNode, base, head, key):
+    if base is _UNDEF and node.keep_if_undef:
+        return head
+    return base
+
+
+def _merge_append(run: _MergeRun, node: _MergeNode, base, head, key):
+    if not isinstance(head, list):
+        raise HeadInstanceError(
+            "Head for an 'append' merge strategy is not an array", head
+        )
+    if base is _UNDEF:
+        base = run._new([])
+    elif not isinstance(base, list):
+        raise BaseInstanceError(
+            "Base for an 'append' merge strategy is not an array", base
+        )
+    else:
+        base = run._own(base)
+    run._extend(base, head)
+    return base
+
+
+def _merge_object(run: _MergeRun, node: _MergeNode, base, head, key):
+    """Like `ObjectMergeWithContextForMergeCollision`"""
+    if not isinstance(head, dict):
+        raise HeadInstanceError(
+            "Head for an 'object' merge strategy is not an object", head
+        )
+    if base is _UNDEF:
+        base = run._new({})
+    elif not isinstance(base, dict):
+        raise BaseInstanceError(
+            "Base for an 'object' merge strategy is not an object", base
+        )
+    else:
+        base = run._own(base)
+
+    try:
+        for k, v in head.items():
+            old = base.get(k)
+            merged = run.descend(node.child(k), _UNDEF if old is None else old, v, k)
+            if merged is _UNDEF:
+                run._delete(base, k)
+            elif merged is not old or k not in base:
+                run._set(base, k, merged)
+    except MergeCollisionException as e:
+        raise e.set_object_context(head)
+
+    return base
+
+
+def _merge_array_by_id(run: _MergeRun, node: _MergeNode, base, head, key):
+    """Like `ArrayMergeByIdWithContextForMergeCollision`"""
+    if not isinstance(head, list):
+        raise HeadInstanceError(
+            "Head for an 'arrayMergeById' merge strategy is not an array", head
+        )
+    if base is _UNDEF:
+        base = run._new([])
+    elif not isinstance(base, list):
+        raise BaseInstanceError(
+            "Base for an 'arrayMergeById' merge strategy is not an array", base
+        )
+    else:
+        base = run._own(base)
+
+    items = node.items()
+    head_ids = [node.get_id(item) for item in head]
+    seen_ids = set()
+    for item, item_id in zip(head, head_ids):
+        if item_id is _UNDEF:
+            continue
+        if _hashable(item_id) in seen_ids:
+            raise HeadInstanceError(f"Id '{item_id}' was not unique in head", item)
+        seen_ids.add(_hashable(item_id))
+
+    index = run._index(node, base)
+    try:
+        for item, item_id in zip(head, head_ids):
+            if item_id is _UNDEF or item_id == node.ignore_id:
+                continue
+
+            positions = index.get(_hashable(item_id), ())
+            if len(positions) == 1:
+                j = positions[0]
+                merged = run.descend(items, base[j], item, j)
+                if merged is not base[j]:
+                    run._set(base, j, merged)
+            elif len(positions) == 0:
+                merged = run.descend(items, _UNDEF, item, len(base))
+                if merged is not _UNDEF:
+                    run._add_to_index(index, item_id, len(base))
+                    run._extend(base, [merged])
+            else:
+                raise BaseInstanceError(
+                    f"Id '{item_id}' was not unique in base", base[positions[1]]
+                )
+    except MergeCollisionException as e:
+        ctx_val = node.get_id(e.object_context)
+        if ctx_val is _UNDEF:
+            raise
+        raise e.with_context(**{node.id_name: ctx_val})
+
+    return base
+
+
+_MERGE_FUNCTIONS = {
+    "overwrite": _merge_overwrite,
+    "overwriteAny": _merge_overwrite_any,
+    "discard": _merge_discard,
+    "append": _merge_append,
+    "objectMerge": _merge_object,
+    "arrayMergeById": _merge_array_by_id,
+}
+
+
+class MergeBuilder:
+    """
+    Accumulates objects by merging each one into the result in place, so that adding
+    `n` objects takes time linear in `n`, rather than quadratic as with repeated
+    `jsonmerge.Merger.merge` calls. If adding an object fails, the result is left as it
+    was before the object was added.
+    """
+
+    def __init__(self, plan: MergePlan):
+        self._run = _MergeRun(plan)
+        self._result = _UNDEF
+
+    def add(self, obj):
+        """Merge `obj` into the result, raising `MergeCollisionException` on conflicting values."""
+        self._run.journal = []
+        try:
+            self._result = self._run.descend(
+                self._run.plan.root, self._result, obj, "#"
+            )
+        except:
+            self._run.undo()
+            raise
+        finally:
+            self._run.journal = None
+
+    @property
+    def result(self):
+        return None if self._result is _UNDEF else self._result
+
+
+def merge_clinical_trial_metadata(
+    patch: dict, target: dict, incremental: bool = False, use_jsonmerge: bool = False
+) -> Tuple[dict, List[str]]:
     """
     Merges two clinical trial metadata objects together
     Args:
         patch: the metadata object to add
         target: the existing metadata object
+        incremental: if True, only validate the parts of the merged object that
+            the patch changed. This gives the same errors as validating the whole
+            merged object, provided `target` is itself valid.
+        use_jsonmerge: if True, merge with `jsonmerge` rather than with a `MergePlan`.
+            Both give the same results, but `jsonmerge` is much slower on large trials.
     Returns:
         arg1: the merged metadata object
         arg2: list of validation errors
@@ -314,7 +994,12 @@ def merge_clinical_trial_metadata(patch: dict, target: dict) -> Tuple[dict, List
         )
 
     # merge the two documents
-    merger = Merger(validator.schema, strategies=PRISM_MERGE_STRATEGIES)
-    merged = merger.merge(target, patch)
+    if use_jsonmerge:
+        merged = get_merger(validator.schema).merge(target, patch)
+    else:
+        merged = get_merge_plan(validator.schema).merge(target, patch)
 
-    return merged, list(validator.iter_error_messages(merged))
+    # the merger shares subtrees untouched by `patch` between `target` and `merged`,
+    # so in incremental mode, the validator skips over those
+    previous = target if incremental else None
+    return merged, list(validator.iter_error_messages(merged, previous=previous))
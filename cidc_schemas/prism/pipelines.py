@@ -7,7 +7,6 @@ from tempfile import NamedTemporaryFile
 from typing import Dict, List, NamedTuple, Union
 
 import jinja2
-import pandas as pd
 
 from .constants import PROTOCOL_ID_FIELD_NAME, SUPPORTED_SHIPPING_MANIFESTS
 from ..template import Template
@@ -365,6 +364,9 @@ class _Wes_pipeline_config:
         batch_runs: List[_AnalysisRun],
         data_bucket: str,
     ) -> bytes:
+        # pandas is slow to import, and only needed for batch configs
+        import pandas as pd
+
         df = pd.DataFrame(columns=WES_CONFIG_COLUMN_NAMES)
 
         for n, run in enumerate(batch_runs):
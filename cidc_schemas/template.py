@@ -7,6 +7,7 @@ import os.path
 import logging
 import uuid
 import json
+import functools
 import jsonschema
 import re
 from typing import (
@@ -23,11 +24,9 @@ from typing import (
 from collections import defaultdict
 
 from .constants import ANALYSIS_TEMPLATE_DIR, SCHEMA_DIR, TEMPLATE_DIR
-from .json_validation import _load_dont_validate_schema
+from .json_validation import compile_instance_validator, schema_registry
 from .util import get_file_ext
 
-from cidc_ngs_pipeline_api import OUTPUT_APIS
-
 logger = logging.getLogger("cidc_schemas.template")
 
 
@@ -67,15 +66,18 @@ def generate_analysis_template_schemas(
     fname_format: Callable[[str], str] = lambda file: f"{file}_analysis_template.json",
 ):
     """Uses output_API.json's from cidc-ngs-pipeline-api along with existing assays/components/ngs analysis templates to generate templates/analyses schemas"""
+    from cidc_ngs_pipeline_api import OUTPUT_APIS
+
     # for each output_API.json
     for analysis, output_schema in OUTPUT_APIS.items():
         # try to convert it, but skip if it's not implemented
         # need an existing assay/components/ngs analysis schema to find merge pointers
         try:
-            assay_schema = _load_dont_validate_schema(
+            assay_schema = schema_registry.get(
                 f"assays/components/ngs/{analysis}/{analysis}_analysis.json"
                 if analysis in ["rna", "atacseq"]  # special cases currently
-                else f"assays/{analysis}_analysis.json"  # all others should be here
+                else f"assays/{analysis}_analysis.json",  # all others should be here
+                validate=False,
             )
         except Exception as e:
             print(
@@ -621,8 +623,12 @@ def _convert_api_to_template(name: str, schema: dict, assay_schema: dict):
     return template
 
 
-def _get_template_path_map() -> dict:
-    """Build a mapping from template schema types to template schema paths."""
+@functools.lru_cache(maxsize=1)
+def _get_template_path_map() -> Dict[str, str]:
+    """
+    Build a mapping from template schema types to template schema paths.
+    The template directory is only scanned once, on first use.
+    """
     path_map = {}
     for template_type_dir in os.listdir(TEMPLATE_DIR):
         abs_type_dir = os.path.join(TEMPLATE_DIR, template_type_dir)
@@ -635,7 +641,47 @@ def _get_template_path_map() -> dict:
     return path_map
 
 
-_TEMPLATE_PATH_MAP = _get_template_path_map()
+def __getattr__(name: str):
+    # `_TEMPLATE_PATH_MAP` is built on first access rather than at import
+    if name == "_TEMPLATE_PATH_MAP":
+        return _get_template_path_map()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_type_ref(schema_root: str, ref: str) -> dict:
+    """
+    Follow a template field's `type_ref` to the schema entry it points to.
+    Entries are shared between callers, so they mustn't be modified.
+    """
+    referer = {"$ref": ref}
+
+    resolver_cache = {}
+    schemas_dir = f"file://{schema_root}/schemas"
+    while "$ref" in referer:
+        # get the entry
+        resolver = jsonschema.RefResolver(schemas_dir, referer, resolver_cache)
+        _, referer = resolver.resolve(referer["$ref"])
+
+    return referer
+
+
+# Templates loaded by `Template.from_type`, keyed on template type
+_TEMPLATE_REGISTRY: Dict[str, "Template"] = {}
+
+
+def _drop_templates(schema: Optional[dict]):
+    """Drop templates built from `schema`, or every template if it's None, from the registry."""
+    if schema is None:
+        _TEMPLATE_REGISTRY.clear()
+        return
+    for template_type, template in list(_TEMPLATE_REGISTRY.items()):
+        if template.schema is schema:
+            _TEMPLATE_REGISTRY.pop(template_type, None)
+
+
+# keep templates only as long as the schemas they were built from
+schema_registry.add_drop_callback(_drop_templates)
 
 
 def generate_empty_template(schema_path: str, target_path: str):
@@ -727,6 +773,35 @@ class _FieldDef(NamedTuple):
         ):
             raise Exception(f"dict type gcs_uri_format should have 'format' def")
 
+    def compile_expressions(self):
+        """
+        Compile this field's `parse_through` and `gcs_uri_format` expressions, and compute
+        its facet group, so that's done once per template rather than once per value.
+        Expressions that aren't valid Python are logged now, and reported as a
+        `ParsingException` for each value processed with them; other errors are raised.
+        """
+        expressions = []
+        if self.parse_through:
+            expressions.append((_compile_parse_through, self.parse_through))
+
+        if isinstance(self.gcs_uri_format, dict):
+            if "check_errors" in self.gcs_uri_format:
+                expressions.append(
+                    (_eval_template_lambda, self.gcs_uri_format["check_errors"])
+                )
+            expressions.append((_eval_template_lambda, self.gcs_uri_format["format"]))
+            expressions.append((_get_facet_group, self.gcs_uri_format["format"]))
+        elif self.gcs_uri_format:
+            expressions.append((_get_facet_group, self.gcs_uri_format))
+
+        for compile_expression, expression in expressions:
+            try:
+                compile_expression(expression)
+            except (SyntaxError, NameError) as e:
+                logger.warning(
+                    f"Invalid expression for {self.key_name!r}: {expression!r}: {e}"
+                )
+
     def process_value(
         self, raw_val, format_context: dict, encrypt_fn: Callable
     ) -> Tuple[List[AtomicChange], List[LocalFileUploadEntry]]:
@@ -743,7 +818,9 @@ class _FieldDef(NamedTuple):
 
         if self.parse_through:
             try:
-                raw_val = eval(self.parse_through, format_context, {})(raw_val)
+                # parse_through lambdas may refer to format_context values, like `folder`
+                parse_through = _compile_parse_through(self.parse_through)
+                raw_val = eval(parse_through, format_context, {})(raw_val)
 
             # catching everything, because of eval
             except Exception as e:
@@ -854,14 +931,17 @@ class _FieldDef(NamedTuple):
         # or it could be a dict
         if isinstance(self.gcs_uri_format, dict):
             if "check_errors" in self.gcs_uri_format:
-                # `eval` should be fine, as we're controlling the code argument in templates
-                err = eval(self.gcs_uri_format["check_errors"])(local_path)
+                check_errors = _eval_template_lambda(
+                    self.gcs_uri_format["check_errors"]
+                )
+                err = check_errors(local_path)
                 if err:
                     raise ParsingException(err)
 
             format = self.gcs_uri_format["format"]
-            # `eval` should be fine, as we're controlling the code argument in templates
-            try_formatting = lambda: eval(format)(local_path, format_context)
+            try_formatting = lambda: _eval_template_lambda(format)(
+                local_path, format_context
+            )
 
         try:
             gs_key = try_formatting()
@@ -902,9 +982,23 @@ class ParsingException(ValueError):
     pass
 
 
+@functools.lru_cache(maxsize=None)
+def _compile_parse_through(parse_through: str):
+    """Compile a `parse_through` lambda expression, to be evaluated against a format context"""
+    return compile(parse_through, "<parse_through>", "eval")
+
+
+@functools.lru_cache(maxsize=None)
+def _eval_template_lambda(code: str) -> Callable:
+    """Evaluate a lambda expression from a template's `gcs_uri_format`"""
+    # `eval` should be fine, as we're controlling the code argument in templates
+    return eval(code)
+
+
 _empty_defaultdict: Dict[str, str] = defaultdict(str)
 
 
+@functools.lru_cache(maxsize=None)
 def _get_facet_group(gcs_uri_format: str) -> str:
     """ "
     Extract a file's facet group from its GCS URI format string by removing
@@ -949,6 +1043,7 @@ class Template:
         self.schema_root = schema_root
         self.worksheets = self._extract_worksheets()
         self.key_lu = self._load_keylookup()
+        self._cell_validators: Dict[int, Callable] = {}
 
     def __repr__(self):
         return f"<Template({self.type})>"
@@ -1015,16 +1110,7 @@ class Template:
             Python function pointer
         """
 
-        referer = {"$ref": ref}
-
-        resolver_cache = {}
-        schemas_dir = f"file://{self.schema_root}/schemas"
-        while "$ref" in referer:
-            # get the entry
-            resolver = jsonschema.RefResolver(schemas_dir, referer, resolver_cache)
-            _, referer = resolver.resolve(referer["$ref"])
-
-        entry = referer
+        entry = _resolve_type_ref(self.schema_root, ref)
 
         return self._get_typed_entry_coerce(entry)
 
@@ -1136,6 +1222,7 @@ class Template:
                 coerce = self._get_coerce(def_dict)
                 fd = _FieldDef(key_name=key_name, coerce=coerce, **def_dict)
                 fd.artifact_checks()
+                fd.compile_expressions()
             except Exception as e:
                 raise Exception(f"Couldn't load mapping for {key_name!r}: {e}") from e
 
@@ -1272,6 +1359,20 @@ class Template:
 
         return changes, files
 
+    def get_cell_validator(
+        self, field_schema: dict
+    ) -> Callable[[Any, bool], Optional[str]]:
+        """
+        Get a function `(value, is_required) -> Optional[str]` validating cell values
+        against `field_schema`, a field schema from `self.worksheets`. Validators are
+        compiled on first use and reused for the lifetime of this `Template`.
+        """
+        # field schemas are owned by this template, so their ids are stable
+        key = id(field_schema)
+        if key not in self._cell_validators:
+            self._cell_validators[key] = compile_instance_validator(field_schema)
+        return self._cell_validators[key]
+
     # XlTemplateReader only knows how to format these types of sections
     VALID_WS_SECTIONS = set(
         [
@@ -1296,12 +1397,23 @@ class Template:
 
     @staticmethod
     def from_type(template_type: str):
-        """Load a Template from a template type, e.g., "pbmc" or "wes"."""
+        """
+        Load a Template from a template type, e.g., "pbmc" or "wes".
+        Each template type is only loaded once per process, and the resulting
+        Template is shared between callers.
+        """
+        template = _TEMPLATE_REGISTRY.get(template_type)
+        if template is not None:
+            return template
+
         try:
-            schema_path = _TEMPLATE_PATH_MAP[template_type]
+            schema_path = _get_template_path_map()[template_type]
         except KeyError:
             raise NotImplementedError(f"unknown template type: {template_type}")
-        return Template.from_json(schema_path, type=template_type)
+
+        template_schema = schema_registry.get(schema_path, validate=False)
+        template = Template(template_schema, type=template_type)
+        return _TEMPLATE_REGISTRY.setdefault(template_type, template)
 
     @staticmethod
     def from_json(
@@ -1314,7 +1426,9 @@ class Template:
             template_schema_path {str} -- path to the template schema file
             schema_root {str} -- path to the directory where all schemas are stored
         """
-        template_schema = _load_dont_validate_schema(template_schema_path, schema_root)
+        template_schema = schema_registry.get(
+            template_schema_path, schema_root, validate=False
+        )
 
         return Template(
             template_schema,
@@ -18,7 +18,6 @@ import openpyxl
 
 from .template import Template
 from .template_writer import RowType, row_type_from_string
-from .json_validation import validate_instance
 
 logger = logging.getLogger("cidc_schemas.template_reader")
 
@@ -65,12 +64,14 @@ class XlTemplateReader:
         return clean[::-1]
 
     @staticmethod
-    def from_excel(xlsx_path: Union[str, BinaryIO]):
+    def from_excel(xlsx_path: Union[str, BinaryIO], read_only: bool = True):
         """
         Initialize an Excel template reader from an excel file.
 
         Arguments:
           xlsx_path {Union[str, BinaryIO]} -- path to the Excel file or the open file itself.
+          read_only {bool} = True -- whether to stream the workbook's cell values rather than
+                loading every cell (and its styles) into memory. Both modes produce the same output.
 
         Returns:
             arg1: XlTemplateReader or None if errors
@@ -78,8 +79,15 @@ class XlTemplateReader:
         """
 
         # Load the Excel file
-        workbook = openpyxl.load_workbook(xlsx_path)
+        workbook = openpyxl.load_workbook(xlsx_path, read_only=read_only)
+        try:
+            return XlTemplateReader._read_workbook(workbook)
+        finally:
+            # read-only workbooks hold the underlying file open until closed
+            workbook.close()
 
+    @staticmethod
+    def _read_workbook(workbook: openpyxl.Workbook):
         template = {}
         errors = []
         for worksheet_name in workbook.sheetnames:
@@ -87,64 +95,85 @@ class XlTemplateReader:
                 continue
 
             worksheet = workbook[worksheet_name]
-            rows = []
-            header_width = 0
-            for row_num, row in enumerate(worksheet.iter_rows(), start=1):
-                # Convert to string and extract type annotation
-                typ, *values = [col.value for col in row]
-                row_type = row_type_from_string(typ)
-
-                # If entire row is empty, skip it (this happens at the bottom of the data table, e.g.)
-                if not any(values):
-                    continue
+            if workbook.read_only:
+                # read-only worksheets stop at the size stored in the file, which
+                # may be stale, so read every row (their widths are evened out below)
+                worksheet.reset_dimensions()
+            template[worksheet_name] = list(
+                XlTemplateReader._iter_worksheet_rows(worksheet, worksheet_name, errors)
+            )
 
-                # If no recognized row type is found but the row has data, throw an error
-                if not row_type:
-                    raise ValidationError(
-                        f"No recognized row type found in row {worksheet_name}/{row_num}.\n"
-                        f"Add #skip to column A to skip this row.\n"
-                        f"Add #title to column A if this is a preamble row.\n"
-                        f"Add #preamble to column A if this is a preamble row.\n"
-                        f"Add #header to column A if this is a data header row.\n"
-                        f"Add #data to column A if this is a data row."
-                    )
+        return XlTemplateReader(template), errors
 
-                # Filter empty cells from the end of the row
-                if row_type == RowType.HEADER:
-                    values = XlTemplateReader._clean_value_row(values)
-                    header_width = len(values)
+    @staticmethod
+    def _iter_worksheet_rows(worksheet, worksheet_name: str, errors: List[str]):
+        """
+        Build a `TemplateRow` from each row of cell values as the worksheet yields it,
+        appending any problems found to `errors`.
+        """
+        sheet_width = 0
+        unpadded_rows = []
+        header_width = 0
+        for row_num, row in enumerate(worksheet.iter_rows(values_only=True), start=1):
+            sheet_width = max(sheet_width, len(row))
+            # Extract type annotation (read-only worksheets without
+            # dimensions may yield empty tuples for empty rows)
+            typ, *values = row or (None,)
+            row_type = row_type_from_string(typ)
+
+            # If entire row is empty, skip it (this happens at the bottom of the data table, e.g.)
+            if not any(values):
+                continue
 
-                # Filter empty cells from the end of a data row
-                elif row_type == RowType.DATA:
-                    if not header_width:
-                        errors.append(
-                            f"Encountered data row (#{row_num} in worksheet {worksheet_name!r}) before header row"
-                        )
+            # If no recognized row type is found but the row has data, throw an error
+            if not row_type:
+                raise ValidationError(
+                    f"No recognized row type found in row {worksheet_name}/{row_num}.\n"
+                    f"Add #skip to column A to skip this row.\n"
+                    f"Add #title to column A if this is a preamble row.\n"
+                    f"Add #preamble to column A if this is a preamble row.\n"
+                    f"Add #header to column A if this is a data header row.\n"
+                    f"Add #data to column A if this is a data row."
+                )
 
-                    values = XlTemplateReader._clean_value_row(values)
-                    if len(values) > header_width:
-                        errors.append(
-                            f"Encountered data row (#{row_num} in worksheet {worksheet_name!r}) wider than header row"
-                        )
+            # Filter empty cells from the end of the row
+            if row_type == RowType.HEADER:
+                values = XlTemplateReader._clean_value_row(values)
+                header_width = len(values)
 
-                elif row_type == RowType.PREAMBLE:
-                    values = XlTemplateReader._clean_value_row(values)
+            # Filter empty cells from the end of a data row
+            elif row_type == RowType.DATA:
+                if not header_width:
+                    errors.append(
+                        f"Encountered data row (#{row_num} in worksheet {worksheet_name!r}) before header row"
+                    )
 
-                    # preamble rows are [key, value], therefore must have exactly two entries
-                    # if the value is optional and missing (ie None), will only get [key] after _clean_value_row, so add back None
-                    if len(values) == 1:
-                        values.append(None)
-                    elif len(values) != 2:
-                        errors.append(
-                            f"Encountered preamble row in worksheet with width {len(values)} (expected 2)"
-                        )
+                values = XlTemplateReader._clean_value_row(values)
+                if len(values) > header_width:
+                    errors.append(
+                        f"Encountered data row (#{row_num} in worksheet {worksheet_name!r}) wider than header row"
+                    )
 
-                # Reassemble parsed row and add to rows
-                new_row = TemplateRow(row_num, row_type, values)
-                rows.append(new_row)
-            template[worksheet_name] = rows
+            elif row_type == RowType.PREAMBLE:
+                values = XlTemplateReader._clean_value_row(values)
 
-        return XlTemplateReader(template), errors
+                # preamble rows are [key, value], therefore must have exactly two entries
+                # if the value is optional and missing (ie None), will only get [key] after _clean_value_row, so add back None
+                if len(values) == 1:
+                    values.append(None)
+                elif len(values) != 2:
+                    errors.append(
+                        f"Encountered preamble row in worksheet with width {len(values)} (expected 2)"
+                    )
+
+            else:
+                unpadded_rows.append(values)
+
+            yield TemplateRow(row_num, row_type, values)
+
+        # rows that weren't cleaned above span the whole sheet, as when fully loaded
+        for values in unpadded_rows:
+            values.extend([None] * (sheet_width - 1 - len(values)))
 
     def _group_worksheet_rows(self) -> Dict[str, RowGroup]:
         """Map worksheet names to rows grouped by row type"""
@@ -205,7 +234,7 @@ class XlTemplateReader:
 
     def iter_errors(self, template: Template) -> List[str]:
         for name, schema in template.worksheets.items():
-            yield from self._validate_worksheet(name, schema)
+            yield from self._validate_worksheet(name, schema, template)
 
     def validate(self, template: Template) -> bool:
         """
@@ -231,14 +260,14 @@ class XlTemplateReader:
     ) -> str:
         return f"Error in worksheet {worksheet_name!r}, row {row_num}, field {field_name!r}: {message}"
 
-    def _validate_instance(self, value, schema):
+    def _validate_instance(self, value, schema, template: Template):
         # All fields in an Excel template are required
         # except for "allow_empty"
-        return validate_instance(
-            value, schema, is_required=(not schema.get("allow_empty"))
-        )
+        return template.get_cell_validator(schema)(value, not schema.get("allow_empty"))
 
-    def _validate_worksheet(self, worksheet_name: str, ws_schema: dict) -> List[str]:
+    def _validate_worksheet(
+        self, worksheet_name: str, ws_schema: dict, template: Template
+    ) -> List[str]:
         """Validate rows in a worksheet, returning a list of validation error messages."""
         self.visited_fields.clear()
 
@@ -264,7 +293,7 @@ class XlTemplateReader:
                         worksheet_name, key, row.row_num, error
                     )
                     continue
-                invalid_reason = self._validate_instance(value, schema)
+                invalid_reason = self._validate_instance(value, schema, template)
 
                 if invalid_reason:
                     yield self._make_validation_error(
@@ -330,7 +359,7 @@ class XlTemplateReader:
                     if isinstance(value, str):
                         value = value.strip()
 
-                    invalid_reason = self._validate_instance(value, schema)
+                    invalid_reason = self._validate_instance(value, schema, template)
 
                     if invalid_reason:
                         yield self._make_validation_error(
@@ -1,12 +1,40 @@
 """Tools from extracting information from trial metadata blobs."""
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ThreadPoolExecutor
+from functools import lru_cache
 from io import StringIO, BytesIO
-from typing import Callable, Dict, List, NamedTuple, Optional, Union
+from itertools import islice
+from typing import (
+    IO,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
 
 import pandas as pd
 
-from . import prism
+from . import __version__, prism
+from .json_validation import load_and_validate_schema
 from .util import participant_id_from_cimac
 
+logger = logging.getLogger("cidc_schemas.unprism")
+
 
 class DeriveFilesContext(NamedTuple):
     trial_metadata: dict
@@ -16,12 +44,32 @@ class DeriveFilesContext(NamedTuple):
     #   * arg1 (str): object_url
     #   * arg2 (bool): if True, return artifact as StringIO, otherwise BytesIO.
     fetch_artifact: Callable[[str, bool], Optional[Union[StringIO, BytesIO]]]
+    # max_workers:
+    #   * if greater than 1, fetch and parse artifacts on a pool of up to this many threads.
+    #   * fetch_artifact must be thread-safe in that case.
+    max_workers: Optional[int] = None
+    # stream:
+    #   * if True, derivations that combine many artifacts write their output to a
+    #     temporary file as they go, and return that file as the Artifact's data.
+    stream: bool = False
+    # artifact_cache:
+    #   * if provided, parsed artifacts are looked up in and added to this cache, so that
+    #     only new or changed artifacts are fetched and parsed.
+    artifact_cache: Optional["ParsedArtifactCache"] = None
+    # output_format:
+    #   * one of OUTPUT_FORMATS. Tabular derived files are converted from CSV to
+    #     Parquet or Arrow IPC if requested, which requires pyarrow.
+    output_format: str = "csv"
     # TODO: add new attributes as needed?
 
 
+OUTPUT_FORMATS = ("csv", "parquet", "arrow")
+
+
 class Artifact(NamedTuple):
     object_url: str
-    data: Union[str, bytes]
+    # a file object, rewound to the start, for streamed derivations
+    data: Union[str, bytes, IO]
     file_type: str
     data_format: str
     metadata: Optional[dict]
@@ -32,6 +80,170 @@ class DeriveFilesResult(NamedTuple):
     trial_metadata: dict
 
 
+class ArtifactFetchError(Exception):
+    """Raised when an artifact needed for a file derivation can't be fetched or parsed."""
+
+    def __init__(self, object_url: str, cause: Exception):
+        self.object_url = object_url
+        super().__init__(f"Failed to fetch and parse {object_url}: {cause}")
+
+
+T = TypeVar("T")
+
+
+class ParsedArtifactCache:
+    """
+    An LRU cache of parsed artifacts, keyed by what was parsed, the artifact's object URL
+    and its content hash. This stores up to `max_size` artifacts in memory; override
+    `_load`, `_store`, `_remove` and `_size_of` to store them somewhere else; `_load`
+    should raise `LookupError` if an artifact has gone, so that it's parsed again.
+    `hits` and `misses` count lookups that did and didn't find a parsed artifact.
+    Parsers return None for artifacts that weren't found, so None is never cached.
+    """
+
+    def __init__(self, max_size: int = 128):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # sizes of cached artifacts, least recently used first
+        self._sizes: "OrderedDict[str, int]" = OrderedDict()
+        self._total_size = 0
+        self._values: Dict[str, object] = {}
+
+    @staticmethod
+    def make_key(parser: str, object_url: str, content_hash: str) -> str:
+        return hashlib.sha256(
+            "\0".join([__version__, parser, object_url, content_hash]).encode()
+        ).hexdigest()
+
+    def get_or_parse(self, key: str, parse: Callable[[], T]) -> T:
+        """
+        Get the parsed artifact for `key`, calling `parse` to make it on a miss
+        (and storing what it returns, unless that's None).
+        """
+        with self._lock:
+            cached = key in self._sizes
+            if cached:
+                self._sizes.move_to_end(key)
+
+        if cached:
+            try:
+                value = self._load(key)
+            except LookupError:
+                # e.g., removed by another process, so forget it and parse it again
+                with self._lock:
+                    if key in self._sizes:
+                        self._total_size -= self._sizes.pop(key)
+                        self._remove(key)
+            else:
+                with self._lock:
+                    self.hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+
+        value = parse()
+        if value is None:
+            # not found, but it may be uploaded later
+            return value
+
+        # store outside of the lock, since writing large artifacts can be slow
+        self._store(key, value)
+
+        with self._lock:
+            if key not in self._sizes:
+                try:
+                    size = self._size_of(key)
+                except OSError:
+                    # evicted by another thread storing the same artifact
+                    return value
+                self._add(key, size)
+                self._evict()
+        return value
+
+    def _add(self, key: str, size: int):
+        self._sizes[key] = size
+        self._total_size += size
+
+    def _evict(self):
+        while self._total_size > self.max_size and len(self._sizes) > 1:
+            key, size = self._sizes.popitem(last=False)
+            self._total_size -= size
+            self._remove(key)
+
+    def _load(self, key: str):
+        return self._values[key]
+
+    def _store(self, key: str, value):
+        self._values[key] = value
+
+    def _remove(self, key: str):
+        self._values.pop(key, None)
+
+    def _size_of(self, key: str) -> int:
+        return 1
+
+
+class DirectoryArtifactCache(ParsedArtifactCache):
+    """
+    A `ParsedArtifactCache` that pickles parsed artifacts into `cache_dir`, holding up to
+    `max_size` bytes of them. Artifacts already in `cache_dir` are reused, so the cache
+    persists across processes (though it shouldn't be used by more than one at a time).
+    """
+
+    def __init__(self, cache_dir: str, max_size: int = 2**30):
+        super().__init__(max_size)
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+        existing = [
+            entry
+            for entry in os.scandir(cache_dir)
+            if entry.is_file() and entry.name.endswith(".pickle")
+        ]
+        for entry in sorted(existing, key=lambda e: e.stat().st_mtime):
+            self._add(entry.name[: -len(".pickle")], entry.stat().st_size)
+        self._evict()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pickle")
+
+    def _load(self, key: str):
+        path = self._path(key)
+        try:
+            # record when the artifact was last used, for LRU order across processes
+            os.utime(path)
+            with open(path, "rb") as f:
+                return pickle.load(f)
+        except Exception as e:
+            # e.g., a missing or truncated file
+            logger.warning(f"Ignoring unreadable cached artifact {path}: {e}")
+            raise LookupError(key) from e
+
+    def _store(self, key: str, value):
+        path = self._path(key)
+        # write to a temporary file first so readers never see a partial artifact
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # the artifact is still returned, just not cached
+            logger.warning(f"Couldn't cache parsed artifact at {path}: {e}")
+
+    def _remove(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _size_of(self, key: str) -> int:
+        return os.path.getsize(self._path(key))
+
+
 _upload_type_derivations: Dict[
     str, Callable[[DeriveFilesContext], DeriveFilesResult]
 ] = {}
@@ -61,6 +273,21 @@ def derive_files(context: DeriveFilesContext) -> Optional[DeriveFilesResult]:
               * should return None if no artifact is found.
               * arg1 (str): object_url
               * arg2 (bool): if True, return artifact as StringIO, otherwise BytesIO.
+            max_workers: Optional[int] = None
+              * if greater than 1, fetch and parse artifacts on a pool of up to this many threads.
+              * fetch_artifact must be thread-safe in that case.
+            stream: bool = False
+              * if True, the MAF, NPX and CyTOF derivations write their output to a spooled
+                temporary file, so memory use is bounded by one input artifact rather than
+                the whole trial. The file is returned as the Artifact's data, and the caller
+                should close it. Values are copied as text rather than parsed into dataframes.
+            artifact_cache: Optional[ParsedArtifactCache] = None
+              * if provided, artifacts with a crc32c_hash or md5_hash in the trial metadata are
+                only fetched and parsed if they aren't already in the cache.
+            output_format: str = "csv"
+              * one of OUTPUT_FORMATS. "parquet" and "arrow" (Arrow IPC) require pyarrow, and
+                change derived tables' file extensions and data_format to match. Columns
+                described by the participant and sample schemas get the schemas' types.
 
     Returns
     -------
@@ -72,12 +299,86 @@ def derive_files(context: DeriveFilesContext) -> Optional[DeriveFilesResult]:
         None if context.upload_type does not have a defined file derivation
         all prism.SUPPORTED_SHIPPING_MANIFESTS are supported via _shipping_manifest_derivation()
         otherwise use wrapper @_register_derivation(upload_type: str)
+
+    Raises
+    ------
+    ArtifactFetchError
+        if an artifact needed for the derivation can't be fetched or parsed
+    ValueError
+        if context.output_format isn't one of OUTPUT_FORMATS
+    ImportError
+        if context.output_format requires pyarrow, and it isn't installed
     """
+    if context.output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Unsupported output_format {context.output_format!r}, expected one of {OUTPUT_FORMATS}"
+        )
+
     if context.upload_type in prism.SUPPORTED_SHIPPING_MANIFESTS:
-        return _shipping_manifest_derivation(context)
+        result = _shipping_manifest_derivation(context)
+    elif context.upload_type in _upload_type_derivations:
+        result = _upload_type_derivations[context.upload_type](context)
+    else:
+        return None
+
+    if context.output_format != "csv":
+        result = result._replace(
+            artifacts=[
+                _convert_artifact(artifact, context.output_format)
+                for artifact in result.artifacts
+            ]
+        )
+    return result
+
+
+async def derive_files_async(
+    context: DeriveFilesContext,
+    max_concurrency: int = 8,
+    executor: Optional[Executor] = None,
+) -> Optional[DeriveFilesResult]:
+    """
+    Like `derive_files`, but for use on an event loop, with a `context.fetch_artifact`
+    that is a coroutine function taking the same arguments.
 
-    if context.upload_type in _upload_type_derivations:
-        return _upload_type_derivations[context.upload_type](context)
+    Parameters
+    ----------
+    context: DeriveFilesContext(NamedTuple)
+        as for `derive_files`, except that `fetch_artifact` is async
+    max_concurrency: int = 8
+        the most artifacts to fetch at once. This is also the default for
+        `context.max_workers`, the number of threads that parse fetched artifacts.
+    executor: Optional[Executor] = None
+        where to run the derivation itself, which parses artifacts and builds the
+        derived files. Defaults to the event loop's default executor.
+
+    Returns
+    -------
+    Optional[DeriveFilesResult(NamedTuple)]
+        as for `derive_files`
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(max_concurrency)
+    fetch_artifact_async = context.fetch_artifact
+
+    async def fetch_artifact_limited(
+        object_url: str, as_string: bool
+    ) -> Optional[Union[StringIO, BytesIO]]:
+        async with semaphore:
+            return await fetch_artifact_async(object_url, as_string)
+
+    def fetch_artifact(
+        object_url: str, as_string: bool
+    ) -> Optional[Union[StringIO, BytesIO]]:
+        # derivations run on `executor`, so they can block on the event loop
+        return asyncio.run_coroutine_threadsafe(
+            fetch_artifact_limited(object_url, as_string), loop
+        ).result()
+
+    sync_context = context._replace(
+        fetch_artifact=fetch_artifact,
+        max_workers=context.max_workers or max_concurrency,
+    )
+    return await loop.run_in_executor(executor, derive_files, sync_context)
 
 
 def _build_artifact(
@@ -106,20 +407,429 @@ def _build_artifact(
     )
 
 
-def _shipping_manifest_derivation(context: DeriveFilesContext) -> DeriveFilesResult:
-    """Generate files derived from a shipping manifest upload."""
-    participants = pd.json_normalize(
-        data=context.trial_metadata,
-        record_path=["participants"],
-        meta=[prism.PROTOCOL_ID_FIELD_NAME],
+def _content_hash(artifact: dict, prefix: str = "") -> Optional[str]:
+    """
+    Get a hash of the contents of the artifact described by `artifact`, or of the
+    artifact at `prefix` if `artifact` is a flattened record from `pd.json_normalize`.
+    """
+    for hash_field in ["crc32c_hash", "md5_hash"]:
+        value = artifact.get(f"{prefix}{hash_field}")
+        if isinstance(value, str):
+            return f"{hash_field}:{value}"
+    return None
+
+
+def _iter_fetch_and_parse(
+    context: DeriveFilesContext,
+    fetch_and_parse: Callable[[str], T],
+    object_urls: Iterable[str],
+    content_hashes: Optional[Iterable[Optional[str]]] = None,
+) -> Iterator[T]:
+    """
+    Apply `fetch_and_parse` to each of `object_urls`, on a thread pool if
+    `context.max_workers` allows it, with no more than `context.max_workers`
+    artifacts in flight at once. Results are yielded in the same order as `object_urls`,
+    and the first URL (in that order) that fails raises an `ArtifactFetchError`.
+
+    If `content_hashes` are given, artifacts with a hash are looked up in
+    `context.artifact_cache` before they're fetched.
+    """
+    cache = context.artifact_cache
+    parser = fetch_and_parse.__qualname__
+
+    def fetch_and_parse_one(url_and_hash: Tuple[str, Optional[str]]) -> T:
+        object_url, content_hash = url_and_hash
+        try:
+            if cache is None or content_hash is None:
+                return fetch_and_parse(object_url)
+            return cache.get_or_parse(
+                cache.make_key(parser, object_url, content_hash),
+                lambda: fetch_and_parse(object_url),
+            )
+        except Exception as e:
+            raise ArtifactFetchError(object_url, e) from e
+
+    if content_hashes is None:
+        object_urls = ((url, None) for url in object_urls)
+    else:
+        object_urls = zip(object_urls, content_hashes)
+    if not context.max_workers or context.max_workers <= 1:
+        for url in object_urls:
+            yield fetch_and_parse_one(url)
+        return
+
+    with ThreadPoolExecutor(max_workers=context.max_workers) as pool:
+        futures = deque(
+            pool.submit(fetch_and_parse_one, url)
+            for url in islice(object_urls, context.max_workers)
+        )
+        try:
+            while futures:
+                result = futures.popleft().result()
+                for url in islice(object_urls, 1):
+                    futures.append(pool.submit(fetch_and_parse_one, url))
+                yield result
+        finally:
+            # don't bother fetching artifacts that haven't started yet
+            for future in futures:
+                future.cancel()
+
+
+def _fetch_and_parse_all(
+    context: DeriveFilesContext,
+    fetch_and_parse: Callable[[str], T],
+    object_urls: List[str],
+    content_hashes: Optional[List[Optional[str]]] = None,
+) -> List[T]:
+    """Like `_iter_fetch_and_parse`, but collects all results into a list."""
+    return list(
+        _iter_fetch_and_parse(context, fetch_and_parse, object_urls, content_hashes)
     )
-    samples = pd.json_normalize(
-        data=context.trial_metadata,
-        record_path=["participants", "samples"],
-        meta=[prism.PROTOCOL_ID_FIELD_NAME, ["participants", "cimac_participant_id"]],
+
+
+# Spooled files are kept in memory until they grow bigger than this
+_SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def _spooled_text_file() -> IO:
+    return tempfile.SpooledTemporaryFile(
+        max_size=_SPOOL_MAX_SIZE, mode="w+", newline=""
+    )
+
+
+class _RowSpool:
+    """
+    Collects rows with varying columns in a spooled temporary file, then writes them
+    as a CSV whose header is the union of all rows' columns, in order of appearance.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, None] = {}
+        self.rows = _spooled_text_file()
+
+    def add(self, row: dict):
+        self.columns.update(dict.fromkeys(row))
+        self.rows.write(json.dumps(row) + "\n")
+
+    def write_csv(self, **csv_kwargs) -> IO:
+        """Write the collected rows to a new spooled file, and return it rewound."""
+        out = _spooled_text_file()
+        writer = csv.DictWriter(
+            out, fieldnames=list(self.columns), lineterminator="\n", **csv_kwargs
+        )
+        writer.writeheader()
+        self.rows.seek(0)
+        for line in self.rows:
+            writer.writerow(json.loads(line))
+        self.rows.close()
+        out.seek(0)
+        return out
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.csv
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError(
+            "pyarrow is required for output formats other than csv: pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+# data_formats of derived artifacts that are CSV tables, and their delimiters
+_TABULAR_DATA_FORMATS = {"csv": ",", "maf": "\t", "npx|analysis_ready": ","}
+
+# number of header rows in analysis-ready NPX files:
+# Assay, Uniprot ID, Olink ID and LOD for each analyte
+_NPX_HEADER_ROWS = 4
+
+_JSON_TYPES_TO_ARROW_TYPES = {
+    "string": "string",
+    "integer": "int64",
+    "number": "float64",
+    "boolean": "bool_",
+}
+
+
+@lru_cache(maxsize=None)
+def _schema_column_types() -> Dict[str, str]:
+    """
+    Get the names of pyarrow types for derived table columns, based on the
+    participant and sample schemas.
+    """
+
+    def add_properties(schema: dict, prefix: str = ""):
+        for name, prop in schema.get("properties", {}).items():
+            json_type = prop.get("type")
+            if isinstance(json_type, list):
+                json_type = next((t for t in json_type if t != "null"), None)
+
+            if json_type == "object":
+                # pd.json_normalize flattens nested objects like this
+                add_properties(prop, f"{prefix}{name}.")
+            elif json_type in _JSON_TYPES_TO_ARROW_TYPES:
+                column_types[f"{prefix}{name}"] = _JSON_TYPES_TO_ARROW_TYPES[json_type]
+
+    column_types = {
+        prism.PROTOCOL_ID_FIELD_NAME: "string",
+        "participants.cimac_participant_id": "string",
+    }
+    add_properties(load_and_validate_schema("participant.json"))
+    add_properties(load_and_validate_schema("sample.json"))
+    return column_types
+
+
+def _convert_artifact(artifact: Artifact, output_format: str) -> Artifact:
+    """
+    Convert a derived CSV table to `output_format`, keeping streamed artifacts
+    streamed. Other artifacts are returned as they are.
+    """
+    if artifact.data_format not in _TABULAR_DATA_FORMATS:
+        return artifact
+
+    pa = _import_pyarrow()
+    streamed = not isinstance(artifact.data, (str, bytes))
+
+    # pyarrow reads bytes, not text
+    if streamed:
+        source = tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        with artifact.data as text:
+            for chunk in iter(lambda: text.read(2**20), ""):
+                source.write(chunk.encode())
+        source.seek(0)
+    elif isinstance(artifact.data, str):
+        source = BytesIO(artifact.data.encode())
+    else:
+        source = BytesIO(artifact.data)
+
+    delimiter = _TABULAR_DATA_FORMATS[artifact.data_format]
+    header_rows = [
+        next(csv.reader([source.readline().decode()], delimiter=delimiter))
+        for _ in range(
+            _NPX_HEADER_ROWS if artifact.data_format == "npx|analysis_ready" else 1
+        )
+    ]
+    source.seek(0)
+
+    if artifact.data_format == "npx|analysis_ready":
+        # NPX values are one row per sample, with a column per analyte
+        column_names = ["cimac_id", *header_rows[0][1:]]
+        column_types = {name: pa.float64() for name in column_names[1:]}
+        column_types["cimac_id"] = pa.string()
+        field_metadata = {
+            name: {row[0]: row[i] for row in header_rows[1:]}
+            for i, name in enumerate(column_names)
+            if i > 0
+        }
+        integer_columns = []
+    else:
+        column_names = header_rows[0]
+        schema_types = _schema_column_types()
+        column_types = {
+            name: getattr(pa, schema_types[name])()
+            for name in column_names
+            if name in schema_types
+        }
+        # pandas writes integer columns with missing values as floats, so read them
+        # as floats and convert them back below where we can
+        integer_columns = [
+            name for name, typ in column_types.items() if typ == pa.int64()
+        ]
+        for name in integer_columns:
+            column_types[name] = pa.float64()
+        if streamed:
+            # types are inferred from the first block of a streamed table, so don't
+            # infer them at all rather than risk later blocks not matching
+            for name in column_names:
+                column_types.setdefault(name, pa.string())
+        field_metadata = {}
+
+    read_options = pa.csv.ReadOptions(
+        column_names=column_names, skip_rows=len(header_rows)
     )
+    parse_options = pa.csv.ParseOptions(delimiter=delimiter)
+    convert_options = pa.csv.ConvertOptions(column_types=column_types)
+
+    if streamed:
+        batches = pa.csv.open_csv(
+            source,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+        schema = batches.schema
+    else:
+        table = pa.csv.read_csv(
+            source,
+            read_options=read_options,
+            parse_options=parse_options,
+            convert_options=convert_options,
+        )
+        for name in integer_columns:
+            i = table.schema.get_field_index(name)
+            try:
+                integers = pa.compute.cast(table[name], pa.int64())
+            except pa.ArrowInvalid:
+                continue
+            table = table.set_column(i, pa.field(name, pa.int64()), integers)
+        schema = table.schema
+        batches = table.to_batches()
+
+    schema = pa.schema(
+        [
+            field.with_metadata(field_metadata[field.name])
+            if field.name in field_metadata
+            else field
+            for field in schema
+        ]
+    )
+
+    sink = (
+        tempfile.SpooledTemporaryFile(max_size=_SPOOL_MAX_SIZE)
+        if streamed
+        else BytesIO()
+    )
+    if output_format == "parquet":
+        writer = pa.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+    with writer:
+        for batch in batches:
+            if output_format == "parquet":
+                writer.write_table(pa.Table.from_batches([batch], schema=schema))
+            else:
+                writer.write_batch(
+                    pa.RecordBatch.from_arrays(batch.columns, schema=schema)
+                )
+    source.close()
+
+    if streamed:
+        sink.seek(0)
+        data = sink
+    else:
+        data = sink.getvalue()
+
+    return artifact._replace(
+        object_url=f"{os.path.splitext(artifact.object_url)[0]}.{output_format}",
+        data=data,
+        data_format=output_format,
+    )
+
+
+# pandas dtypes for table columns with these JSON schema types. Other columns keep
+# their values as they are, so numbers are written just like they appear in the trial.
+_JSON_TYPES_TO_PANDAS_DTYPES = {"integer": "Int64", "boolean": "boolean"}
+
+
+@lru_cache(maxsize=None)
+def _schema_column_dtypes(schema_name: str) -> Dict[str, Optional[str]]:
+    """
+    Get the columns that records of `schema_name` are flattened into, in the order
+    the schema lists them, along with the pandas dtype to use for each.
+    """
+
+    def add_properties(schema: dict, prefix: str = ""):
+        for name, prop in schema.get("properties", {}).items():
+            json_type = prop.get("type")
+            if json_type == "object":
+                # nested objects are flattened like pd.json_normalize does
+                add_properties(prop, f"{prefix}{name}.")
+            elif isinstance(json_type, str):
+                dtypes[f"{prefix}{name}"] = _JSON_TYPES_TO_PANDAS_DTYPES.get(json_type)
+            else:
+                dtypes[f"{prefix}{name}"] = None
 
-    participants.drop("samples", axis=1, inplace=True, errors="ignore")
+    dtypes: Dict[str, Optional[str]] = {}
+    add_properties(load_and_validate_schema(schema_name))
+    return dtypes
+
+
+def _flatten(record: dict, prefix: str = "") -> Iterator[Tuple[str, object]]:
+    for key, value in record.items():
+        if isinstance(value, dict):
+            yield from _flatten(value, f"{prefix}{key}.")
+        else:
+            yield f"{prefix}{key}", value
+
+
+class _TableBuilder:
+    """
+    Builds a table from records described by `schema_name` one column at a time,
+    with columns in the schema's order. Columns without any values are left out, and
+    properties that the schema doesn't describe go after those that it does.
+    """
+
+    def __init__(self, schema_name: str, exclude: Iterable[str] = ()):
+        self.dtypes = _schema_column_dtypes(schema_name)
+        self.exclude = set(exclude)
+        self.columns: Dict[str, list] = {}
+        self.num_rows = 0
+
+    def add(self, record: dict, extra: Dict[str, object]):
+        """Add a row for `record`, followed by `extra` columns."""
+        for name, value in [*_flatten(record), *extra.items()]:
+            if name in self.exclude:
+                continue
+            column = self.columns.get(name)
+            if column is None:
+                column = self.columns[name] = [None] * self.num_rows
+            column.append(value)
+
+        self.num_rows += 1
+        for column in self.columns.values():
+            if len(column) < self.num_rows:
+                column.append(None)
+
+    def to_dataframe(self, extra_columns: List[str]) -> pd.DataFrame:
+        names = [
+            *(name for name in self.dtypes if name in self.columns),
+            *(
+                name
+                for name in self.columns
+                if name not in self.dtypes and name not in extra_columns
+            ),
+            *(name for name in extra_columns if name in self.columns),
+        ]
+
+        data = {}
+        for name in names:
+            dtype = self.dtypes.get(name) or object
+            try:
+                data[name] = pd.array(self.columns[name], dtype=dtype)
+            except (TypeError, ValueError):
+                # the trial has values that don't match the schema
+                data[name] = pd.array(self.columns[name], dtype=object)
+        return pd.DataFrame(data, columns=names)
+
+
+def _shipping_manifest_derivation(context: DeriveFilesContext) -> DeriveFilesResult:
+    """Generate files derived from a shipping manifest upload."""
+    participant_meta = [prism.PROTOCOL_ID_FIELD_NAME]
+    sample_meta = [prism.PROTOCOL_ID_FIELD_NAME, "participants.cimac_participant_id"]
+
+    # Flatten participants and samples in a single walk of the trial
+    participants_table = _TableBuilder("participant.json", exclude=["samples"])
+    samples_table = _TableBuilder("sample.json")
+    protocol_id = context.trial_metadata.get(prism.PROTOCOL_ID_FIELD_NAME)
+    for participant in context.trial_metadata.get("participants", []):
+        participants_table.add(participant, {prism.PROTOCOL_ID_FIELD_NAME: protocol_id})
+        for sample in participant.get("samples", []):
+            samples_table.add(
+                sample,
+                {
+                    prism.PROTOCOL_ID_FIELD_NAME: protocol_id,
+                    "participants.cimac_participant_id": participant.get(
+                        "cimac_participant_id"
+                    ),
+                },
+            )
+
+    participants = participants_table.to_dataframe(participant_meta)
+    samples = samples_table.to_dataframe(sample_meta)
 
     participants_csv = participants.to_csv(index=False)
     samples_csv = samples.to_csv(index=False)
@@ -232,39 +942,47 @@ def _olink_derivation(context: DeriveFilesContext) -> DeriveFilesResult:
 
         return None
 
-    return_files: Dict[str, pd.DataFrame] = {}
+    npx_files: Dict[str, dict] = {}
     if "object_url" in olink.get("study", {}).get("npx_file", {}):
-        study_npx = olink["study"]["npx_file"]
-        return_files["study_wide"] = download_and_parse_npx(study_npx["object_url"])
+        npx_files["study_wide"] = olink["study"]["npx_file"]
     else:
         for batch in olink.get("batches", []):
             if "combined" in batch:
-                batch_npx = batch["combined"]["npx_file"]
-                return_files[batch["batch_id"]] = download_and_parse_npx(
-                    batch_npx["object_url"]
-                )
+                npx_files[batch["batch_id"]] = batch["combined"]["npx_file"]
             elif len(batch.get("records", [])) == 1:
                 chip = batch["records"][0]
-                chip_npx = chip["files"]["assay_npx"]
-                return_files[chip["chip_barcode"]] = download_and_parse_npx(
-                    chip_npx["object_url"]
-                )
+                npx_files[chip["chip_barcode"]] = chip["files"]["assay_npx"]
             else:
                 raise Exception(
                     f"Olink for {context.trial_metadata.get(prism.constants.PROTOCOL_ID_FIELD_NAME)} batch {batch['batch_id']} has multiple chips but no batch-level summary file."
                 )
 
+    npx_dfs = _iter_fetch_and_parse(
+        context,
+        download_and_parse_npx,
+        [npx_file["object_url"] for npx_file in npx_files.values()],
+        [_content_hash(npx_file) for npx_file in npx_files.values()],
+    )
+    return_files: Dict[str, Union[str, IO]] = {}
+    for covers, df in zip(npx_files, npx_dfs):
+        if context.stream:
+            return_files[covers] = _spooled_text_file()
+            df.to_csv(return_files[covers])
+            return_files[covers].seek(0)
+        else:
+            return_files[covers] = df.to_csv()
+
     return DeriveFilesResult(
         [
             _build_artifact(
                 context,
                 file_name=f"all_samples_npx.{covers}.csv",
-                data=df.to_csv(),
+                data=npx_csv,
                 file_type="csv",
                 data_format="npx|analysis_ready",
                 include_upload_type=True,
             )
-            for covers, df in return_files.items()
+            for covers, npx_csv in return_files.items()
         ],
         context.trial_metadata,  # return metadata without updates
     )
@@ -279,6 +997,10 @@ def _wes_analysis_derivation(context: DeriveFilesContext) -> DeriveFilesResult:
         record_path=["analysis", "wes_analysis", "pair_runs"],
     )
     maf_urls = runs["somatic.maf_tnscope_filter.object_url"]
+    maf_hashes = [
+        _content_hash(run, prefix="somatic.maf_tnscope_filter.")
+        for run in runs.to_dict("records")
+    ]
 
     def download_and_parse_maf(maf_url: str) -> Optional[pd.DataFrame]:
         maf_stream = context.fetch_artifact(maf_url, True)
@@ -287,14 +1009,37 @@ def _wes_analysis_derivation(context: DeriveFilesContext) -> DeriveFilesResult:
             return pd.read_csv(maf_stream, sep="\t", skiprows=1)
         return None
 
-    # Download all sample-level MAF files as dataframes
-    maf_dfs = maf_urls.apply(download_and_parse_maf)
+    def download_and_read_maf_rows(maf_url: str) -> Optional[List[dict]]:
+        maf_stream = context.fetch_artifact(maf_url, True)
+        if not maf_stream:
+            return None
+        reader = csv.reader(maf_stream, delimiter="\t")
+        # First row will contain a comment, not headers, so skip it
+        next(reader, None)
+        header = next(reader, [])
+        return [dict(zip(header, row)) for row in reader if row]
 
-    # Combine all sample-level MAF dataframes
-    combined_maf_df = pd.concat(maf_dfs.values, join="outer")
+    if context.stream:
+        # Write sample-level MAF rows to a temporary file one file at a time
+        combined_rows = _RowSpool()
+        for maf_rows in _iter_fetch_and_parse(
+            context, download_and_read_maf_rows, maf_urls, maf_hashes
+        ):
+            for row in maf_rows or []:
+                combined_rows.add(row)
 
-    # Write the combined dataframe to tab-separated string
-    combined_maf = combined_maf_df.to_csv(sep="\t", index=False)
+        combined_maf = combined_rows.write_csv(delimiter="\t")
+    else:
+        # Download all sample-level MAF files as dataframes
+        maf_dfs = _fetch_and_parse_all(
+            context, download_and_parse_maf, list(maf_urls), maf_hashes
+        )
+
+        # Combine all sample-level MAF dataframes
+        combined_maf_df = pd.concat(maf_dfs, join="outer")
+
+        # Write the combined dataframe to tab-separated string
+        combined_maf = combined_maf_df.to_csv(sep="\t", index=False)
 
     return DeriveFilesResult(
         [
@@ -320,56 +1065,153 @@ def _cytof_analysis_derivation(context: DeriveFilesContext) -> DeriveFilesResult
         meta=[prism.PROTOCOL_ID_FIELD_NAME],
     )
 
-    artifacts = []
-    for combined_f_kind in [
+    combined_f_kinds = [
         "cell_counts_assignment",
         "cell_counts_compartment",
         "cell_counts_profiling",
-    ]:
-        res_df = pd.DataFrame()
-        for index, row in cell_counts_analysis_csvs.iterrows():
-            obj_url = row[f"output_files.{combined_f_kind}.object_url"]
+    ]
 
-            cell_counts_csv = context.fetch_artifact(obj_url, True)
+    def download_and_parse_cell_counts(obj_url: str) -> pd.DataFrame:
+        cell_counts_csv = context.fetch_artifact(obj_url, True)
 
-            if not cell_counts_csv:
-                raise Exception(
-                    f"Failed to read {obj_url} building Cytof analysis derivation"
+        if not cell_counts_csv:
+            raise Exception("artifact not found building Cytof analysis derivation")
+
+        df = pd.read_csv(cell_counts_csv)
+
+        # Each cell_counts_... file consist of just records for one sample.
+        # The first column of each cell_counts_csv (CellSubset) contains cell group types
+        # and the second contains counts for those types.
+        # Create a new, transposed dataframe with cell group types as column headers
+        # and a single row of cell count data.
+        df = df.set_index("CellSubset")
+        df = df.drop(
+            columns="Unnamed: 0", axis=1
+        )  # Cell counts files contain an unnamed index column
+        return df.transpose()
+
+    def download_and_read_cell_counts_rows(obj_url: str) -> List[dict]:
+        cell_counts_csv = context.fetch_artifact(obj_url, True)
+
+        if not cell_counts_csv:
+            raise Exception("artifact not found building Cytof analysis derivation")
+
+        # Transpose the file as above, without parsing its values
+        header, *rows = list(csv.reader(cell_counts_csv))
+        cell_subsets = [row[header.index("CellSubset")] for row in rows]
+        return [
+            dict(zip(cell_subsets, (row[i] for row in rows)))
+            for i, column in enumerate(header)
+            # Cell counts files contain an unnamed index column
+            if column not in ("", "CellSubset")
+        ]
+
+    records = cell_counts_analysis_csvs.to_dict("records")
+    metadata_columns = [
+        "cimac_id",
+        "cimac_participant_id",
+        prism.PROTOCOL_ID_FIELD_NAME,
+    ]
+
+    # Fetch the cell counts files in the order that the loops below consume them,
+    # so they can be fetched in parallel
+    obj_urls = [
+        record[f"output_files.{combined_f_kind}.object_url"]
+        for record in records
+        for combined_f_kind in combined_f_kinds
+    ]
+    obj_hashes = [
+        _content_hash(record, prefix=f"output_files.{combined_f_kind}.")
+        for record in records
+        for combined_f_kind in combined_f_kinds
+    ]
+    cell_counts = _iter_fetch_and_parse(
+        context,
+        download_and_read_cell_counts_rows
+        if context.stream
+        else download_and_parse_cell_counts,
+        obj_urls,
+        obj_hashes,
+    )
+
+    combined_csvs: Dict[str, Union[str, IO]] = {}
+    if context.stream:
+        # Write each sample's rows to a temporary file as soon as they're fetched
+        combined_rows = {
+            combined_f_kind: _RowSpool() for combined_f_kind in combined_f_kinds
+        }
+        for record in records:
+            # adding metadata, so we can distinguish different samples
+            metadata = dict(
+                zip(
+                    metadata_columns,
+                    (
+                        record["cimac_id"],
+                        participant_id_from_cimac(record["cimac_id"]),
+                        record[prism.PROTOCOL_ID_FIELD_NAME],
+                    ),
                 )
+            )
+            for combined_f_kind in combined_f_kinds:
+                for row in next(cell_counts):
+                    combined_rows[combined_f_kind].add({**row, **metadata})
 
-            df = pd.read_csv(cell_counts_csv)
-
-            # Each cell_counts_... file consist of just records for one sample.
-            # The first column of each cell_counts_csv (CellSubset) contains cell group types
-            # and the second contains counts for those types.
-            # Create a new, transposed dataframe with cell group types as column headers
-            # and a single row of cell count data.
-            df = df.set_index("CellSubset")
-            df = df.drop(
-                columns="Unnamed: 0", axis=1
-            )  # Cell counts files contain an unnamed index column
-            df = df.transpose()
-
-            # and adding metadata, so we can distinguish different samples
-            df = df.rename(index={"N": row["cimac_id"]})
-            df["cimac_id"] = row["cimac_id"]
-            df["cimac_participant_id"] = participant_id_from_cimac(row["cimac_id"])
-            df[prism.PROTOCOL_ID_FIELD_NAME] = row[prism.PROTOCOL_ID_FIELD_NAME]
-
-            # finally combine them
-            res_df = pd.concat([res_df, df])
-
-        # and add as artifact
-        artifacts.append(
-            _build_artifact(
-                context=context,
-                file_name=f"combined_{combined_f_kind}.csv",
-                data=res_df.to_csv(index=False),
-                data_format="csv",  # confusing, but right
-                file_type=combined_f_kind.replace("_", " "),
-                include_upload_type=True,
+        for combined_f_kind in combined_f_kinds:
+            combined_csvs[combined_f_kind] = combined_rows[combined_f_kind].write_csv()
+    else:
+        # Collect the per-sample rows for every combined file in a single pass
+        # over the records, then concatenate each combined file just once.
+        sample_dfs: Dict[str, List[pd.DataFrame]] = {
+            combined_f_kind: [] for combined_f_kind in combined_f_kinds
+        }
+        sample_metadata: Dict[str, List[tuple]] = {
+            combined_f_kind: [] for combined_f_kind in combined_f_kinds
+        }
+        for record in records:
+            # adding metadata, so we can distinguish different samples
+            metadata = (
+                record["cimac_id"],
+                participant_id_from_cimac(record["cimac_id"]),
+                record[prism.PROTOCOL_ID_FIELD_NAME],
             )
+            for combined_f_kind in combined_f_kinds:
+                df = next(cell_counts)
+                sample_dfs[combined_f_kind].append(df)
+                sample_metadata[combined_f_kind].extend([metadata] * len(df))
+
+        for combined_f_kind in combined_f_kinds:
+            dfs = sample_dfs[combined_f_kind]
+            if not dfs:
+                res_df = pd.DataFrame()
+            else:
+                # finally combine them, with the metadata columns placed as though
+                # they'd been added to each sample's dataframe before combining
+                columns = list(
+                    dict.fromkeys(
+                        c for df in dfs for c in [*df.columns, *metadata_columns]
+                    )
+                )
+                res_df = pd.concat(dfs, ignore_index=True)
+                for column, values in zip(
+                    metadata_columns, zip(*sample_metadata[combined_f_kind])
+                ):
+                    res_df[column] = values
+                res_df = res_df[columns]
+
+            combined_csvs[combined_f_kind] = res_df.to_csv(index=False)
+
+    # and add as artifacts
+    artifacts = [
+        _build_artifact(
+            context=context,
+            file_name=f"combined_{combined_f_kind}.csv",
+            data=combined_csvs[combined_f_kind],
+            data_format="csv",  # confusing, but right
+            file_type=combined_f_kind.replace("_", " "),
+            include_upload_type=True,
         )
+        for combined_f_kind in combined_f_kinds
+    ]
 
     return DeriveFilesResult(
         artifacts, context.trial_metadata  # return metadata without updates
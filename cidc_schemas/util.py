@@ -1,7 +1,7 @@
 import os
 import re
 import jinja2
-from typing import List, Union
+from typing import List, Sequence, Union
 
 JSON = Union[dict, float, int, list, str]
 
@@ -85,14 +85,17 @@ def split_python_style_path(path: str) -> list:
         yield groups[2] or int(groups[1])
 
 
-def get_source(ct: dict, key: str, skip_last=None) -> (JSON, JSON):
+def get_source(
+    ct: dict, key: Union[str, Sequence[Union[str, int]]], skip_last=None
+) -> (JSON, JSON):
     """
     extract the object in the dictionary specified by
     the supplied key (or one of its parents.)
 
     Args:
         ct: clinical_trial object to be searched
-        key: the identifier we are looking for in the dictionary,
+        key: the identifier we are looking for in the dictionary, either as
+            `get_path` output or as a sequence of tokens like `split_python_style_path` yields
         skip_last: how many levels at the end of key path we want to skip.
     Returns:
         arg1: the value present in `ct` at the `key` path
@@ -101,7 +104,10 @@ def get_source(ct: dict, key: str, skip_last=None) -> (JSON, JSON):
         ValueError if `key` doesn't exist in `ct`
     """
 
-    tokens = list(split_python_style_path(key))
+    if isinstance(key, str):
+        tokens = list(split_python_style_path(key))
+    else:
+        tokens = list(key)
 
     if skip_last:
         last_idx = -1 * skip_last
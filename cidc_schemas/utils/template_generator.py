@@ -6,7 +6,11 @@ from ..template import Template
 from ..template_writer import XlTemplateWriter
 
 
-wes_analysis_template = Template.from_type("wes_analysis")
+def __getattr__(name: str):
+    # `wes_analysis_template` is loaded on first access rather than at import
+    if name == "wes_analysis_template":
+        return Template.from_type("wes_analysis")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def write_wes_analysis_batch(
@@ -74,7 +78,7 @@ def write_wes_analysis_template(
         the normal and tumor CIMAC IDs
         the tumor id is used as the run id
     """
-    XlTemplateWriter().write(outfile_path, wes_analysis_template)
+    XlTemplateWriter().write(outfile_path, Template.from_type("wes_analysis"))
 
     wb = load_workbook(outfile_path)
 
@@ -3,8 +3,11 @@
 """Global test configuration and shared fixtures"""
 
 import os
+import re
 import sys
 import logging
+import tracemalloc
+import zipfile
 
 import pytest
 
@@ -18,6 +21,49 @@ set_prism_encrypt_key("")
 logging.basicConfig(stream=sys.stdout, level=logging.INFO)
 
 
+@pytest.fixture
+def record_peak_memory(benchmark):
+    """
+    Run a function under tracemalloc and record its peak memory use in the benchmark's
+    extra info. Memory is measured in a separate run from the timed ones, since tracing
+    allocations slows most code down a lot.
+    """
+
+    def record(fn):
+        tracemalloc.start()
+        try:
+            fn()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_memory_mb"] = peak / 2**20
+
+    return record
+
+
+@pytest.fixture
+def understate_dimensions():
+    """
+    Rewrite the xlsx file at a given path so that each worksheet's stored dimension
+    (which read-only workbooks trust) covers only the given range, e.g. "A1:A2".
+    """
+
+    def understate(path: str, ref: str = "A1:A2"):
+        with zipfile.ZipFile(path) as xlsx:
+            parts = [(info, xlsx.read(info.filename)) for info in xlsx.infolist()]
+        with zipfile.ZipFile(path, "w") as xlsx:
+            for info, data in parts:
+                if info.filename.startswith("xl/worksheets/"):
+                    data = re.sub(
+                        rb'<dimension ref="[^"]*"',
+                        f'<dimension ref="{ref}"'.encode(),
+                        data,
+                    )
+                xlsx.writestr(info, data)
+
+    return understate
+
+
 @pytest.fixture
 def pbmc_schema_path():
     return os.path.join(MANIFEST_DIR, "pbmc_template.json")
@@ -0,0 +1,24 @@
+"""Shared fixtures for prism tests"""
+
+import pytest
+from openpyxl import Workbook
+
+
+@pytest.fixture(scope="session")
+def large_npx(tmp_path_factory):
+    """A wide NPX workbook: many assay columns, with sample IDs only in the first"""
+    path = tmp_path_factory.mktemp("large_npx") / "large_npx.xlsx"
+    n_assays = 500
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("NPX Data")
+    ws.append(["Olink Target 96 Test"])
+    ws.append(["NPX data"])
+    ws.append(["Panel"] + ["Olink TEST"] * n_assays)
+    ws.append(["Assay"] + [f"ASSAY{j}" for j in range(n_assays)])
+    ws.append(["OlinkID"] + [f"OID{j:05d}" for j in range(n_assays)])
+    samples = [f"CTTTP{i:02d}A{j}.00" for i in range(1, 100) for j in range(1, 4)]
+    for sample in samples:
+        ws.append([sample] + [0.5] * n_assays)
+    ws.append(["LOD"] + [0.1] * n_assays)
+    wb.save(path)
+    return str(path), samples
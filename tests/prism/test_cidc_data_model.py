@@ -1,10 +1,15 @@
+import os
 import pytest
 from copy import deepcopy
+from unittest.mock import MagicMock
+
+import openpyxl
 from deepdiff import DeepDiff, grep
 
 from cidc_schemas.json_validation import load_and_validate_schema
 from cidc_schemas.prism import (
     prismify,
+    validate_and_prismify,
     merge_clinical_trial_metadata,
     merge_artifacts,
     PROTOCOL_ID_FIELD_NAME,
@@ -12,6 +17,7 @@ from cidc_schemas.prism import (
 )
 
 from .cidc_test_data import list_test_data, PrismTestData
+from ..constants import TEMPLATE_EXAMPLES_DIR
 
 
 @pytest.fixture(params=list_test_data(), ids=lambda ptd: ptd.upload_type)
@@ -55,16 +61,18 @@ def test_gcs_uri_format(prism_test: PrismTestData):
         assert ue.gs_key.startswith(f"{prot_id}/{assay}")
 
 
-def test_prismify(prism_test: PrismTestData, monkeypatch):
+def mock_encrypt(monkeypatch):
     monkeypatch.setattr(
         "cidc_schemas.prism.core._encrypt", lambda x: f"test_encrypted({str(x)!r})"
     )
 
     monkeypatch.setattr("cidc_schemas.prism.core._check_encrypt_init", lambda: None)
 
-    # Run prismify on the given test case
-    patch, upload_entries, errs = prismify(*prism_test.prismify_args)
 
+def assert_prismify_matches(
+    prism_test: PrismTestData, patch: dict, upload_entries: list, errs: list
+):
+    """Check prismify output against the expected output for `prism_test`."""
     # Ensure no errors resulted from the prismify run
     assert len(errs) == 0, "\n".join([str(e) for e in errs])
 
@@ -93,6 +101,32 @@ def test_prismify(prism_test: PrismTestData, monkeypatch):
     )
 
 
+def test_prismify(prism_test: PrismTestData, monkeypatch):
+    mock_encrypt(monkeypatch)
+
+    # Run prismify on the given test case
+    patch, upload_entries, errs = prismify(*prism_test.prismify_args)
+
+    assert_prismify_matches(prism_test, patch, upload_entries, errs)
+
+
+def test_validate_and_prismify(prism_test: PrismTestData, monkeypatch):
+    mock_encrypt(monkeypatch)
+
+    # count workbook loads
+    load_workbook = MagicMock(wraps=openpyxl.load_workbook)
+    monkeypatch.setattr("openpyxl.load_workbook", load_workbook)
+
+    xlsx_path = os.path.join(
+        TEMPLATE_EXAMPLES_DIR, f"{prism_test.upload_type}_template.xlsx"
+    )
+    _, template = prism_test.prismify_args
+    patch, upload_entries, errs = validate_and_prismify(xlsx_path, template)
+
+    load_workbook.assert_called_once()
+    assert_prismify_matches(prism_test, patch, upload_entries, errs)
+
+
 def test_merge_patch_into_trial(prism_test: PrismTestData, ct_validator):
     # Merge the prismify patch into the base trial metadata
     result, errs = merge_clinical_trial_metadata(
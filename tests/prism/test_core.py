@@ -7,16 +7,18 @@ import os
 import base64
 import hmac
 from unittest.mock import MagicMock
-from collections import namedtuple
 
+import openpyxl
 import pytest
 
 from cidc_schemas.template import Template
-from cidc_schemas.template_reader import XlTemplateReader
+from cidc_schemas.template_reader import XlTemplateReader, ValidationError
 from cidc_schemas import prism
 from cidc_schemas import util
 from cidc_schemas.prism import core
 
+from ..constants import TEMPLATE_EXAMPLES_DIR, TEST_DATA_DIR
+
 #### HELPER FUNCTION TESTS ####
 
 
@@ -74,6 +76,37 @@ def test_unsupported_prismify():
     ):
         core.prismify(None, mock_template)
 
+    with pytest.raises(
+        NotImplementedError, match="'some-unsupported-type' is not supported"
+    ):
+        core.validate_and_prismify(None, mock_template)
+
+
+def test_validate_and_prismify_invalid(tmp_path):
+    """Check that validate_and_prismify reports validation errors without prismifying"""
+    template = Template.from_type("pbmc")
+
+    # unrecognized row types are raised, as when reading the workbook
+    pbmc_invalid = os.path.join(TEST_DATA_DIR, "pbmc_invalid.xlsx")
+    with pytest.raises(ValidationError, match="No recognized row type"):
+        core.validate_and_prismify(pbmc_invalid, template)
+
+    # blank out a required cell in the first data row
+    workbook = openpyxl.load_workbook(
+        os.path.join(TEMPLATE_EXAMPLES_DIR, "pbmc_template.xlsx")
+    )
+    data_row = next(
+        row for row in workbook["Samples"].iter_rows() if row[0].value == "#data"
+    )
+    data_row[1].value = None
+    missing_value = str(tmp_path / "pbmc_missing_value.xlsx")
+    workbook.save(missing_value)
+
+    patch, file_maps, errs = core.validate_and_prismify(missing_value, template)
+    assert patch == {}
+    assert file_maps == []
+    assert errs and errs == list(template.iter_errors_excel(missing_value))
+
 
 def mock_XlTemplateReader_from_excel(sheets: dict, monkeypatch):
 
@@ -85,10 +118,9 @@ def mock_XlTemplateReader_from_excel(sheets: dict, monkeypatch):
 
     workbook.__getitem__.side_effect = wb.__getitem__
     workbook.sheetnames = sheets.keys()
-    cell = namedtuple("cell", ["value"])
-
     for k, rows in sheets.items():
-        wb[k].iter_rows.return_value = [map(cell, r) for r in rows]
+        # XlTemplateReader iterates over cell values only
+        wb[k].iter_rows.return_value = [tuple(r) for r in rows]
 
     return
 
@@ -478,6 +510,84 @@ def test_prism_joining_tabs(monkeypatch):
     }
 
 
+def test_prism_merge_collision(monkeypatch):
+    """Tests that prismify reports conflicting data rows with row and worksheet context"""
+    mock_XlTemplateReader_from_excel(
+        {
+            "authors": [["#header", "author id"], ["#data", "CPP0"]],
+            "books": [
+                ["#header", "book id", "book name"],
+                ["#data", "CPP0S0.00", "Foo"],
+                ["#data", "CPP0S0.00", "Bar"],
+                ["#data", "CPP0S1.00", "Baz"],
+            ],
+        },
+        monkeypatch,
+    )
+
+    template = build_mock_Template(
+        _tab_joining_template_schema(), "test_prism_merge_collision", monkeypatch
+    )
+
+    xlsx, errs = XlTemplateReader.from_excel("workbook")
+    assert not errs
+
+    patch, _, errs = core.prismify(xlsx, template, TEST_SCHEMA_DIR)
+    assert len(errs) == 1
+    assert isinstance(errs[0], prism.MergeCollisionException)
+    assert str(errs[0]) == (
+        "Detected mismatch of book_name='Foo' and book_name='Bar' "
+        "in book_id='CPP0S0.00' author_id='CPP0' row=3 worksheet='books'"
+    )
+
+    # the conflicting row is left out, but others are still merged
+    assert patch == {
+        "authors": [
+            {
+                "author_id": "CPP0",
+                "books": [
+                    {"book_id": "CPP0S0.00", "book_name": "Foo"},
+                    {"book_id": "CPP0S1.00", "book_name": "Baz"},
+                ],
+            }
+        ]
+    }
+
+
+def test_prismify_many_rows_speed(benchmark, monkeypatch):
+    """Prismify a worksheet with 10k data rows"""
+    # author ids are the first 4 characters of book ids, so there are at most 10
+    n_authors, n_books = 10, 1000
+    mock_XlTemplateReader_from_excel(
+        {
+            "authors": [["#header", "author id"]]
+            + [["#data", f"CPP{a}"] for a in range(n_authors)],
+            "books": [["#header", "book id", "book name"]]
+            + [
+                ["#data", f"CPP{a}S{b}.00", f"Book {b}"]
+                for a in range(n_authors)
+                for b in range(n_books)
+            ],
+        },
+        monkeypatch,
+    )
+
+    template = build_mock_Template(
+        _tab_joining_template_schema(), "test_prismify_many_rows", monkeypatch
+    )
+
+    xlsx, errs = XlTemplateReader.from_excel("workbook")
+    assert not errs
+
+    def prismify():
+        patch, _, errs = core.prismify(xlsx, template, TEST_SCHEMA_DIR)
+        assert not errs
+        assert len(patch["authors"]) == n_authors
+        assert all(len(author["books"]) == n_books for author in patch["authors"])
+
+    benchmark.pedantic(prismify, rounds=3)
+
+
 def test_prism_process_as_error(monkeypatch):
     """Tests that prismify doesn't crash when a `parse_through` function errors"""
     mock_XlTemplateReader_from_excel(
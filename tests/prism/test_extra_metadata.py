@@ -1,4 +1,5 @@
 import os
+import shutil
 
 import pytest
 
@@ -102,6 +103,32 @@ def test_parser_smoketest(parser, file_path, target):
         assert parser(f) == target
 
 
+@pytest.mark.parametrize(
+    "parser,file_path,target",
+    [
+        (parse_npx, npx_combined_file_path, combined_npx_metadata),
+        (parse_elisa, elisa_file_path_2, elisa_metadata_2),
+        (parse_clinical, clinical_file_path_3, clinical_metadata_3),
+    ],
+    ids=["npx", "elisa", "clinical"],
+)
+def test_parser_stale_dimensions(
+    parser, file_path, target, tmp_path, understate_dimensions
+):
+    """Check that the parsers aren't cut short by a stale stored worksheet dimension"""
+    stale_path = str(tmp_path / os.path.basename(file_path))
+    shutil.copy(file_path, stale_path)
+    understate_dimensions(stale_path)
+
+    with open(stale_path, "rb") as f:
+        parsed = parser(f)
+    # clinical participants are collected into a set, so their order varies
+    sort_lists = lambda d: {
+        k: sorted(v) if type(v) == list else v for k, v in d.items()
+    }
+    assert sort_lists(parsed) == sort_lists(target)
+
+
 def test_parse_npx_exc():
     with pytest.raises(TypeError, match=r"not file paths"):
         parse_npx("str should fail")
@@ -162,3 +189,18 @@ def test_parse_clinical():
     with open(clinical_file_path_2_bom_csv, "rb") as f:
         data = parse_clinical(f)
         _check_clin_eq(data, clinical_metadata_1)
+
+
+def test_parse_npx_memory(benchmark, record_peak_memory, large_npx):
+    """Time and peak memory use of extracting sample IDs from a wide NPX file"""
+    path, samples = large_npx
+
+    def parse():
+        with open(path, "rb") as f:
+            assert parse_npx(f) == {
+                "samples": samples,
+                "number_of_samples": len(samples),
+            }
+
+    benchmark.pedantic(parse, rounds=3)
+    record_peak_memory(parse)
@@ -1,11 +1,16 @@
 """Tests for generic merging functionality."""
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
 from uuid import uuid4
 from unittest.mock import MagicMock
 
 import pytest
 from jsonmerge import Merger
+from jsonmerge.strategies import Overwrite
 
+from cidc_schemas.json_validation import schema_registry
 from cidc_schemas.prism import merger as prism_merger
 from cidc_schemas.prism.core import LocalFileUploadEntry
 from cidc_schemas.prism.constants import PROTOCOL_ID_FIELD_NAME
@@ -142,6 +147,148 @@ def test_overwrite_any():
         merger.merge(base, head)
 
 
+def test_merge_builder():
+    """Check that MergeBuilder accumulates objects just like repeated jsonmerge merges"""
+    schema = {
+        "type": "object",
+        "properties": {
+            "participants": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "participant_id": {"type": "string"},
+                        "samples": {
+                            "type": "array",
+                            "items": {"type": "object"},
+                            "mergeStrategy": "arrayMergeById",
+                            "mergeOptions": {"idRef": "/sample_id"},
+                        },
+                        "tags": {"type": "array", "mergeStrategy": "append"},
+                    },
+                },
+                "mergeStrategy": "arrayMergeById",
+                "mergeOptions": {"idRef": "/participant_id"},
+            }
+        },
+    }
+
+    def row(participant_id, sample_id, weight, tag="t"):
+        return {
+            "participants": [
+                {
+                    "participant_id": participant_id,
+                    "samples": [{"sample_id": sample_id, "weight": weight}],
+                    "tags": [tag],
+                }
+            ]
+        }
+
+    rows = [
+        row("p1", "c1", 1),
+        row("p1", "c2", 2),
+        row("p2", "c1", 3),
+        row("p1", "c1", 1, tag="u"),
+        # collides after appending a tag, which should be rolled back
+        row("p1", "c2", 333),
+        row("p3", "c4", 4),
+        # collides after adding a participant, which should be rolled back
+        {
+            "participants": [
+                row("p4", "c5", 5)["participants"][0],
+                row("p2", "c1", 0)["participants"][0],
+            ]
+        },
+        row("p2", "c6", 6),
+    ]
+
+    merger = Merger(schema, strategies=prism_merger.PRISM_MERGE_STRATEGIES)
+    builder = prism_merger.MergePlan(schema).builder()
+    expected = {}
+    for r in rows:
+        try:
+            expected = merger.merge(expected, deepcopy(r))
+        except prism_merger.MergeCollisionException as e:
+            with pytest.raises(
+                prism_merger.MergeCollisionException, match=re.escape(str(e))
+            ):
+                builder.add(deepcopy(r))
+        else:
+            builder.add(deepcopy(r))
+        assert builder.result == expected
+
+    assert len(expected["participants"]) == 3
+
+
+def test_cached_mergers():
+    """Check that merge plans and jsonmerge mergers are only built once per schema"""
+    schema = {"type": "object", "properties": {"a": {"type": "number"}}}
+    plan = prism_merger.get_merge_plan(schema)
+    assert prism_merger.get_merge_plan(schema) is plan
+    assert prism_merger.get_merge_plan(deepcopy(schema)) is not plan
+
+    merger = prism_merger.get_merger(schema)
+    assert prism_merger.get_merger(schema) is merger
+    assert prism_merger.get_merger(deepcopy(schema)) is not merger
+    strategies = {**prism_merger.PRISM_MERGE_STRATEGIES, "overwrite": Overwrite()}
+    assert prism_merger.get_merger(schema, strategies) is not merger
+    assert merger.merge({"a": 1}, {"a": 1}) == {"a": 1}
+
+    # plans are shared between threads, but jsonmerge mergers aren't
+    with ThreadPoolExecutor(4) as pool:
+        plans = set(pool.map(lambda _: prism_merger.get_merge_plan(schema), range(8)))
+        merged = list(
+            pool.map(
+                lambda a: prism_merger.get_merger(schema).merge({"a": a}, {"a": a}),
+                range(8),
+            )
+        )
+        thread_merger = pool.submit(prism_merger.get_merger, schema).result()
+    assert plans == {plan}
+    assert merged == [{"a": a} for a in range(8)]
+    assert thread_merger is not merger
+
+
+def test_cached_mergers_dropped_with_schemas(monkeypatch):
+    """Check that merge plans and mergers don't outlive the schemas they were built from"""
+    monkeypatch.setattr(prism_merger, "_MERGE_PLANS", OrderedDict())
+    monkeypatch.setattr(prism_merger, "_MERGERS", OrderedDict())
+    trial = {PROTOCOL_ID_FIELD_NAME: "test_prism_trial_id"}
+
+    for _ in range(3):
+        for use_jsonmerge in [False, True]:
+            prism_merger.merge_clinical_trial_metadata(
+                trial, trial, use_jsonmerge=use_jsonmerge
+            )
+        assert len(prism_merger._MERGE_PLANS) == 1
+        assert len(prism_merger._MERGERS) == 1
+        schema_registry.clear()
+        assert not prism_merger._MERGE_PLANS
+        assert not prism_merger._MERGERS
+
+    # evicted schemas are dropped too
+    schemas = [{"type": "object", "title": str(i)} for i in range(3)]
+    for schema in schemas:
+        prism_merger.get_merge_plan(schema)
+        prism_merger.get_merger(schema)
+    prism_merger._drop_mergers(schemas[1])
+    assert [s for s, _ in prism_merger._MERGE_PLANS.values()] == [
+        schemas[0],
+        schemas[2],
+    ]
+    assert [s for s, _, _ in prism_merger._MERGERS.values()] == [
+        schemas[0],
+        schemas[2],
+    ]
+
+    # and the caches are bounded
+    monkeypatch.setattr(prism_merger, "MAX_CACHED_MERGERS", 2)
+    prism_merger.get_merge_plan(schemas[1])
+    prism_merger.get_merger(schemas[1])
+    assert len(prism_merger._MERGE_PLANS) == len(prism_merger._MERGERS) == 2
+    assert schemas[0] not in [s for s, _ in prism_merger._MERGE_PLANS.values()]
+
+
 #### END MERGE STRATEGY TESTS ####
 
 #### MERGER TESTS ####
@@ -246,6 +393,24 @@ def test_merge_artifacts_smoketest(ct_and_artifacts):
     assert artifacts_batch == artifacts_1by1
 
 
+def test_index_upload_placeholders(ct_and_artifacts):
+    """Check that index_upload_placeholders finds every placeholder and its artifact"""
+    ct, artifacts = ct_and_artifacts
+    index = prism_merger.index_upload_placeholders(ct)
+    assert set(index) == {a.artifact_uuid for a in artifacts}
+
+    placeholder = index[artifacts[-1].artifact_uuid]
+    assert placeholder.path == ("a", "c", 1, "e", "f", 124, "upload_placeholder")
+    assert placeholder.artifact is ct["a"]["c"][1]["e"]["f"][124]
+
+    assert prism_merger.index_upload_placeholders({"a": [{"b": 1}]}) == {}
+
+    with pytest.raises(KeyError, match="not found"):
+        prism_merger.merge_artifact(
+            ct, "not-a-uuid", "a/b", "", 0, "", crc32c_hash="foo"
+        )
+
+
 #### END MERGER TESTS ####
 
 #### EXTRA METADATA TESTS ####
@@ -292,6 +457,74 @@ def test_merge_artifact_extra_metadata_exc(monkeypatch):
             )
 
 
+@pytest.mark.parametrize("workers", [1, 2], ids=["batch", "pool"])
+def test_merge_artifacts_extra_metadata_exc(workers):
+    """Ensure merge_artifacts_extra_metadata checks the whole batch before merging"""
+    ct = {"a": [up("npx_1"), up("npx_2")]}
+    original_ct = deepcopy(ct)
+
+    assert prism_merger.merge_artifacts_extra_metadata(ct, [], workers) == (ct, [])
+
+    with open(npx_file_path, "rb") as valid, open(invalid_npx_file_path, "rb") as bad:
+        with pytest.raises(ValueError, match="Assay foo does not support extra"):
+            prism_merger.merge_artifacts_extra_metadata(
+                ct, [("npx_1", "olink", valid), ("npx_2", "foo", bad)], workers
+            )
+        with pytest.raises(KeyError, match="key: npx_3 not found"):
+            prism_merger.merge_artifacts_extra_metadata(
+                ct, [("npx_1", "olink", valid), ("npx_3", "olink", bad)], workers
+            )
+        with pytest.raises(
+            ValueError, match="Assay npx_2 cannot be parsed for olink metadata"
+        ):
+            prism_merger.merge_artifacts_extra_metadata(
+                ct, [("npx_1", "olink", valid), ("npx_2", "olink", bad)], workers
+            )
+        assert ct == original_ct
+
+        # doesn't wrap TypeErrors
+        valid.seek(0)
+        with pytest.raises(TypeError, match="only accepts BinaryIO"):
+            prism_merger.merge_artifacts_extra_metadata(
+                ct, [("npx_1", "olink", valid), ("npx_2", "olink", "a/path")], workers
+            )
+
+
+def test_merge_artifacts_extra_metadata_single_cpu(monkeypatch):
+    """Check that files are parsed in this process by default on a single CPU"""
+    monkeypatch.setattr(prism_merger.os, "cpu_count", lambda: 1)
+    monkeypatch.setattr(prism_merger, "ProcessPoolExecutor", None)
+    with open(npx_file_path, "rb") as first, open(npx_file_path, "rb") as second:
+        assert prism_merger._parse_extra_metadata_files(
+            [("npx_1", "olink", first), ("npx_2", "olink", second)], None
+        ) == [single_npx_metadata, single_npx_metadata]
+
+
+@pytest.mark.parametrize("workers", [1, 4], ids=["batch", "pool"])
+def test_merge_artifacts_extra_metadata_speed(benchmark, large_npx, workers):
+    """Time parsing and merging a batch of wide NPX files"""
+    path, samples = large_npx
+    uuids = [f"npx_{i}" for i in range(4)]
+
+    def merge():
+        ct = {"files": [up(uuid) for uuid in uuids]}
+        data_files = [open(path, "rb") for _ in uuids]
+        try:
+            ct, merged_artifacts = prism_merger.merge_artifacts_extra_metadata(
+                ct,
+                [(uuid, "olink", f) for uuid, f in zip(uuids, data_files)],
+                workers,
+            )
+        finally:
+            for f in data_files:
+                f.close()
+        assert [artifact["samples"] for artifact, _ in merged_artifacts] == [
+            samples
+        ] * len(uuids)
+
+    benchmark.pedantic(merge, rounds=1)
+
+
 # upload placeholder shorthand
 up = lambda uuid: {"upload_placeholder": uuid}
 
@@ -340,16 +573,41 @@ def olink_file_infos():
     ]
 
 
-def _do_extra_metadata_merge(ct, file_infos, upload_type):
-    for finfo in file_infos:
-        with open(finfo.local_path, "rb") as data_file:
-            prism_merger.merge_artifact_extra_metadata(
-                ct, finfo.upload_placeholder, upload_type, data_file
-            )
+def _do_extra_metadata_merge(ct, file_infos, upload_type, workers=None):
+    if workers is None:
+        for finfo in file_infos:
+            with open(finfo.local_path, "rb") as data_file:
+                prism_merger.merge_artifact_extra_metadata(
+                    ct, finfo.upload_placeholder, upload_type, data_file
+                )
+        return
+
+    data_files = [open(finfo.local_path, "rb") for finfo in file_infos]
+    try:
+        prism_merger.merge_artifacts_extra_metadata(
+            ct,
+            [
+                prism_merger.ExtraMetadataInfo(
+                    finfo.upload_placeholder, upload_type, data_file
+                )
+                for finfo, data_file in zip(file_infos, data_files)
+            ],
+            workers=workers,
+        )
+    finally:
+        for data_file in data_files:
+            data_file.close()
 
 
-def test_merge_extra_metadata_olink(olink_ct_metadata, olink_file_infos):
-    _do_extra_metadata_merge(olink_ct_metadata, olink_file_infos, "olink")
+# merge one file at a time, or in a batch parsed in this process or a process pool
+extra_metadata_workers = pytest.mark.parametrize(
+    "workers", [None, 1, 2], ids=["single", "batch", "pool"]
+)
+
+
+@extra_metadata_workers
+def test_merge_extra_metadata_olink(olink_ct_metadata, olink_file_infos, workers):
+    _do_extra_metadata_merge(olink_ct_metadata, olink_file_infos, "olink", workers)
 
     study_npx = olink_ct_metadata["assays"]["olink"]["study"]["npx_file"]
     assay_npx = olink_ct_metadata["assays"]["olink"]["batches"][0]["records"][0][
@@ -382,8 +640,9 @@ def elisa_file_infos():
     ]
 
 
-def test_merge_extra_metadata_elisa(elisa_ct_metadata, elisa_file_infos):
-    _do_extra_metadata_merge(elisa_ct_metadata, elisa_file_infos, "elisa")
+@extra_metadata_workers
+def test_merge_extra_metadata_elisa(elisa_ct_metadata, elisa_file_infos, workers):
+    _do_extra_metadata_merge(elisa_ct_metadata, elisa_file_infos, "elisa", workers)
 
     artifact = elisa_ct_metadata["assays"]["elisa"][0]["assay_xlsx"]
 
@@ -417,8 +676,13 @@ def clinical_file_infos():
     ]
 
 
-def test_merge_extra_metadata_clinical(clinical_ct_metadata, clinical_file_infos):
-    _do_extra_metadata_merge(clinical_ct_metadata, clinical_file_infos, "clinical_data")
+@extra_metadata_workers
+def test_merge_extra_metadata_clinical(
+    clinical_ct_metadata, clinical_file_infos, workers
+):
+    _do_extra_metadata_merge(
+        clinical_ct_metadata, clinical_file_infos, "clinical_data", workers
+    )
 
     artifact = clinical_ct_metadata["clinical_data"]["records"][0]["clinical_file"]
     assert (
@@ -6,9 +6,16 @@
 import os
 import pytest
 import json
+import time
 import jsonschema
+from collections import OrderedDict
+from copy import deepcopy
+from jsonmerge.exceptions import JSONMergeError
 
 from cidc_schemas.json_validation import load_and_validate_schema
+from cidc_schemas.prism import merge_clinical_trial_metadata, PROTOCOL_ID_FIELD_NAME
+from cidc_schemas.prism import merger as prism_merger
+from cidc_schemas.prism.merger import MergeCollisionException
 
 
 def example_paths():
@@ -45,3 +52,131 @@ def test_schema(example_path):
                 \n CT_SCHEMA{"["+"][".join(repr(p) for p in e.absolute_schema_path)+"]"} \
                 \n instance {e.instance}'
             )
+
+
+def incremental_merge_patches(ct_example: dict):
+    """Build a variety of valid and invalid patches for the given trial example."""
+    protocol_id = ct_example[PROTOCOL_ID_FIELD_NAME]
+    yield {PROTOCOL_ID_FIELD_NAME: protocol_id}
+
+    participant = ct_example["participants"][0]
+    new_participant = deepcopy(participant)
+    old_id = participant["cimac_participant_id"]
+    new_participant["cimac_participant_id"] = old_id[:-1] + "Z"
+    for sample in new_participant.get("samples", []):
+        sample["cimac_id"] = (
+            new_participant["cimac_participant_id"] + sample["cimac_id"][len(old_id) :]
+        )
+    yield {PROTOCOL_ID_FIELD_NAME: protocol_id, "participants": [new_participant]}
+
+    invalid_participant = deepcopy(new_participant)
+    invalid_participant["cohort_name"] = "not an allowed cohort"
+    invalid_participant["unexpected_property"] = 1
+    for sample in invalid_participant.get("samples", []):
+        sample["collection_event_name"] = "not an allowed event"
+    yield {PROTOCOL_ID_FIELD_NAME: protocol_id, "participants": [invalid_participant]}
+
+    sample = participant["samples"][0]
+    yield {
+        PROTOCOL_ID_FIELD_NAME: protocol_id,
+        "participants": [
+            {
+                "cimac_participant_id": old_id,
+                "samples": [{"cimac_id": sample["cimac_id"], "unexpected_property": 1}],
+            }
+        ],
+    }
+
+
+@pytest.mark.parametrize("example_path", example_paths(), ids=lambda x: x[1])
+def test_incremental_merge_validation(example_path):
+    """Check that incremental and full validation agree when merging into each example"""
+    with open(os.path.join(*example_path)) as file:
+        ct_example = json.load(file)
+
+    for patch in incremental_merge_patches(ct_example):
+        full, full_errs = merge_clinical_trial_metadata(
+            deepcopy(patch), deepcopy(ct_example)
+        )
+        incremental, incremental_errs = merge_clinical_trial_metadata(
+            deepcopy(patch), deepcopy(ct_example), incremental=True
+        )
+        assert full == incremental
+        assert full_errs == incremental_errs
+
+
+def _merge_or_error(patch: dict, target: dict, use_jsonmerge: bool):
+    try:
+        return merge_clinical_trial_metadata(
+            deepcopy(patch), deepcopy(target), use_jsonmerge=use_jsonmerge
+        )
+    except MergeCollisionException as e:
+        return str(e)
+    except JSONMergeError as e:
+        # only jsonmerge reports where in the document the error happened
+        return type(e), e.message
+
+
+@pytest.mark.parametrize("example_path", example_paths(), ids=lambda x: x[1])
+def test_merge_matches_jsonmerge(example_path):
+    """Check that merging with a MergePlan gives the same results as jsonmerge"""
+    with open(os.path.join(*example_path)) as file:
+        ct_example = json.load(file)
+
+    colliding_participant = deepcopy(ct_example["participants"][0])
+    colliding_participant["cohort_name"] = "a different cohort"
+    patches = [
+        *incremental_merge_patches(ct_example),
+        ct_example,
+        {
+            PROTOCOL_ID_FIELD_NAME: ct_example[PROTOCOL_ID_FIELD_NAME],
+            "participants": [colliding_participant],
+        },
+    ]
+    empty_trial = {PROTOCOL_ID_FIELD_NAME: ct_example[PROTOCOL_ID_FIELD_NAME]}
+    for target in [ct_example, empty_trial]:
+        for patch in patches:
+            native = _merge_or_error(patch, target, use_jsonmerge=False)
+            reference = _merge_or_error(patch, target, use_jsonmerge=True)
+            assert native == reference
+
+
+@pytest.mark.parametrize("use_jsonmerge", [False, True], ids=["native", "jsonmerge"])
+def test_merge_clinical_trial_metadata_speed(benchmark, monkeypatch, use_jsonmerge):
+    """Benchmark merging a new participant into a trial with many participants"""
+    with open(
+        os.path.join(os.path.dirname(__file__), "data/clinicaltrial_examples/CT_1.json")
+    ) as file:
+        ct_example = json.load(file)
+
+    participants = []
+    for i in range(500):
+        participant = deepcopy(ct_example["participants"][0])
+        participant["cimac_participant_id"] = f"CTTTP{i:03d}"
+        for j, sample in enumerate(participant["samples"]):
+            sample["cimac_id"] = f"CTTTP{i:03d}S{j}.00"
+        participants.append(participant)
+    ct_example["participants"] = participants
+    patch = {
+        PROTOCOL_ID_FIELD_NAME: ct_example[PROTOCOL_ID_FIELD_NAME],
+        "participants": [participants[-1]],
+    }
+
+    # the first merge builds the merger, which later merges reuse
+    monkeypatch.setattr(prism_merger, "_MERGE_PLANS", OrderedDict())
+    monkeypatch.setattr(prism_merger, "_MERGERS", OrderedDict())
+    start = time.perf_counter()
+    merge_clinical_trial_metadata(
+        patch, ct_example, incremental=True, use_jsonmerge=use_jsonmerge
+    )
+    benchmark.extra_info["first_call_seconds"] = time.perf_counter() - start
+
+    merged, _ = benchmark.pedantic(
+        merge_clinical_trial_metadata,
+        args=(patch, ct_example),
+        kwargs=dict(incremental=True, use_jsonmerge=use_jsonmerge),
+        rounds=3,
+    )
+    assert merged == ct_example
+    if benchmark.stats:
+        benchmark.extra_info["per_call_seconds"] = benchmark.stats.stats.data
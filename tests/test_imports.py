@@ -0,0 +1,70 @@
+"""Tests for the cost of importing `cidc_schemas`."""
+
+import subprocess
+import sys
+from typing import Tuple
+
+from .constants import ROOT_DIR
+
+# Modules that short-lived processes (the CLI, cloud functions) import on startup
+STARTUP_MODULES = [
+    "cidc_schemas.json_validation",
+    "cidc_schemas.template",
+    "cidc_schemas.template_reader",
+    "cidc_schemas.prism",
+    "cidc_schemas.utils.template_generator",
+]
+
+# Modules that should only be imported once they're needed
+LAZY_MODULES = ["dateparser", "pandas", "cidc_ngs_pipeline_api"]
+
+# Generous enough for slow CI machines, but far below the seconds spent
+# when schemas were loaded and validated at import.
+MAX_SELF_IMPORT_SECONDS = 0.5
+
+
+def _import_in_subprocess() -> Tuple[str, str]:
+    """Import `STARTUP_MODULES` in a fresh interpreter, returning its output and -X importtime log."""
+    code = "\n".join(
+        [f"import {module}" for module in STARTUP_MODULES]
+        + [
+            "import sys",
+            "from cidc_schemas.json_validation import schema_registry",
+            "print(schema_registry.stats().size)",
+            f"print(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules))",
+        ]
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout, result.stderr
+
+
+def _self_import_seconds(importtime_log: str) -> float:
+    """Total time spent importing `cidc_schemas` modules, excluding their dependencies."""
+    total_us = 0
+    for line in importtime_log.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, _, module = line[len("import time:") :].split("|")
+        if module.strip().startswith("cidc_schemas") and self_us.strip().isdigit():
+            total_us += int(self_us)
+    return total_us / 1e6
+
+
+def test_import_time(benchmark):
+    """Importing cidc_schemas shouldn't load schemas or slow optional dependencies"""
+    stdout, importtime_log = benchmark.pedantic(_import_in_subprocess, rounds=3)
+
+    n_cached_schemas, loaded_lazy_modules = stdout.splitlines()
+    assert n_cached_schemas == "0"
+    assert loaded_lazy_modules == "[]"
+
+    self_seconds = _self_import_seconds(importtime_log)
+    benchmark.extra_info["self_import_seconds"] = self_seconds
+    assert self_seconds < MAX_SELF_IMPORT_SECONDS
@@ -4,11 +4,18 @@
 """Tests for JSON loading/validation utilities."""
 
 import os
+import copy
 import json
+import pickle
+import datetime
+import subprocess
+import sys
 
 import pytest
 import jsonschema
 import jsonpointer
+import dateparser
+import openpyxl
 
 from cidc_schemas.json_validation import (
     _map_refs,
@@ -16,12 +23,22 @@ from cidc_schemas.json_validation import (
     _load_dont_validate_schema,
     _resolve_refs,
     _Validator,
+    compile_instance_validator,
+    convert,
+    validate_instance,
     InDocRefNotFoundError,
     RefResolutionError,
     format_validation_error,
+    default_schema_cache_dir,
+    set_schema_cache_dir,
+    set_schema_interning,
+    _intern_schema,
+    SchemaRegistry,
+    schema_registry,
 )
+from cidc_schemas import json_validation
 from cidc_schemas.prism import PROTOCOL_ID_FIELD_NAME
-from .constants import SCHEMA_DIR, TEST_SCHEMA_DIR
+from .constants import ROOT_DIR, SCHEMA_DIR, TEST_SCHEMA_DIR, TEST_DATA_DIR
 
 
 def test_validator_iter_errors_in_doc_ref():
@@ -290,6 +307,130 @@ def test_validate_in_doc_refs():
         v.validate({"objs": [], "refs": ["anything"]})
 
 
+def test_in_doc_ref_patterns_precomputed():
+    """Check that in_doc_ref_pattern locations are collected once, on construction."""
+    validator = load_and_validate_schema("clinical_trial.json", return_validator=True)
+    assert validator._in_doc_ref_patterns == {
+        "/participants/*/cimac_participant_id",
+        "/participants/*/samples/*/cimac_id",
+        "/allowed_cohort_names/*",
+        "/allowed_collection_event_names/*",
+    }
+
+    # in_doc_ref_pattern values nested in arrays are found, too
+    v = _Validator({"anyOf": [{"items": {"in_doc_ref_pattern": "/a/*"}}]})
+    assert v._in_doc_ref_patterns == {"/a/*"}
+    assert list(v.safe_iter_errors({"a": [1]})) == []
+
+    # and refs are checked when ignore_in_doc_refs is False only
+    v = _Validator({"properties": {"b": {"in_doc_ref_pattern": "/a/*"}}})
+    assert len(list(v.safe_iter_errors({"a": [1], "b": 2}))) == 1
+    assert list(v.safe_iter_errors({"a": [1], "b": 2}, ignore_in_doc_refs=True)) == []
+
+
+def test_validate_changes_only():
+    """Check that passing a previous document skips only shared, unchanged subtrees."""
+    v = _Validator(
+        {
+            "properties": {
+                "ids": {"type": "array", "items": {"type": "string"}},
+                "objs": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"ref": {"in_doc_ref_pattern": "/ids/*"}},
+                        "additionalProperties": False,
+                    },
+                },
+            }
+        }
+    )
+
+    previous = {"ids": ["a", "b"], "objs": [{"ref": "a"}, {"ref": "b"}]}
+    instance = {"ids": previous["ids"], "objs": [*previous["objs"], {"foo": "c"}]}
+    errors = list(v.safe_iter_errors(instance, previous=previous))
+    assert len(errors) == 1 and "'foo' was unexpected" in errors[0].message
+    # subtrees shared with `previous` are assumed valid
+    instance["objs"][0]["foo"] = "c"
+    assert len(list(v.safe_iter_errors(instance, previous=previous))) == 1
+    assert len(list(v.safe_iter_errors(instance))) == 2
+
+    # if in-doc ref targets were removed, everything is checked
+    previous = {"ids": ["a", "b"], "objs": [{"ref": "a"}, {"ref": "b"}]}
+    instance = {"ids": ["a"], "objs": previous["objs"]}
+    errors = list(v.safe_iter_errors(instance, previous=previous))
+    assert len(errors) == 1 and isinstance(errors[0], InDocRefNotFoundError)
+
+
+def test_compile_instance_validator():
+    """Check that compiled validators behave just like validate_instance"""
+    schemas = [
+        {"type": "string", "format": "date"},
+        {"type": "integer", "minimum": 0},
+        {"type": "string", "enum": ["a", "b"]},
+        {"allOf": [{"type": "number"}, {"type": "string"}]},
+        {"allOf": [{"type": "number"}, {"maximum": 10}]},
+    ]
+    values = [None, "a", "c", "2020-01-02", "blah", 3, "-1", 12.5, True]
+    for schema in schemas:
+        validate = compile_instance_validator(schema)
+        for value in values:
+            for is_required in [True, False]:
+                assert str(validate(value, is_required)) == str(
+                    validate_instance(value, schema, is_required)
+                )
+
+    # invalid schemas are reported when validating, as jsonschema.validate would
+    validate = compile_instance_validator({"type": "foo"})
+    assert validate(None) is None
+    with pytest.raises(jsonschema.SchemaError):
+        validate("a")
+
+
+def test_convert_dates_like_dateparser():
+    """Check that date conversion matches plain dateparser conversion"""
+
+    def expected(fmt, value):
+        dt = dateparser.parse(str(value))
+        if fmt == "date":
+            return dt.strftime("%Y-%m-%d")
+        return dt.strftime("%H:%M:%S")
+
+    wb = openpyxl.load_workbook(os.path.join(TEST_DATA_DIR, "date_examples.xlsx"))
+    # skip the labels and empty cells in the example workbook
+    values = [
+        cell
+        for ws in wb
+        for row in ws.iter_rows(values_only=True)
+        for cell in row
+        if cell is not None and any(c.isdigit() for c in str(cell))
+    ]
+    values += [
+        "2020-01-02",
+        "2020-1-2",
+        "2020-01-02 10:11:12",
+        "2020-01-02T10:11:12.123",
+        "12/1/98",
+        "1/2/68",
+        "1/2/69",
+        "13/01/2020",
+        "10:45:01",
+        "10:45",
+        " 2020-01-02",
+        datetime.date(2020, 1, 2),
+        datetime.datetime(2020, 1, 2, 3, 4, 5, 600),
+    ]
+    for value in values:
+        for fmt in ["date", "time"]:
+            # call twice to exercise the memoized path
+            assert convert(fmt, value) == expected(fmt, value)
+            assert convert(fmt, value) == expected(fmt, value)
+
+    for value in ["2020-02-30", "not a date"]:
+        with pytest.raises(jsonschema.ValidationError):
+            convert("date", value)
+
+
 def test_load_ct_schema_speed(benchmark):
     def load():
         load_and_validate_schema("clinical_trial.json")
@@ -297,6 +438,218 @@ def test_load_ct_schema_speed(benchmark):
     benchmark.pedantic(load, rounds=3)
 
 
+def test_schema_cache_dir(monkeypatch, tmp_path):
+    """Check that resolved schemas can be cached on disk"""
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert default_schema_cache_dir() == str(tmp_path / "cidc_schemas")
+    monkeypatch.delenv("XDG_CACHE_HOME")
+    assert default_schema_cache_dir() == os.path.expanduser("~/.cache/cidc_schemas")
+
+    schema = load_and_validate_schema("sample.json")
+
+    cache_dir = str(tmp_path / "schemas")
+    set_schema_cache_dir(cache_dir)
+    try:
+        schema_registry.clear()
+        assert load_and_validate_schema("sample.json") == schema
+        assert len(os.listdir(cache_dir)) == 1
+
+        # schemas loaded from the on-disk cache match those loaded from scratch,
+        # without resolving or checking them again
+        schema_registry.clear()
+        with monkeypatch.context() as m:
+            m.setattr(json_validation, "_load_dont_validate_schema", None)
+            m.setattr(json_validation, "_validator_instance", None)
+            cached_schema = load_and_validate_schema("sample.json")
+            assert cached_schema is not schema
+            assert cached_schema == schema
+            validator = load_and_validate_schema("sample.json", return_validator=True)
+            assert validator.schema == schema
+
+        # schemas loaded with `on_refs` aren't cached
+        load_and_validate_schema("sample.json", on_refs=lambda ref: {})
+        assert len(os.listdir(cache_dir)) == 1
+
+        # unreadable entries are reloaded and replaced
+        [cache_file] = os.listdir(cache_dir)
+        with open(os.path.join(cache_dir, cache_file), "wb") as f:
+            f.write(b"not a pickle")
+        schema_registry.clear()
+        assert load_and_validate_schema("sample.json") == schema
+        schema_registry.clear()
+        with monkeypatch.context() as m:
+            m.setattr(json_validation, "_load_dont_validate_schema", None)
+            assert load_and_validate_schema("sample.json") == schema
+    finally:
+        set_schema_cache_dir(None)
+        schema_registry.clear()
+
+
+def test_schema_registry():
+    """Check that the schema registry evicts, counts and clears cached schemas"""
+    registry = SchemaRegistry(maxsize=2, preload_templates=False)
+    sample = registry.get("sample.json")
+    assert registry.get("sample.json") is sample
+    assert registry.get("participant.json") == load_and_validate_schema(
+        "participant.json"
+    )
+    assert registry.stats() == (1, 2, 0, 2, 2)
+
+    # the least recently used schema is evicted
+    registry.get("sample.json")
+    registry.get("aliquot.json")
+    assert registry.stats() == (2, 3, 1, 2, 2)
+    assert registry.get("sample.json") is sample
+    registry.get("participant.json")
+    assert registry.stats() == (3, 4, 2, 2, 2)
+
+    validator = registry.get_validator("sample.json")
+    assert validator.schema is sample
+    assert registry.get_validator("sample.json") is validator
+
+    # template schemas don't pass the metaschema, so are loaded unvalidated
+    with pytest.raises(jsonschema.SchemaError):
+        registry.get("templates/manifests/pbmc_template.json")
+    assert (
+        "pbmc"
+        in registry.get("templates/manifests/pbmc_template.json", validate=False)[
+            "title"
+        ].lower()
+    )
+
+    dropped = []
+    registry.add_drop_callback(dropped.append)
+    registry.resize(1)
+    assert registry.stats().size == 1
+    assert dropped == [sample]
+
+    registry.clear()
+    assert registry.stats() == (0, 0, 0, 0, 1)
+    assert dropped == [sample, None]
+    assert registry.get("sample.json") is not sample
+
+    registry = SchemaRegistry(preload_schemas=["sample.json", "participant.json"])
+    registry.preload()
+    n_preloaded = registry.stats().misses
+    assert n_preloaded > 2
+    registry.get("sample.json")
+    registry.get("participant.json")
+    assert registry.stats().hits == 2
+
+    # schemas loaded with `on_refs` bypass the registry
+    stats = schema_registry.stats()
+    load_and_validate_schema("sample.json", on_refs=lambda ref: {})
+    assert schema_registry.stats() == stats
+
+
+def test_intern_schema():
+    """Check that identical schema nodes are interned as one read-only node"""
+    schema = {"a": {"x": [1]}, "b": {"x": [1]}, "c": {"x": [True]}, "d": {"y": [1]}}
+    interned = _intern_schema(copy.deepcopy(schema))
+    assert interned == schema
+    assert interned["a"] is interned["b"]
+    assert interned["a"] is _intern_schema({"x": [1]})
+    assert interned["c"] is not interned["a"]
+    assert interned["d"]["y"] is interned["a"]["x"]
+
+    with pytest.raises(TypeError, match="read-only"):
+        interned["a"]["x"] = []
+    with pytest.raises(TypeError, match="read-only"):
+        interned["a"]["x"].append(2)
+    with pytest.raises(TypeError, match="read-only"):
+        interned.update({"e": {}})
+
+    # copies are plain, mutable containers
+    for copied in [
+        dict(interned),
+        copy.copy(interned),
+        copy.deepcopy(interned),
+        pickle.loads(pickle.dumps(interned)),
+    ]:
+        assert copied == schema
+        assert type(copied) is dict
+        copied["e"] = {}
+    assert type(copy.deepcopy(interned)["a"]["x"]) is list
+    assert json.loads(json.dumps(interned)) == schema
+
+
+def test_schema_interning():
+    """Check that loaded schemas can share identical subschemas"""
+    schema = load_and_validate_schema("clinical_trial.json")
+
+    set_schema_interning(True)
+    try:
+        interned = load_and_validate_schema("clinical_trial.json")
+        assert interned == schema
+
+        # every $ref to sample.json shares one copy of it
+        sample = load_and_validate_schema("sample.json")
+        participant = interned["properties"]["participants"]["items"]
+        assert participant["properties"]["samples"]["items"] is sample
+        with pytest.raises(TypeError, match="read-only"):
+            sample["title"] = "foo"
+
+        validator = load_and_validate_schema("sample.json", return_validator=True)
+        assert validator.schema is sample
+        assert not validator.is_valid({})
+    finally:
+        set_schema_interning(False)
+    assert type(load_and_validate_schema("sample.json")) is dict
+
+
+def test_schema_interning_memory(benchmark):
+    """Memory held by the clinical trial schema and some templates, with and without interning"""
+    code = (
+        "import tracemalloc\n"
+        "from cidc_schemas.json_validation import load_and_validate_schema, set_schema_interning\n"
+        "from cidc_schemas.template import Template\n"
+        "set_schema_interning({interned})\n"
+        "tracemalloc.start()\n"
+        "load_and_validate_schema('clinical_trial.json', return_validator=True)\n"
+        "templates = [Template.from_type(t) for t in ('pbmc', 'wes_fastq', 'olink')]\n"
+        "print(tracemalloc.get_traced_memory()[0] / 2**20)"
+    )
+
+    def load(interned: bool) -> float:
+        result = subprocess.run(
+            [sys.executable, "-c", code.format(interned=interned)],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return float(result.stdout)
+
+    copied_mb = load(False)
+    interned_mb = benchmark.pedantic(load, args=(True,), rounds=1)
+    benchmark.extra_info["copied_memory_mb"] = copied_mb
+    benchmark.extra_info["interned_memory_mb"] = interned_mb
+    assert interned_mb < copied_mb
+
+
+@pytest.mark.parametrize("cache", ["cold", "warm"])
+def test_load_ct_schema_startup_speed(benchmark, tmp_path, cache):
+    """Time a new process loading the clinical trial validator, with and without a schema cache"""
+    cache_dir = str(tmp_path / "schemas")
+    code = (
+        "from cidc_schemas.json_validation import load_and_validate_schema, set_schema_cache_dir\n"
+        f"set_schema_cache_dir({cache_dir!r})\n"
+        "load_and_validate_schema('clinical_trial.json', return_validator=True)"
+    )
+
+    def load():
+        subprocess.run([sys.executable, "-c", code], cwd=ROOT_DIR, check=True)
+
+    def setup():
+        if cache == "cold":
+            for fname in os.listdir(cache_dir):
+                os.remove(os.path.join(cache_dir, fname))
+
+    load()
+    assert len(os.listdir(cache_dir)) == 1
+    benchmark.pedantic(load, setup=setup, rounds=3)
+
+
 def test_validator_speed(benchmark):
     """Basic referential integrity validation speed test"""
     v = _Validator(
@@ -4,13 +4,20 @@
 
 from deepdiff import DeepDiff
 import json
+import logging
 import os
 import pytest
 
 from cidc_schemas.constants import SCHEMA_DIR, TEMPLATE_DIR
 from cidc_schemas.prism import InvalidMergeTargetException
-from cidc_schemas.json_validation import _load_dont_validate_schema
+from cidc_schemas import json_validation
+from cidc_schemas.json_validation import (
+    _load_dont_validate_schema,
+    schema_registry,
+    set_schema_cache_dir,
+)
 
+from cidc_schemas import template as template_module
 from cidc_schemas.template import (
     Template,
     generate_empty_template,
@@ -19,6 +26,8 @@ from cidc_schemas.template import (
     AtomicChange,
     _FieldDef,
     _get_facet_group,
+    _compile_parse_through,
+    _eval_template_lambda,
     _convert_api_to_template,
     _first_in_context,
     generate_analysis_template_schemas,
@@ -246,6 +255,44 @@ def test_field_def_process_value():
     assert files[0].gs_key == "foo.bar"
 
 
+def test_field_def_compile_expressions(caplog):
+    """Check that field expressions are compiled once, and invalid ones are reported"""
+    fmt = "lambda val, ctx: ctx['folder'] + val"
+    check_errors = "lambda val: 'bad' if val.startswith('bad') else None"
+    fd = _FieldDef(
+        key_name="prop",
+        coerce=str,
+        merge_pointer="/prop",
+        parse_through="lambda val: folder + val",
+        gcs_uri_format={"format": fmt, "check_errors": check_errors},
+        is_artifact=1,
+    )
+    fd.compile_expressions()
+    assert _eval_template_lambda(fmt) is _eval_template_lambda(fmt)
+    assert _compile_parse_through.cache_info().currsize > 0
+
+    # parse_through lambdas still see the format context
+    changes, files = fd.process_value("a", {"folder": "dir/"}, {})
+    assert files[0].gs_key == "dir/dir/a"
+
+    with pytest.raises(ParsingException, match="bad"):
+        fd.process_value("bad", {"folder": ""}, {})
+
+    # invalid expressions are logged when the template is loaded,
+    # and fail when values are processed
+    fd = fd._replace(parse_through="lambda val: (")
+    with caplog.at_level(logging.WARNING):
+        fd.compile_expressions()
+    assert "Invalid expression for 'prop': 'lambda val: ('" in caplog.text
+    with pytest.raises(ParsingException, match="Cannot extract"):
+        fd.process_value("a", {}, {})
+
+    # other errors aren't swallowed
+    fd = fd._replace(parse_through=None, gcs_uri_format="{")
+    with pytest.raises(ValueError):
+        fd.compile_expressions()
+
+
 def test_get_facet_group():
     """Check that the _get_facet_group helper function produces facet groups as expected"""
     test_lambda = "lambda val, ctx: '/some/' + str(ctx['foo']) + '/' + val + '_bar.csv'"
@@ -266,6 +313,61 @@ def test_from_type():
         Template.from_type("foo")
 
 
+def test_from_type_registry(monkeypatch, tmp_path):
+    """Check that templates are loaded once per process and their schemas can be cached on disk"""
+    monkeypatch.setattr(template_module, "_TEMPLATE_REGISTRY", {})
+
+    pbmc = Template.from_type("pbmc")
+    assert Template.from_type("pbmc") is pbmc
+
+    cache_dir = str(tmp_path / "schemas")
+    set_schema_cache_dir(cache_dir)
+    try:
+        schema_registry.clear()
+        Template.from_type("pbmc")
+        assert len(os.listdir(cache_dir)) == 1
+
+        # templates loaded from the on-disk cache match those loaded from scratch,
+        # and still go through the schema registry
+        schema_registry.clear()
+        monkeypatch.setattr(json_validation, "_load_dont_validate_schema", None)
+        cached_pbmc = Template.from_type("pbmc")
+        assert cached_pbmc is not pbmc
+        assert cached_pbmc.schema == pbmc.schema
+        assert cached_pbmc.key_lu.keys() == pbmc.key_lu.keys()
+        schema_path = template_module._get_template_path_map()["pbmc"]
+        assert schema_registry.get(schema_path, validate=False) is cached_pbmc.schema
+    finally:
+        set_schema_cache_dir(None)
+        schema_registry.clear()
+
+
+def test_from_type_registry_drop(monkeypatch):
+    """Check that templates are dropped along with their schemas"""
+    monkeypatch.setattr(template_module, "_TEMPLATE_REGISTRY", {})
+
+    Template.from_type("pbmc")
+    schema_registry.clear()
+    assert template_module._TEMPLATE_REGISTRY == {}
+
+    maxsize = schema_registry.stats().maxsize
+    try:
+        pbmc = Template.from_type("pbmc")
+        wes = Template.from_type("wes_fastq")
+        schema_registry.resize(1)
+        assert template_module._TEMPLATE_REGISTRY == {"wes_fastq": wes}
+        assert Template.from_type("pbmc") is not pbmc
+    finally:
+        schema_registry.resize(maxsize)
+
+
+def test_from_type_speed(benchmark):
+    def load():
+        Template.from_type("pbmc")
+
+    benchmark.pedantic(load, rounds=3)
+
+
 def test_worksheet_validation():
     """Check validation errors on invalid worksheets"""
 
@@ -4,12 +4,14 @@
 """Tests for `cidc_template_reader.template_reader` module."""
 
 import os
+import glob
 import pytest
 from typing import List
 from openpyxl import Workbook
 
 from cidc_schemas.template_reader import XlTemplateReader, ValidationError, TemplateRow
 from cidc_schemas.template_writer import RowType
+from cidc_schemas.json_validation import validate_instance
 
 from .constants import TEMPLATE_EXAMPLES_DIR, TEST_DATA_DIR
 
@@ -198,6 +200,44 @@ def test_missing_row_type(tmp_path):
         XlTemplateReader.from_excel(path)
 
 
+def test_read_only_from_excel():
+    """Test that streaming and fully loading a workbook produce the same output"""
+
+    def read(path, read_only):
+        try:
+            reader, errs = XlTemplateReader.from_excel(path, read_only=read_only)
+            return reader.template, errs
+        except ValidationError as e:
+            return str(e)
+
+    paths = glob.glob(os.path.join(TEMPLATE_EXAMPLES_DIR, "**/*.xlsx"), recursive=True)
+    paths += glob.glob(os.path.join(TEST_DATA_DIR, "*.xlsx"))
+    assert paths
+    for path in paths:
+        assert read(path, True) == read(path, False), path
+
+
+def test_read_only_from_excel_stale_dimensions(
+    tiny_template, tmp_path, understate_dimensions
+):
+    """Check that streamed worksheets aren't cut short by a stale stored dimension"""
+    path = str(tmp_path / "stale.xlsx")
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "TEST_SHEET"
+    ws.append(["#preamble", "test_property", "foo"])
+    ws.append(["#header", "test_property", "test_number"])
+    for i in range(5):
+        ws.append(["#data", f"foo {i}", i])
+    wb.save(path)
+    understate_dimensions(path)
+
+    loaded, _ = XlTemplateReader.from_excel(path, read_only=False)
+    streamed, _ = XlTemplateReader.from_excel(path)
+    assert len(loaded.template["TEST_SHEET"]) == 7
+    assert streamed.template == loaded.template
+
+
 def test_pbmc_validation(pbmc_template):
     """Test that the provided pbmc shipping manifest is valid"""
 
@@ -211,3 +251,72 @@ def test_pbmc_invalidation(pbmc_template):
     pbmc_xlsx_path = os.path.join(TEST_DATA_DIR, "pbmc_invalid.xlsx")
     with pytest.raises(ValidationError):
         pbmc_template.validate_excel(pbmc_xlsx_path)
+
+
+def _cells_to_validate(template, n_rows: int = 2000) -> list:
+    """Build (field schema, value) pairs like those found in a large manifest."""
+    schemas = template.worksheets["TEST_SHEET"]["data_columns"]["first table"]
+    row = [
+        ("test_property", "foo"),
+        ("test_number", "4.11"),
+        ("test_enum", "enum_val_1"),
+    ]
+    return [(schemas[field], value) for _ in range(n_rows) for field, value in row]
+
+
+def test_validate_cells_uncompiled_speed(benchmark, tiny_template):
+    """Cell validation speed when checking the schema for every cell, as a baseline"""
+    cells = _cells_to_validate(tiny_template)
+
+    def validate_cells():
+        for schema, value in cells:
+            assert validate_instance(value, schema, is_required=True) is None
+
+    benchmark.pedantic(validate_cells, rounds=3)
+    if benchmark.stats:
+        benchmark.extra_info["cells_per_second"] = (
+            len(cells) / benchmark.stats.stats.mean
+        )
+
+
+def test_validate_cells_compiled_speed(benchmark, tiny_template):
+    """Cell validation speed with the validators cached on the template"""
+    cells = _cells_to_validate(tiny_template)
+
+    def validate_cells():
+        for schema, value in cells:
+            assert tiny_template.get_cell_validator(schema)(value, True) is None
+
+    benchmark.pedantic(validate_cells, rounds=3)
+    if benchmark.stats:
+        benchmark.extra_info["cells_per_second"] = (
+            len(cells) / benchmark.stats.stats.mean
+        )
+
+
+@pytest.fixture(scope="module")
+def large_manifest(tmp_path_factory):
+    """A synthetic 20k-row manifest for the tiny template"""
+    path = tmp_path_factory.mktemp("large_manifest") / "large_manifest.xlsx"
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("TEST_SHEET")
+    ws.append(["#preamble", "test_property", "foo"])
+    ws.append(["#preamble", "test_date", "6/11/12"])
+    ws.append(["#header", "test_property", "test_date", "test_time", "test_number"])
+    for i in range(20000):
+        ws.append(["#data", f"foo {i}", "6/11/12", "10:45:01", i])
+    wb.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize("read_only", [True, False], ids=["streamed", "loaded"])
+def test_from_excel_memory(benchmark, record_peak_memory, large_manifest, read_only):
+    """Time and peak memory use of loading a large manifest"""
+
+    def load():
+        reader, errs = XlTemplateReader.from_excel(large_manifest, read_only)
+        assert not errs
+        assert len(reader.template["TEST_SHEET"]) == 20003
+
+    benchmark.pedantic(load, rounds=3)
+    record_peak_memory(load)
@@ -1,16 +1,27 @@
 import os
 import json
 from io import BytesIO, StringIO
+import asyncio
 import csv
+import random
+import sys
+import time
+from typing import Optional
 import pandas as pd
 
 import pytest
 
+from cidc_schemas import unprism
 from cidc_schemas.unprism import (
     _build_artifact,
     derive_files,
+    derive_files_async,
     DeriveFilesContext,
+    DeriveFilesResult,
     Artifact,
+    ArtifactFetchError,
+    ParsedArtifactCache,
+    DirectoryArtifactCache,
 )
 from cidc_schemas.prism import PROTOCOL_ID_FIELD_NAME, SUPPORTED_SHIPPING_MANIFESTS
 from cidc_schemas.util import participant_id_from_cimac
@@ -20,12 +31,40 @@ ct_example_path = os.path.join(
 )
 
 
+def read_data(artifact: Artifact) -> str:
+    """Get an artifact's data, whether or not it was streamed"""
+    if isinstance(artifact.data, (str, bytes)):
+        return artifact.data
+    with artifact.data as f:
+        return f.read()
+
+
 @pytest.fixture
 def ct():
     with open(ct_example_path, "r") as ct:
         yield json.load(ct)
 
 
+@pytest.fixture
+def wes_trial():
+    """Build a partial clinical trial with a WES pair run for each given MAF url"""
+
+    def build(urls):
+        return {
+            PROTOCOL_ID_FIELD_NAME: "test-trial",
+            "analysis": {
+                "wes_analysis": {
+                    "pair_runs": [
+                        {"somatic": {"maf_tnscope_filter": {"object_url": url}}}
+                        for url in urls
+                    ]
+                }
+            },
+        }
+
+    return build
+
+
 def test_build_artifact():
     """Check that the artifact building helper works as expected"""
     trial_id = "test-trial"
@@ -89,6 +128,59 @@ def test_derive_files_shipping_manifest(ct, upload_type):
     ]
 
 
+def test_derive_files_shipping_manifest_layout():
+    """Check that participants and samples CSVs have schema-ordered, typed columns"""
+    ct = {
+        PROTOCOL_ID_FIELD_NAME: "test-trial",
+        "participants": [
+            {
+                "cohort_name": "Arm_Z",
+                "cimac_participant_id": "CTTTPP1",
+                "not_in_schema": {"nested": 1},
+                "samples": [
+                    {"shipping_entry_number": 1, "cimac_id": "CTTTPP1S1.00"},
+                    {"cimac_id": "CTTTPP1S2.00", "material_used": 1.5},
+                ],
+            },
+            {"cimac_participant_id": "CTTTPP2", "participant_id": "PA.2"},
+        ],
+    }
+    upload_type = SUPPORTED_SHIPPING_MANIFESTS[0]
+    result = derive_files(DeriveFilesContext(ct, upload_type, None))
+    participants, samples = [a.data for a in result.artifacts]
+    assert participants == (
+        f"cimac_participant_id,participant_id,cohort_name,not_in_schema.nested,{PROTOCOL_ID_FIELD_NAME}\n"
+        "CTTTPP1,,Arm_Z,1,test-trial\n"
+        "CTTTPP2,PA.2,,,test-trial\n"
+    )
+    # integers stay integers, even when some are missing
+    assert samples == (
+        f"cimac_id,shipping_entry_number,material_used,{PROTOCOL_ID_FIELD_NAME},participants.cimac_participant_id\n"
+        "CTTTPP1S1.00,1,,test-trial,CTTTPP1\n"
+        "CTTTPP1S2.00,,1.5,test-trial,CTTTPP1\n"
+    )
+
+
+def test_derive_files_shipping_manifest_speed(benchmark, record_peak_memory):
+    """Time and peak memory use of deriving participants and samples CSVs for 50k samples"""
+    ct = load_ct_example("CT_1")
+    participant = ct["participants"][0]
+    sample = participant["samples"][0]
+    ct["participants"] = [
+        dict(
+            participant,
+            cimac_participant_id=f"CTT{i:04d}",
+            samples=[dict(sample, cimac_id=f"CTT{i:04d}S{j}.00") for j in range(10)],
+        )
+        for i in range(5000)
+    ]
+    context = DeriveFilesContext(ct, SUPPORTED_SHIPPING_MANIFESTS[0], None)
+
+    result = benchmark.pedantic(derive_files, args=(context,), rounds=3)
+    assert result.artifacts[1].data.count("\n") == 50001
+    record_peak_memory(lambda: derive_files(context))
+
+
 def test_derive_files_IHC():
     """Check that IHC CSV is derived as expected."""
 
@@ -126,7 +218,8 @@ def test_derive_files_IHC():
     assert recs == true_recs
 
 
-def test_derive_files_olink():
+@pytest.mark.parametrize("stream", [False, True])
+def test_derive_files_olink(stream):
     partial_ct = {
         PROTOCOL_ID_FIELD_NAME: "test-trial",
         "assays": {
@@ -177,22 +270,33 @@ def test_derive_files_olink():
             df.to_excel(writer, sheet_name="NPX Data", index=False)
         return buff
 
-    result = derive_files(DeriveFilesContext(partial_ct, "olink", fetch_artifact))
+    result = derive_files(
+        DeriveFilesContext(partial_ct, "olink", fetch_artifact, stream=stream)
+    )
     assert len(result.artifacts) == 1
-    assert result.artifacts[0].data == (columns_after + cimac1_after + cimac2_after)
+    assert read_data(result.artifacts[0]) == (
+        columns_after + cimac1_after + cimac2_after
+    )
 
     del partial_ct["assays"]["olink"]["study"]
-    result = derive_files(DeriveFilesContext(partial_ct, "olink", fetch_artifact))
+    result = derive_files(
+        DeriveFilesContext(partial_ct, "olink", fetch_artifact, stream=stream)
+    )
     assert len(result.artifacts) == 1
-    assert result.artifacts[0].data == (columns_after + cimac1_after)
+    assert read_data(result.artifacts[0]) == (columns_after + cimac1_after)
 
     del partial_ct["assays"]["olink"]["batches"][0]["combined"]
-    result = derive_files(DeriveFilesContext(partial_ct, "olink", fetch_artifact))
+    result = derive_files(
+        DeriveFilesContext(partial_ct, "olink", fetch_artifact, stream=stream)
+    )
     assert len(result.artifacts) == 1
-    assert result.artifacts[0].data == (columns_after + cimac1_after + cimac2_after)
+    assert read_data(result.artifacts[0]) == (
+        columns_after + cimac1_after + cimac2_after
+    )
 
 
-def test_derive_files_wes_analysis():
+@pytest.mark.parametrize("stream", [False, True])
+def test_derive_files_wes_analysis(stream):
     """Check that combined MAF is derived as expected"""
     url1 = "a"
     url2 = "b"
@@ -221,7 +325,9 @@ def test_derive_files_wes_analysis():
         else:
             return StringIO(version + headers + maf2)
 
-    context = DeriveFilesContext(partial_ct, "wes_analysis", fetch_artifact)
+    context = DeriveFilesContext(
+        partial_ct, "wes_analysis", fetch_artifact, stream=stream
+    )
     result = derive_files(context)
 
     assert result.trial_metadata == partial_ct
@@ -231,7 +337,358 @@ def test_derive_files_wes_analysis():
 
     assert combined_maf.data_format == "maf"
     assert combined_maf.file_type == "combined maf"
-    assert combined_maf.data == headers + maf1 + maf2
+    assert read_data(combined_maf) == headers + maf1 + maf2
+
+
+def test_derive_files_parallel_fetch(wes_trial):
+    """Check that fetching artifacts in parallel keeps results in order and reports failures"""
+    urls = [f"maf{i}" for i in range(20)]
+    partial_ct = wes_trial(urls)
+
+    headers = "col1\tcol2\n"
+
+    def fetch_artifact(url: str, as_string: bool) -> StringIO:
+        # finish out of order
+        time.sleep(random.random() / 100)
+        if url == "broken":
+            raise ValueError("download failed")
+        return StringIO(f"#version 1.0\n{headers}{url}\tb\n")
+
+    serial = derive_files(
+        DeriveFilesContext(partial_ct, "wes_analysis", fetch_artifact, max_workers=None)
+    )
+    parallel = derive_files(
+        DeriveFilesContext(partial_ct, "wes_analysis", fetch_artifact, max_workers=8)
+    )
+    assert serial.artifacts[0].data == parallel.artifacts[0].data
+
+    partial_ct["analysis"]["wes_analysis"]["pair_runs"].append(
+        {"somatic": {"maf_tnscope_filter": {"object_url": "broken"}}}
+    )
+    for max_workers in [None, 8]:
+        with pytest.raises(
+            ArtifactFetchError,
+            match="Failed to fetch and parse broken: download failed",
+        ) as e:
+            derive_files(
+                DeriveFilesContext(
+                    partial_ct, "wes_analysis", fetch_artifact, max_workers
+                )
+            )
+        assert e.value.object_url == "broken"
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_derive_files_artifact_cache(wes_trial, stream, tmpdir):
+    """Check that cached artifacts are only fetched when they're new or changed"""
+    partial_ct = wes_trial(["a", "b", "c"])
+    pair_runs = partial_ct["analysis"]["wes_analysis"]["pair_runs"]
+    # artifacts without hashes ("c") can't be cached
+    for run in pair_runs[:2]:
+        maf = run["somatic"]["maf_tnscope_filter"]
+        maf["crc32c_hash"] = f"{maf['object_url']}-hash"
+
+    fetched = []
+
+    def fetch_artifact(url: str, as_string: bool) -> StringIO:
+        fetched.append(url)
+        return StringIO(f"#version 1.0\ncol1\tcol2\n{url}\tx\n")
+
+    def derive(cache):
+        fetched.clear()
+        result = derive_files(
+            DeriveFilesContext(
+                partial_ct,
+                "wes_analysis",
+                fetch_artifact,
+                stream=stream,
+                artifact_cache=cache,
+            )
+        )
+        return read_data(result.artifacts[0])
+
+    cache = ParsedArtifactCache()
+    uncached = derive(None)
+    assert derive(cache) == uncached
+    assert fetched == ["a", "b", "c"]
+    assert (cache.hits, cache.misses) == (0, 2)
+
+    assert derive(cache) == uncached
+    assert fetched == ["c"]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+    pair_runs[1]["somatic"]["maf_tnscope_filter"]["crc32c_hash"] = "new-hash"
+    derive(cache)
+    assert fetched == ["b", "c"]
+    assert (cache.hits, cache.misses) == (3, 3)
+
+    # the directory cache persists across instances
+    cache_dir = str(tmpdir.join("cache"))
+    assert derive(DirectoryArtifactCache(cache_dir)) == uncached
+    assert fetched == ["a", "b", "c"]
+    cache = DirectoryArtifactCache(cache_dir)
+    assert derive(cache) == uncached
+    assert fetched == ["c"]
+    assert (cache.hits, cache.misses) == (2, 0)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_derive_files_artifact_cache_not_found(wes_trial, stream, tmpdir):
+    """Check that artifacts that weren't found aren't cached"""
+    partial_ct = wes_trial(["a", "b"])
+    for run in partial_ct["analysis"]["wes_analysis"]["pair_runs"]:
+        maf = run["somatic"]["maf_tnscope_filter"]
+        maf["crc32c_hash"] = f"{maf['object_url']}-hash"
+
+    uploaded = {"a"}
+
+    def fetch_artifact(url: str, as_string: bool) -> Optional[StringIO]:
+        if url in uploaded:
+            return StringIO(f"#version 1.0\ncol1\tcol2\n{url}\tx\n")
+        return None
+
+    def derive():
+        result = derive_files(
+            DeriveFilesContext(
+                partial_ct,
+                "wes_analysis",
+                fetch_artifact,
+                stream=stream,
+                artifact_cache=DirectoryArtifactCache(str(tmpdir)),
+            )
+        )
+        return read_data(result.artifacts[0])
+
+    assert derive() == "col1\tcol2\na\tx\n"
+    assert len(tmpdir.listdir()) == 1
+
+    uploaded.add("b")
+    assert derive() == "col1\tcol2\na\tx\nb\tx\n"
+    assert len(tmpdir.listdir()) == 2
+
+
+def test_parsed_artifact_cache_eviction(tmpdir):
+    """Check that parsed artifact caches evict the least recently used artifacts"""
+    cache = ParsedArtifactCache(max_size=2)
+    cache.get_or_parse("a", lambda: 1)
+    cache.get_or_parse("b", lambda: 2)
+    assert cache.get_or_parse("a", lambda: -1) == 1
+    cache.get_or_parse("c", lambda: 3)
+    assert cache.get_or_parse("b", lambda: -2) == -2
+    assert cache.get_or_parse("a", lambda: -1) == -1
+    assert (cache.hits, cache.misses) == (1, 5)
+
+    value = "x" * 1000
+    cache = DirectoryArtifactCache(str(tmpdir), max_size=2500)
+    for key in "abc":
+        cache.get_or_parse(key, lambda: value)
+    assert len(tmpdir.listdir()) == 2
+
+    # a smaller limit evicts cached artifacts from an existing directory,
+    # least recently used first
+    now = time.time()
+    os.utime(tmpdir.join("b.pickle"), (now - 10, now - 10))
+    cache = DirectoryArtifactCache(str(tmpdir), max_size=1500)
+    assert len(tmpdir.listdir()) == 1
+    assert cache.get_or_parse("c", lambda: None) == value
+
+
+def test_directory_artifact_cache_unreadable(tmpdir, caplog):
+    """Check that unreadable cached artifacts are parsed again"""
+    cache = DirectoryArtifactCache(str(tmpdir))
+    cache.get_or_parse("a", lambda: "value")
+    cache.get_or_parse("b", lambda: "value")
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["a.pickle", "b.pickle"]
+
+    # a truncated artifact
+    tmpdir.join("a.pickle").write_binary(b"\x80")
+    assert cache.get_or_parse("a", lambda: "reparsed") == "reparsed"
+    assert "Ignoring unreadable cached artifact" in caplog.text
+    assert cache.get_or_parse("a", lambda: None) == "reparsed"
+
+    # a vanished artifact
+    tmpdir.join("b.pickle").remove()
+    assert cache.get_or_parse("b", lambda: "reparsed") == "reparsed"
+    assert (cache.hits, cache.misses) == (1, 4)
+    assert sorted(f.basename for f in tmpdir.listdir()) == ["a.pickle", "b.pickle"]
+
+
+def test_derive_files_async(wes_trial):
+    """Check that derive_files_async fetches concurrently and derives the same files"""
+    urls = [f"maf{i}" for i in range(20)]
+    partial_ct = wes_trial(urls)
+
+    def fetch_artifact(url: str, as_string: bool) -> StringIO:
+        if url == "broken":
+            raise ValueError("download failed")
+        return StringIO(f"#version 1.0\ncol1\tcol2\n{url}\tb\n")
+
+    in_flight = 0
+    max_in_flight = 0
+
+    async def fetch_artifact_async(url: str, as_string: bool) -> StringIO:
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(random.random() / 100)
+        in_flight -= 1
+        return fetch_artifact(url, as_string)
+
+    expected = derive_files(
+        DeriveFilesContext(partial_ct, "wes_analysis", fetch_artifact)
+    )
+    result = asyncio.run(
+        derive_files_async(
+            DeriveFilesContext(partial_ct, "wes_analysis", fetch_artifact_async),
+            max_concurrency=4,
+        )
+    )
+    assert result == expected
+    assert 1 < max_in_flight <= 4
+
+    # derivations that don't fetch anything work too
+    ct = load_ct_example("CT_1")
+    upload_type = SUPPORTED_SHIPPING_MANIFESTS[0]
+    assert asyncio.run(
+        derive_files_async(DeriveFilesContext(ct, upload_type, fetch_artifact_async))
+    ) == derive_files(DeriveFilesContext(ct, upload_type, fetch_artifact))
+
+    partial_ct["analysis"]["wes_analysis"]["pair_runs"].append(
+        {"somatic": {"maf_tnscope_filter": {"object_url": "broken"}}}
+    )
+    with pytest.raises(ArtifactFetchError, match="broken: download failed"):
+        asyncio.run(
+            derive_files_async(
+                DeriveFilesContext(partial_ct, "wes_analysis", fetch_artifact_async)
+            )
+        )
+
+
+def test_derive_files_output_format_validation(ct):
+    """Check that derive_files rejects unknown output formats"""
+    upload_type = SUPPORTED_SHIPPING_MANIFESTS[0]
+    with pytest.raises(ValueError, match="Unsupported output_format 'xlsx'"):
+        derive_files(DeriveFilesContext(ct, upload_type, None, output_format="xlsx"))
+
+
+def test_derive_files_output_format_without_pyarrow(ct, monkeypatch):
+    """Check that derive_files explains that it needs pyarrow for columnar formats"""
+    upload_type = SUPPORTED_SHIPPING_MANIFESTS[0]
+    # make importing pyarrow fail, whether or not it's installed
+    monkeypatch.setitem(sys.modules, "pyarrow", None)
+    with pytest.raises(ImportError, match="pyarrow is required"):
+        derive_files(DeriveFilesContext(ct, upload_type, None, output_format="parquet"))
+
+
+def read_table(artifact: Artifact):
+    """Read a Parquet or Arrow IPC artifact into a pyarrow Table"""
+    import pyarrow.ipc
+    import pyarrow.parquet
+
+    data = read_data(artifact)
+    if artifact.data_format == "parquet":
+        return pyarrow.parquet.read_table(BytesIO(data))
+    return pyarrow.ipc.open_file(BytesIO(data)).read_all()
+
+
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_derive_files_columnar_shipping_manifest(ct, output_format):
+    """Check that columnar shipping manifest derivations have schema-based types"""
+    pa = pytest.importorskip("pyarrow")
+    upload_type = SUPPORTED_SHIPPING_MANIFESTS[0]
+    csv_result = derive_files(DeriveFilesContext(ct, upload_type, None))
+    result = derive_files(
+        DeriveFilesContext(ct, upload_type, None, output_format=output_format)
+    )
+
+    for csv_artifact, artifact in zip(csv_result.artifacts, result.artifacts):
+        assert artifact.object_url == csv_artifact.object_url.replace(
+            ".csv", f".{output_format}"
+        )
+        assert artifact.data_format == output_format
+        assert artifact.file_type == csv_artifact.file_type
+
+        table = read_table(artifact)
+        expected = pd.read_csv(StringIO(csv_artifact.data))
+        assert table.column_names == list(expected.columns)
+        assert table.num_rows == len(expected)
+        assert table.schema.field(PROTOCOL_ID_FIELD_NAME).type == pa.string()
+
+    samples = read_table(result.artifacts[1])
+    assert samples.schema.field("cimac_id").type == pa.string()
+    assert samples.schema.field("parent_sample_id").type == pa.string()
+    # a "number" in the schema, even though all the values are integers
+    assert samples.schema.field("material_used").type == pa.float64()
+
+
+@pytest.mark.parametrize("stream", [False, True])
+@pytest.mark.parametrize("output_format", ["parquet", "arrow"])
+def test_derive_files_columnar_wes_analysis(wes_trial, stream, output_format):
+    """Check that combined MAFs can be derived as columnar files"""
+    pytest.importorskip("pyarrow")
+    partial_ct = wes_trial(["a", "b"])
+
+    def fetch_artifact(url: str, as_string: bool) -> StringIO:
+        return StringIO(f"#version 1.0\ncol1\tcol2\n{url}\t1\n")
+
+    result = derive_files(
+        DeriveFilesContext(
+            partial_ct,
+            "wes_analysis",
+            fetch_artifact,
+            stream=stream,
+            output_format=output_format,
+        )
+    )
+    artifact = result.artifacts[0]
+    assert artifact.object_url == f"test-trial/wes_analysis/combined.{output_format}"
+    table = read_table(artifact)
+    assert table.column("col1").to_pylist() == ["a", "b"]
+    # streamed tables aren't type-inferred
+    assert table.column("col2").to_pylist() == (["1", "1"] if stream else [1, 1])
+
+
+def test_derive_files_columnar_olink():
+    """Check that NPX files keep their analyte metadata as columnar files"""
+    pa = pytest.importorskip("pyarrow")
+    trial_id = "test-trial"
+    partial_ct = {
+        PROTOCOL_ID_FIELD_NAME: trial_id,
+        "assays": {"olink": {"study": {"npx_file": {"object_url": "foo"}}}},
+    }
+    npx_csv = (
+        "Assay,IL8,IL6\nUniprot ID,P10145,P05231\nOlink ID,OID00752,OID00753\n"
+        "LOD,1.15432,0.5\nCNNNNNNNN.01,8.14109,2.5\n"
+    )
+
+    def derive_npx_csv(context):
+        return DeriveFilesResult(
+            [
+                unprism._build_artifact(
+                    context,
+                    "all_samples_npx.study_wide.csv",
+                    npx_csv,
+                    "csv",
+                    "npx|analysis_ready",
+                    include_upload_type=True,
+                )
+            ],
+            context.trial_metadata,
+        )
+
+    artifact = unprism._convert_artifact(
+        derive_npx_csv(DeriveFilesContext(partial_ct, "olink", None)).artifacts[0],
+        "parquet",
+    )
+    table = read_table(artifact)
+    assert table.column_names == ["cimac_id", "IL8", "IL6"]
+    assert table.column("IL8").to_pylist() == [8.14109]
+    assert table.schema.field("IL8").type == pa.float64()
+    assert table.schema.field("IL8").metadata == {
+        b"Uniprot ID": b"P10145",
+        b"Olink ID": b"OID00752",
+        b"LOD": b"1.15432",
+    }
 
 
 def load_ct_example(name: str) -> dict:
@@ -244,7 +701,8 @@ def load_ct_example(name: str) -> dict:
         return json.load(f)
 
 
-def test_derive_files_CyTOF_analysis():
+@pytest.mark.parametrize("stream", [False, True])
+def test_derive_files_CyTOF_analysis(stream):
     """Check that CyTOF analysis CSV is derived as expected."""
 
     ct = load_ct_example("CT_cytof_with_analysis")
@@ -269,7 +727,9 @@ def test_derive_files_CyTOF_analysis():
                 return StringIO(csv)
         raise Exception(f"Unknown file for url {url}")
 
-    result = derive_files(DeriveFilesContext(ct, "cytof_analysis", fetch_artifact))
+    result = derive_files(
+        DeriveFilesContext(ct, "cytof_analysis", fetch_artifact, stream=stream)
+    )
     assert len(result.artifacts) == 3
 
     artifacts = {a.file_type.replace(" ", "_"): a for a in result.artifacts}
@@ -282,7 +742,7 @@ def test_derive_files_CyTOF_analysis():
 
         cimac_ids = sorted(["CTSTP01S2.01", "CTSTP01S1.01"])
 
-        dictreader = csv.DictReader(StringIO(artifact.data))
+        dictreader = csv.DictReader(StringIO(read_data(artifact)))
 
         recs = []
         for row in dictreader:
@@ -296,3 +756,83 @@ def test_derive_files_CyTOF_analysis():
         assert sorted([r["cimac_participant_id"] for r in recs]) == sorted(
             list(map(participant_id_from_cimac, cimac_ids))
         )
+
+
+def test_derive_files_CyTOF_analysis_speed(benchmark):
+    """Benchmark deriving combined CyTOF analysis CSVs for 2,000 records"""
+    kinds = [
+        "cell_counts_assignment",
+        "cell_counts_compartment",
+        "cell_counts_profiling",
+    ]
+    cimac_ids = [f"CTT{i // 10:04d}S{i % 10}.01" for i in range(2000)]
+    ct = {
+        PROTOCOL_ID_FIELD_NAME: "test-trial",
+        "assays": {
+            "cytof": [
+                {
+                    "records": [
+                        {
+                            "cimac_id": cimac_id,
+                            "output_files": {
+                                kind: {"object_url": f"{cimac_id}/{kind}.csv"}
+                                for kind in kinds
+                            },
+                        }
+                        for cimac_id in cimac_ids
+                    ]
+                }
+            ]
+        },
+    }
+
+    cell_subsets = [f"Cell Subset {i}" for i in range(20)]
+
+    def fetch_artifact(url: str, as_string: bool) -> StringIO:
+        csv = '"","CellSubset","N"\n'
+        csv += "\n".join(f'"{i}","{s}",{i}' for i, s in enumerate(cell_subsets))
+        return StringIO(csv)
+
+    result = benchmark.pedantic(
+        derive_files,
+        args=(DeriveFilesContext(ct, "cytof_analysis", fetch_artifact),),
+        rounds=1,
+    )
+    assert len(result.artifacts) == 3
+    for artifact in result.artifacts:
+        rows = list(csv.DictReader(StringIO(artifact.data)))
+        assert [r["cimac_id"] for r in rows] == cimac_ids
+        assert rows[-1]["Cell Subset 19"] == "19"
+
+
+@pytest.mark.parametrize("stream", [True, False], ids=["streamed", "in_memory"])
+def test_derive_files_wes_analysis_memory(
+    benchmark, record_peak_memory, wes_trial, monkeypatch, stream
+):
+    """Time and peak memory use of combining many MAF files"""
+    # so that streamed outputs don't fit in memory
+    monkeypatch.setattr(unprism, "_SPOOL_MAX_SIZE", 2**20)
+
+    urls = [f"maf{i}" for i in range(50)]
+    partial_ct = wes_trial(urls)
+    columns = [f"col{i}" for i in range(10)]
+    maf_body = "\t".join(columns) + "\n"
+    maf_body += "".join(
+        "\t".join(f"value {i} {c}" for c in columns) + "\n" for i in range(1000)
+    )
+
+    def fetch_artifact(url: str, as_string: bool) -> StringIO:
+        return StringIO(f"#version 1.0\n{maf_body}")
+
+    def derive():
+        result = derive_files(
+            DeriveFilesContext(
+                partial_ct, "wes_analysis", fetch_artifact, stream=stream
+            )
+        )
+        data = result.artifacts[0].data
+        if stream:
+            data.close()
+
+    benchmark.pedantic(derive, rounds=3)
+    record_peak_memory(derive)
@@ -60,6 +60,10 @@ def test_get_source():
     assert obj == util.get_source(hier, "root['p'][0]")[0]
     assert extra_md == {"p.id": "3"}
 
+    assert util.get_source(hier, ("p", 0, "a", 1, "id")) == util.get_source(
+        hier, "root['p'][0]['a'][1]['id']"
+    )
+
     with pytest.raises(ValueError, match=r"not found in"):
         util.get_source(hier, "root['q']")  # entry not in dict
     with pytest.raises(ValueError, match=r"not found in"):